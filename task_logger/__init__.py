@@ -1,7 +1,13 @@
 
 
 from data import CompoundDataSet, CompoundDataFile, SDFDataSet, read_dir, make_data_set
-from logger import JSONProgressLog, ProcessLogger, ProcessingAttempt, States
+from logger import JSONProgressLog, ProcessLogger, ProcessingAttempt, States, convert_log
 from interfaces import ProcessAttemptABC, ProcessLoggerABC
 from review import Reviewer, review, pluck
-from pa_exceptions import StopProcessingAttempt, AttemptAlreadyInProgress, AttemptPreviouslyCompleted, NonSuppressedError, AttemptCanceled
\ No newline at end of file
+from pa_exceptions import (
+    StopProcessingAttempt, AttemptAlreadyInProgress, AttemptPreviouslyCompleted,
+    NonSuppressedError, AttemptCanceled, AttemptTimedOut
+)
+from sqlite_log import SQLiteProgressLog, SQLiteProcessLogger
+from retry import RetryPolicy
+from leases import LeaseDirectory, node_id
@@ -0,0 +1,124 @@
+"""
+Resource accounting for ProcessLogger(resources=True).
+
+Each attempt records the resources its processing used, as numeric fields:
+
+    cpu_user, cpu_system: seconds of CPU time (resource.getrusage)
+    maxrss_delta: growth of the process's peak RSS, in kB - 0 when the
+        attempt stayed under an earlier peak of the same process
+    read_chars, write_chars: bytes read and written by system calls
+        (rchar and wchar of /proc/self/io) - including reads served from
+        the page cache, and NFS traffic.
+    read_bytes, write_bytes: bytes the process caused to be fetched from,
+        and sent to, the storage layer (read_bytes and write_bytes of
+        /proc/self/io) - 0 for reads served from the page cache.
+    The I/O fields are absent where /proc/self/io is not.
+
+Counters are per process. So attempts measured in map(processes=N)
+workers are accurate, while attempts running at once in threads each
+count the others' usage too.
+
+Totals over a log tell CPU-bound work (CPU seconds close to wall seconds,
+per worker) from I/O-bound work (CPU well below wall, and many bytes).
+"""
+import resource
+
+
+# Fields of /proc/self/io, and the record fields they are stored as
+IO_COUNTERS = (
+    ('rchar', 'read_chars'),
+    ('wchar', 'write_chars'),
+    ('read_bytes', 'read_bytes'),
+    ('write_bytes', 'write_bytes'),
+)
+FIELDS = ('cpu_user', 'cpu_system', 'maxrss_delta') + tuple(
+    field for counter, field in IO_COUNTERS
+)
+
+
+def snapshot():
+    """Resource counters of this process, now."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    counters = {
+        'cpu_user': usage.ru_utime,
+        'cpu_system': usage.ru_stime,
+        'maxrss': usage.ru_maxrss,
+    }
+    counters.update(_io_counters())
+    return counters
+
+def usage_since(before):
+    """Record fields for the resources used since snapshot() 'before'."""
+    after = snapshot()
+    usage = {
+        'cpu_user': after['cpu_user'] - before['cpu_user'],
+        'cpu_system': after['cpu_system'] - before['cpu_system'],
+        'maxrss_delta': after['maxrss'] - before['maxrss'],
+    }
+    for counter, field in IO_COUNTERS:
+        if field in before and field in after:
+            usage[field] = after[field] - before[field]
+    return usage
+
+def aggregate(records):
+    """Totals of FIELDS over the records which have them - except
+    maxrss_delta, whose largest value is kept. 'attempts' counts the
+    records measured. None if no record was measured."""
+    totals = None
+    for record in records:
+        if 'cpu_user' not in record:
+            continue
+        if totals == None:
+            totals = {'attempts': 0}
+        totals['attempts'] += 1
+        for field in FIELDS:
+            if field not in record:
+                continue
+            if field == 'maxrss_delta':
+                totals[field] = max(totals.get(field, 0), record[field])
+            else:
+                totals[field] = totals.get(field, 0) + record[field]
+    return totals
+
+def describe(totals, wall=None):
+    """Text of aggregate() totals. wall: seconds elapsed over the same
+    attempts, for the share of it spent on CPU."""
+    cpu = totals['cpu_user'] + totals['cpu_system']
+    lines = [str.format(
+        "Resources of {0} attempts: CPU {1:.2f}s user, {2:.2f}s system",
+        totals['attempts'], totals['cpu_user'], totals['cpu_system']
+    )]
+    if wall:
+        lines.append("    CPU / wall time: {0:.0%} of {1:.2f}s".format(cpu / wall, wall))
+    lines.append("    largest peak RSS growth: {0} kB".format(totals['maxrss_delta']))
+    if 'read_chars' in totals:
+        lines.append(str.format(
+            "    read {0} bytes, wrote {1} bytes",
+            totals['read_chars'], totals.get('write_chars', 0)
+        ))
+    if 'read_bytes' in totals:
+        lines.append(str.format(
+            "    storage: read {0} bytes, wrote {1} bytes",
+            totals['read_bytes'], totals.get('write_bytes', 0)
+        ))
+    return "\n".join(lines)
+
+
+#==============================================================================
+#    Local Utility Functions
+#==============================================================================
+def _io_counters():
+    """The IO_COUNTERS of /proc/self/io, by their record fields - or {}
+    where it does not exist (ex. not Linux)."""
+    try:
+        with open('/proc/self/io') as fi:
+            text = fi.read()
+    except IOError:
+        return {}
+    counters = dict(
+        line.split(':', 1) for line in text.splitlines() if ':' in line
+    )
+    return dict(
+        (field, int(counters[counter]))
+        for counter, field in IO_COUNTERS if counter in counters
+    )
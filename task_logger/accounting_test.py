@@ -0,0 +1,42 @@
+import unittest
+#-----
+import accounting
+
+
+
+
+class AccountingTests(unittest.TestCase):
+    def test_usage_since(self):
+        before = accounting.snapshot()
+        total = sum(number * number for number in xrange(300000))
+        with open(__file__) as fi:
+            text = fi.read()
+        usage = accounting.usage_since(before)
+        self.assert_(usage['cpu_user'] + usage['cpu_system'] > 0)
+        self.assert_(usage['maxrss_delta'] >= 0)
+        if 'read_chars' in usage:
+            self.assert_(usage['read_chars'] >= len(text))
+            #Storage reads: 0 when served from the page cache
+            self.assert_(0 <= usage['read_bytes'])
+
+    def test_aggregate(self):
+        records = [
+            {'state': 'completed', 'cpu_user': 1.5, 'cpu_system': 0.5,
+             'maxrss_delta': 100, 'read_chars': 10, 'write_chars': 1,
+             'read_bytes': 4096, 'write_bytes': 0},
+            {'state': 'errored', 'cpu_user': 0.5, 'cpu_system': 0.0,
+             'maxrss_delta': 300, 'read_chars': 20, 'write_chars': 2},
+            {'state': 'new'},
+        ]
+        totals = accounting.aggregate(records)
+        self.assertEqual(totals, {
+            'attempts': 2, 'cpu_user': 2.0, 'cpu_system': 0.5,
+            'maxrss_delta': 300, 'read_chars': 30, 'write_chars': 3,
+            'read_bytes': 4096, 'write_bytes': 0,
+        })
+        self.assertEqual(accounting.aggregate(records[2:]), None)
+        text = accounting.describe(totals, wall=5.0)
+        self.assert_("Resources of 2 attempts" in text)
+        self.assert_("50% of 5.00s" in text)
+        self.assert_("read 30 bytes, wrote 3 bytes" in text)
+        self.assert_("storage: read 4096 bytes, wrote 0 bytes" in text)
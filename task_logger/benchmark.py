@@ -0,0 +1,193 @@
+"""
+Benchmarks for reading and writing progress-logs.
+
+    python benchmark.py [read|lazy|codecs] [count ...]
+
+Each measurement runs in a fresh interpreter, so the peak resident memory
+it reports (from resource.getrusage) is not inflated by earlier measurements.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import resource
+import subprocess
+#---- Local Modules
+from logger import JSONProgressLog, ProcessLogger, _convert_to_string
+from log_codecs import CODECS
+
+
+DEFAULT_COUNTS = (10000, 100000)
+CODEC_COUNTS = (10000, 100000, 1000000)
+FAKE_TRACEBACK = "\n".join(
+    '  File "/data/htdocs/cccid/build/import_sdf.py", line {0}, in load\n'
+    '    records = parse_sdf(filepath)'.format(line)
+    for line in range(8)
+)
+
+
+
+
+#==============================================================================
+#    Log construction
+#==============================================================================
+def fake_record(index):
+    """A record shaped like those written by ProcessingAttempt()."""
+    record = {
+        'state': 'completed',
+        'started': '2014-03-02 10:15:00.000000',
+        'stopped': '2014-03-02 10:17:31.000000',
+        'elapsed': '0:02:31',
+        'results': 'Inserted {0} compounds'.format(index),
+    }
+    if index % 3 == 0:
+        record.update({
+            'state': 'errored',
+            'exc_type': 'RuntimeError',
+            'exc_value': 'Unparsable record at line {0}'.format(index),
+            'exc_traceback': FAKE_TRACEBACK,
+        })
+    return record
+
+def fake_key(index):
+    return (
+        '/data/htdocs/cccid/build/compounds-db/data-files/virtual_chemistry/'
+        'Virtual_Chemistry_{0:07d}.sdf.expanded'.format(index),
+    )
+
+def make_log(logpath, count, codec='json'):
+    """Write a JSONProgressLog of 'count' fake records to logpath."""
+    log = JSONProgressLog(logpath, codec=codec)
+    log.write(dict(
+        (fake_key(index), fake_record(index)) for index in xrange(int(count))
+    ))
+    return logpath
+
+
+#==============================================================================
+#    Readers
+#==============================================================================
+def read_whole(logpath):
+    """Original JSONProgressLog.read(): json.load(), then unserialize(),
+    then _convert_to_string() over the whole structure."""
+    log = JSONProgressLog(logpath)
+    with open(logpath, mode='r') as fi:
+        raw = json.load(fi)
+    return _convert_to_string(log.unserialize(raw))
+
+def read_streaming(logpath):
+    """Current JSONProgressLog.read(): single streaming pass."""
+    return JSONProgressLog(logpath).read()
+
+def read_lazy(logpath):
+    """JSONProgressLog(lazy=True).read(): index of state and position only."""
+    return JSONProgressLog(logpath, lazy=True).read()
+
+
+#==============================================================================
+#    Attempts
+#==============================================================================
+def repeat_attempts(logpath, count):
+    """Enter and exit 'count' attempts on one argument, in a ProcessLogger
+    at logpath - for the memory kept per attempt."""
+    with ProcessLogger(logpath, heartbeat=None) as log:
+        for i in xrange(int(count)):
+            with log.attempt('same'):
+                pass
+            del log['same']     #So it can be attempted again
+
+
+#==============================================================================
+#    Measurement
+#==============================================================================
+def measure(func, *args):
+    """Run func(*args) in a fresh interpreter.
+    Returns (seconds, peak RSS growth in megabytes)."""
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--measure', func.__name__] + list(args),
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    seconds, megabytes = output.split()
+    return float(seconds), float(megabytes)
+
+def _measure_child(func, args):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    func(*args)
+    seconds = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kilobytes on Linux
+    print("{0} {1}".format(seconds, (after - before) / 1024.0))
+
+def report(name, count, filesize, seconds, megabytes):
+    print("{0:<16} {1:>9} records {2:>8.1f} MB file {3:>8.2f} s {4:>9.1f} MB peak".format(
+        name, count, filesize / 1048576.0, seconds, megabytes
+    ))
+
+def bench_read(counts=DEFAULT_COUNTS):
+    """Compare peak memory and wall time of read_whole and read_streaming."""
+    directory = tempfile.mkdtemp()
+    try:
+        for count in counts:
+            #Built in a child too: peak RSS is inherited across exec
+            logpath = os.path.join(directory, 'bench-log.json')
+            measure(make_log, logpath, str(count))
+            filesize = os.path.getsize(logpath)
+            for reader in (read_whole, read_streaming):
+                seconds, megabytes = measure(reader, logpath)
+                report(reader.__name__, count, filesize, seconds, megabytes)
+    finally:
+        shutil.rmtree(directory)
+
+def bench_lazy(counts=DEFAULT_COUNTS):
+    """Compare opening a log in full, and as a lazy index."""
+    directory = tempfile.mkdtemp()
+    try:
+        for count in counts:
+            #Built in a child too: peak RSS is inherited across exec
+            logpath = os.path.join(directory, 'bench-log.json')
+            measure(make_log, logpath, str(count))
+            filesize = os.path.getsize(logpath)
+            for reader in (read_streaming, read_lazy):
+                seconds, megabytes = measure(reader, logpath)
+                report(reader.__name__, count, filesize, seconds, megabytes)
+    finally:
+        shutil.rmtree(directory)
+
+def bench_codecs(counts=CODEC_COUNTS):
+    """Compare save time, load time and file size of each log codec.
+    Save times include building the fake records, which is the same
+    for every codec."""
+    directory = tempfile.mkdtemp()
+    try:
+        for count in counts:
+            for codec in CODECS:
+                logpath = os.path.join(directory, 'bench-log.' + codec)
+                seconds, megabytes = measure(make_log, logpath, str(count), codec)
+                filesize = os.path.getsize(logpath)
+                report('save ' + codec, count, filesize, seconds, megabytes)
+                seconds, megabytes = measure(read_streaming, logpath)
+                report('load ' + codec, count, filesize, seconds, megabytes)
+                os.remove(logpath)
+    finally:
+        shutil.rmtree(directory)
+
+BENCHMARKS = {'read': bench_read, 'lazy': bench_lazy, 'codecs': bench_codecs}
+
+
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--measure']:
+        _measure_child(globals()[sys.argv[2]], sys.argv[3:])
+        sys.exit()
+    args = sys.argv[1:]
+    names = [arg for arg in args if arg in BENCHMARKS] or sorted(BENCHMARKS)
+    counts = [int(arg) for arg in args if arg.isdigit()]
+    for name in names:
+        if counts:
+            BENCHMARKS[name](counts)
+        else:
+            BENCHMARKS[name]()
@@ -0,0 +1,55 @@
+"""
+Chunk-size tuning for ProcessLogger.map(processes=N, chunksize='auto').
+
+When each argument is tiny (a row, a compound ID), sending arguments to
+workers one at a time spends more on IPC than on processing. Sending them
+in chunks amortizes that - but a fixed chunk size is either too small for
+fast items, or too large for slow ones, leaving workers idle at the end.
+AdaptiveChunker sizes each chunk from the per-item processing time
+observed so far, so every chunk takes about 'target' seconds.
+"""
+
+
+class AdaptiveChunker(object):
+    """
+    target: seconds of processing wanted per chunk.
+    initial: chunk size until a chunk has been timed.
+    maximum: largest chunk size.
+    smoothing: weight of the newest chunk in the moving average of
+        per-item latency (an exponentially weighted moving average).
+
+    Counters, for monitoring:
+        latency: moving average of seconds per item, or None
+        chunks: number of chunks timed
+    """
+    def __init__(self, target=0.2, initial=1, maximum=1000, smoothing=0.5):
+        self.target = target
+        self.initial = initial
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.latency = None
+        self.chunks = 0
+
+    def size(self, remaining, workers):
+        """Size of the next chunk, with 'remaining' items left to dispatch
+        among 'workers'. Near the end, chunks shrink so the last items are
+        still spread across every worker."""
+        if self.latency == None:
+            size = self.initial
+        elif self.latency <= 0:
+            size = self.maximum
+        else:
+            size = int(self.target / self.latency)
+        size = min(size, self.maximum, max(1, remaining // (2 * workers)))
+        return max(1, size)
+
+    def observe(self, items, seconds):
+        """Record that a chunk of 'items' items took 'seconds' to process."""
+        if items <= 0:
+            return
+        latency = float(seconds) / items
+        if self.latency == None:
+            self.latency = latency
+        else:
+            self.latency = self.smoothing * latency + (1 - self.smoothing) * self.latency
+        self.chunks += 1
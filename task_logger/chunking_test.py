@@ -0,0 +1,36 @@
+import unittest
+#-----
+from chunking import AdaptiveChunker
+
+
+
+
+class AdaptiveChunkerTests(unittest.TestCase):
+    def test_initial(self):
+        chunker = AdaptiveChunker(initial=4)
+        self.assertEqual(chunker.size(remaining=1000, workers=2), 4)
+
+    def test_tuning(self):
+        chunker = AdaptiveChunker(target=0.2, maximum=1000)
+        chunker.observe(10, 0.01)   #1 ms per item
+        self.assertEqual(chunker.size(remaining=100000, workers=4), 200)
+        chunker.observe(10, 1.0)    #100 ms per item, averaged in
+        self.assertEqual(chunker.latency, 0.0505)
+        self.assertEqual(chunker.size(remaining=100000, workers=4), 3)
+        self.assertEqual(chunker.chunks, 2)
+
+    def test_limits(self):
+        chunker = AdaptiveChunker(target=1.0, maximum=50)
+        chunker.observe(100, 0.0)
+        self.assertEqual(chunker.size(remaining=100000, workers=1), 50)
+        #Near the end, chunks shrink to keep every worker busy
+        self.assertEqual(chunker.size(remaining=40, workers=4), 5)
+        self.assertEqual(chunker.size(remaining=3, workers=4), 1)
+        chunker.observe(0, 5.0)
+        self.assertEqual(chunker.chunks, 1)
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
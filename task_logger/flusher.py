@@ -0,0 +1,104 @@
+"""
+Write-behind persistence for ProcessLogger().
+
+Attempts put their finished records on a queue as they exit, and a
+background thread persists them in batches. So the processing loop never
+waits on disk I/O - which matters when log directories are NFS mounted,
+and a single write can stall for hundreds of milliseconds.
+"""
+import threading
+import Queue
+import time
+
+
+_STOP = object()    #Sentinel, telling the flusher thread to exit
+
+
+class WriteBehindFlusher(threading.Thread):
+    """
+    Background thread, persisting batches of log entries.
+
+    persist: callable, given a list of entries ([key, value] for a record,
+        or [key] for a deletion). Only ever called from this thread.
+    batch_size: most entries handed to persist() at once.
+
+    Once persist() raises, the flusher stops accepting work: the error is
+    raised by every later put(), drain() and stop() - so entries are never
+    queued only to be dropped.
+
+    Counters, for monitoring:
+        queue_depth: entries waiting to be persisted
+        flushes: number of calls to persist()
+        records_flushed: number of entries persisted
+        last_latency, max_latency, total_latency: seconds spent in persist()
+    """
+    def __init__(self, persist, batch_size=100):
+        threading.Thread.__init__(self, name='WriteBehindFlusher')
+        self.daemon = True
+        self.persist = persist
+        self.batch_size = batch_size
+        self.queue = Queue.Queue()
+        self.error = None
+
+        self.flushes = 0
+        self.records_flushed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def put(self, entry):
+        """Queue an entry to be persisted. Never blocks. Raises the error of
+        an earlier batch, if persist() failed."""
+        self._raise_error()
+        self.queue.put(entry)
+
+    def drain(self):
+        """Block until every queued entry has been persisted."""
+        self.queue.join()
+        self._raise_error()
+
+    def stop(self):
+        """Persist every queued entry, and end the thread."""
+        self.queue.put(_STOP)
+        self.join()
+        self._raise_error()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            stopping = any(entry is _STOP for entry in batch)
+            entries = [entry for entry in batch if entry is not _STOP]
+            try:
+                if entries and self.error == None:
+                    self._persist(entries)
+            except Exception as exc:
+                #Re-raised in the owning thread, by put(), drain() or stop()
+                self.error = exc
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stopping:
+                return
+
+    def _persist(self, entries):
+        start = time.time()
+        self.persist(entries)
+        latency = time.time() - start
+        self.flushes += 1
+        self.records_flushed += len(entries)
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+
+    def _raise_error(self):
+        if self.error != None:
+            raise self.error
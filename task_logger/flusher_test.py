@@ -0,0 +1,56 @@
+import unittest
+import threading
+import time
+#-----
+from flusher import WriteBehindFlusher
+
+
+
+
+class WriteBehindFlusherTests(unittest.TestCase):
+    def setUp(self):
+        self.persisted = []
+        self.flusher = WriteBehindFlusher(self.slow_persist, batch_size=10)
+        self.flusher.start()
+
+    def slow_persist(self, entries):
+        time.sleep(0.01)
+        self.persisted.append(list(entries))
+
+    def test_batches(self):
+        for i in range(50):
+            self.flusher.put([('file', i), {'state':'completed'}])
+        self.flusher.stop()
+        self.assertEqual(sum(len(batch) for batch in self.persisted), 50)
+        self.assert_(all(len(batch) <= 10 for batch in self.persisted))
+        self.assertEqual(self.flusher.records_flushed, 50)
+        self.assertEqual(self.flusher.flushes, len(self.persisted))
+        self.assert_(self.flusher.max_latency >= 0.01)
+
+    def test_drain(self):
+        for i in range(5):
+            self.flusher.put([('file', i)])
+        self.flusher.drain()
+        self.assertEqual(self.flusher.queue_depth, 0)
+        self.assertEqual(sum(len(batch) for batch in self.persisted), 5)
+        self.assert_(self.flusher.is_alive())
+        self.flusher.stop()
+        self.assert_(not self.flusher.is_alive())
+
+    def test_error_is_reraised(self):
+        def failing_persist(entries):
+            raise IOError("NFS went away")
+        flusher = WriteBehindFlusher(failing_persist)
+        flusher.start()
+        flusher.put([('file', 0)])
+        self.assertRaises(IOError, flusher.drain)
+        #No more work is accepted, and the error is not forgotten
+        self.assertRaises(IOError, flusher.put, [('file', 1)])
+        self.assertRaises(IOError, flusher.stop)
+        self.assert_(not flusher.is_alive())
+        self.flusher.stop()
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+"""
+Lease files, for running one ProcessLogger task on several hosts sharing
+a POSIX filesystem - with no coordinator, and no network services.
+
+Before processing an argument, a node claims it by creating a lease file
+named by the hash of the argument, with O_CREAT | O_EXCL: exactly one
+node's create succeeds (on NFS, from v3). While processing runs, a
+heartbeat thread touches the node's lease files, so their mtime stays
+fresh. A lease whose mtime is older than 'ttl' seconds belongs to a node
+which died, and may be broken by any other node.
+
+Once the argument's record is persisted, its lease becomes a completion
+marker - never expired - so a node whose view of the log is older still
+skips it. Errored arguments are released, and may be retried by any node.
+
+While started, each node also keeps a presence file (<owner>.node),
+refreshed by the same heartbeat - so live_owners() can tell which nodes
+are still running, even between claims.
+
+Expiry compares file mtimes (set by the file server) against local time,
+so the hosts' clocks should agree to well within 'ttl'.
+"""
+import errno
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+
+# Default seconds without a heartbeat after which a lease has expired
+DEFAULT_TTL = 60.0
+
+
+def node_id():
+    """Name for this process among the nodes sharing a log: 'host-pid'."""
+    return "{0}-{1}".format(socket.gethostname(), os.getpid())
+
+
+class LeaseDirectory(object):
+    """
+    Directory of lease files, one per claimed argument.
+
+    path: the directory - created if missing.
+    owner: name of this node, written into its lease files.
+    ttl: seconds without a heartbeat after which a lease has expired.
+        Written into each lease, so other nodes expire it by the same ttl.
+    on_lost: called with the key of each lease found taken over by
+        another node, from the heartbeat thread - so the processing of
+        that key can be discarded.
+
+    Counters, for monitoring:
+        held: {key: lease path} of leases this node holds
+        broken: expired leases this node has broken
+        lost: leases found taken over by another node on renewal
+    """
+    def __init__(self, path, owner, ttl=DEFAULT_TTL, on_lost=None):
+        if not ttl > 0:
+            raise ValueError("ttl should be a positive number of seconds, not {0}".format(ttl))
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.on_lost = on_lost
+        self.presence_path = os.path.join(path, owner + '.node')
+        self.held = {}
+        self.broken = 0
+        self.lost = 0
+        self._heartbeat = None
+        try:
+            os.makedirs(path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def path_of(self, key):
+        """Path of the lease file for key. Keys are hashed as JSON, so
+        every node names a key's lease the same."""
+        return os.path.join(
+            self.path, hashlib.sha1(json.dumps(key)).hexdigest() + '.lease'
+        )
+
+    def acquire(self, key):
+        """Claim key. True if this node now holds its lease; False if
+        another node does, or key has been completed."""
+        if key in self.held:
+            return True
+        path = self.path_of(key)
+        for trial in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0644)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+                if not self._break_expired(path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as fi:
+                fi.write(json.dumps({'owner': self.owner, 'state': 'attempting', 'ttl': self.ttl}))
+            self.held[key] = path
+            return True
+        return False
+
+    def renew(self):
+        """Heartbeat: refresh the mtime of every lease this node holds, and
+        of its presence file, if started. Leases another node has taken
+        over are dropped, counted, and passed to on_lost()."""
+        if self._heartbeat != None:
+            self._write(self.presence_path, {'owner': self.owner, 'ttl': self.ttl})
+        for key, path in self.held.items():
+            try:
+                if _read(path).get('owner') != self.owner:
+                    raise OSError(errno.ENOENT, "Lease taken over", path)
+                os.utime(path, None)
+            except OSError:
+                #Unless completed or released meanwhile
+                if self.held.pop(key, None) != None:
+                    self.lost += 1
+                    if self.on_lost != None:
+                        self.on_lost(key)
+
+    def complete(self, key):
+        """Turn this node's lease on key into a completion marker."""
+        path = self.held.pop(key, None)
+        if path == None:
+            return
+        self._write(path, {'owner': self.owner, 'state': 'completed'})
+
+    def release(self, key):
+        """Give up this node's lease on key, so any node may claim it."""
+        path = self.held.pop(key, None)
+        if path != None and _read(path).get('owner') == self.owner:
+            _remove(path)
+
+    def release_all(self):
+        for key in list(self.held):
+            self.release(key)
+
+    def start(self):
+        """Write the presence file, and start the heartbeat thread renewing
+        it and held leases every ttl/3 seconds."""
+        if self._heartbeat == None:
+            self._write(self.presence_path, {'owner': self.owner, 'ttl': self.ttl})
+            self._heartbeat = Heartbeat(self.renew, self.ttl / 3.0, name='LeaseHeartbeat')
+            self._heartbeat.start()
+        return self
+
+    def stop(self):
+        """Stop the heartbeat thread, release every lease still held, and
+        remove the presence file."""
+        if self._heartbeat != None:
+            heartbeat, self._heartbeat = self._heartbeat, None
+            heartbeat.stop()
+            _remove(self.presence_path)
+        self.release_all()
+        return self
+
+    def _write(self, path, contents):
+        """Replace the file at path, so readers never see half of it."""
+        temporary = "{0}.{1}.tmp".format(path, self.owner)
+        with open(temporary, 'w') as fi:
+            fi.write(json.dumps(contents))
+        os.rename(temporary, path)
+
+    def _expired(self, path):
+        try:
+            return os.path.getmtime(path) + self.ttl < time.time()
+        except OSError:
+            return False
+
+    def _break_expired(self, path):
+        """Remove the lease at path, if it has expired. True if the lease
+        is gone, and can be created again."""
+        if not os.path.exists(path):
+            return True
+        if _read(path).get('state') == 'completed' or not self._expired(path):
+            return False
+        #Move it aside first: only one node's rename succeeds
+        aside = "{0}.{1}.broken".format(path, self.owner)
+        try:
+            os.rename(path, aside)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return True
+        if not self._expired(aside):
+            #Another node broke it, and took a fresh lease, between the
+            #check and the rename: that lease is put back
+            try:
+                os.link(aside, path)
+            except OSError:
+                pass
+            _remove(aside)
+            return False
+        _remove(aside)
+        self.broken += 1
+        return True
+
+
+class Heartbeat(threading.Thread):
+    """Background thread, calling beat() every 'interval' seconds until
+    stopped. Used for leases, and for the heartbeats of open attempts."""
+    def __init__(self, beat, interval, name='Heartbeat'):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.beat = beat
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def run(self):
+        while True:
+            self.stopping.wait(self.interval)
+            if self.stopping.isSet():
+                return
+            self.beat()
+
+
+def live_owners(path):
+    """Owners of the unexpired leases and presence files in the lease
+    directory at path - the nodes still running. Each file expires by the
+    ttl written into it; completion markers are skipped."""
+    owners = set()
+    if not os.path.isdir(path):
+        return owners
+    now = time.time()
+    for name in os.listdir(path):
+        if not (name.endswith('.lease') or name.endswith('.node')):
+            continue
+        filepath = os.path.join(path, name)
+        contents = _read(filepath)
+        if contents.get('owner') == None or contents.get('state') == 'completed':
+            continue
+        try:
+            if os.path.getmtime(filepath) + contents.get('ttl', DEFAULT_TTL) >= now:
+                owners.add(str(contents['owner']))
+        except OSError:
+            continue    #Released meanwhile
+    return owners
+
+
+#==============================================================================
+#    Local Utility Functions
+#==============================================================================
+def _read(path):
+    """Contents of a lease file: {} if it is missing, or still being written."""
+    try:
+        with open(path) as fi:
+            return json.loads(fi.read())
+    except (IOError, ValueError):
+        return {}
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
@@ -0,0 +1,102 @@
+import unittest
+import os
+import shutil
+import time
+#-----
+from leases import LeaseDirectory, node_id, live_owners
+
+
+
+
+class LeaseTests(unittest.TestCase):
+    def setUp(self):
+        self.path = "lease-test-leases"
+        self.tearDown()
+    def tearDown(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def test_exclusive(self):
+        first = LeaseDirectory(self.path, 'first')
+        second = LeaseDirectory(self.path, 'second')
+        self.assert_(first.acquire(('a.sdf', 'import')))
+        self.assert_(first.acquire(('a.sdf', 'import')))
+        self.assert_(not second.acquire(('a.sdf', 'import')))
+        self.assert_(second.acquire(('b.sdf', 'import')))
+        #Released leases may be claimed by any node
+        first.release(('a.sdf', 'import'))
+        self.assert_(second.acquire(('a.sdf', 'import')))
+
+    def test_expiry(self):
+        first = LeaseDirectory(self.path, 'first', ttl=0.2)
+        second = LeaseDirectory(self.path, 'second', ttl=0.2)
+        self.assert_(first.acquire('a'))
+        time.sleep(0.3)
+        self.assert_(second.acquire('a'))
+        self.assertEqual(second.broken, 1)
+        #The first node finds its lease taken over
+        first.renew()
+        self.assertEqual((first.held, first.lost), ({}, 1))
+        first.release('a')
+        self.assert_(not first.acquire('a'))
+
+    def test_heartbeat(self):
+        first = LeaseDirectory(self.path, 'first', ttl=0.2).start()
+        second = LeaseDirectory(self.path, 'second', ttl=0.2)
+        try:
+            self.assert_(first.acquire('a'))
+            time.sleep(0.5)
+            self.assert_(not second.acquire('a'))
+        finally:
+            first.stop()
+        #stop() releases held leases
+        self.assert_(second.acquire('a'))
+
+    def test_completed(self):
+        first = LeaseDirectory(self.path, 'first', ttl=0.1)
+        second = LeaseDirectory(self.path, 'second', ttl=0.1)
+        self.assert_(first.acquire('a'))
+        first.complete('a')
+        time.sleep(0.2)
+        #Completion markers never expire
+        self.assert_(not second.acquire('a'))
+        self.assert_(not first.acquire('a'))
+
+    def test_on_lost(self):
+        lost = []
+        first = LeaseDirectory(self.path, 'first', ttl=0.2, on_lost=lost.append)
+        second = LeaseDirectory(self.path, 'second', ttl=0.2)
+        self.assert_(first.acquire('a'))
+        first.renew()
+        self.assertEqual(lost, [])
+        time.sleep(0.3)
+        self.assert_(second.acquire('a'))
+        first.renew()
+        self.assertEqual(lost, ['a'])
+
+    def test_live_owners(self):
+        first = LeaseDirectory(self.path, 'first', ttl=0.2).start()
+        second = LeaseDirectory(self.path, 'second', ttl=0.2)
+        try:
+            #Started, but holding no lease
+            self.assertEqual(live_owners(self.path), set(['first']))
+            self.assert_(second.acquire('a'))
+            self.assertEqual(live_owners(self.path), set(['first', 'second']))
+            second.complete('a')
+            time.sleep(0.3)
+            #Completion markers never count; the heartbeat keeps 'first' live
+            self.assertEqual(live_owners(self.path), set(['first']))
+        finally:
+            first.stop()
+        self.assertEqual(live_owners(self.path), set())
+        self.assertEqual(live_owners(self.path + '-missing'), set())
+
+    def test_node_id(self):
+        self.assert_(node_id().endswith('-' + str(os.getpid())))
+        self.assertRaises(ValueError, LeaseDirectory, self.path, 'first', ttl=0)
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
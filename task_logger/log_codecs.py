@@ -0,0 +1,382 @@
+"""
+Codecs for the log-file written by JSONProgressLog().
+
+    json:    {"log": [[key, value], ...]} - one element per line. Readable,
+             and the format of every log written before codecs existed.
+    marshal: a header line, then zlib-compressed blocks of marshal data.
+             Several times faster to load than json, and a fraction of its
+             size - at the cost of being opaque to text tools, and tied to
+             the Python version (see MarshalCodec).
+
+The codec of an existing log-file is detected from its header, so a log
+can be read whichever codec wrote it. Journal and delta segments are
+always JSON lines.
+
+Convert an existing log (with the records of its side-files) from the shell:
+
+    python log_codecs.py marshal import-sdf-log.json [outpath]
+"""
+import collections
+import json
+import marshal
+import re
+import struct
+import sys
+import zlib
+#----
+from local_packages import rich_core
+
+
+class JSONCodec(object):
+    """{"log": [[key, value], ...]}, as written by json.dumps().
+    An optional "prefixes" table precedes "log" - see _key_prefixes()."""
+    name = 'json'
+    magic = None    #Fallback: any file not starting with another codec's magic
+
+    def dump(self, fileobj, pairs, offsets=None, prefixes=None):
+        """Write (key, value) pairs, one element per line. If offsets is
+        a dict, it is filled with {key: (offset, length)} of each element
+        in the file. If prefixes is a sequence of strings, it is written
+        once, and key strings starting with one of them are stored as
+        {"p": index-of-prefix, "s": rest-of-string}."""
+        if prefixes == None:
+            fileobj.write('{"log": [\n')
+        else:
+            fileobj.write('{"prefixes": ' + json.dumps(prefixes) + ',\n"log": [\n')
+            prefix_index = dict((prefix, index) for index, prefix in enumerate(prefixes))
+        position = fileobj.tell()
+        separator = ''
+        for key, value in pairs:
+            if prefixes == None:
+                text = json.dumps([key, value])
+            else:
+                text = json.dumps([_compress_key(key, prefix_index), value])
+            fileobj.write(separator)
+            position += len(separator)
+            if offsets != None:
+                offsets[key] = (position, len(text))
+            fileobj.write(text)
+            position += len(text)
+            separator = ',\n'
+        fileobj.write('\n]}\n')
+
+    def elements(self, fileobj, chunksize=65536):
+        """Yield ([key, value], offset, length) for each element of the
+        log-file, as decoded by json - without string conversion. Elements
+        are decoded one at a time, so only a chunk of the file is held in
+        memory. Raises ValueError if the file is not a complete log."""
+        scanner = _LogScanner(fileobj, chunksize)
+        prefixes = None
+        if scanner.match(_LOG_OPEN) and scanner.match(_LOG_PREFIXES):
+            prefixes = scanner.decode()
+        if not scanner.match(_LOG_ARRAY):
+            raise ValueError("Log-file does not begin with {\"log\": [")
+        while True:
+            scanner.match(_LOG_SEPARATORS)
+            if scanner.peek() == ']':
+                return
+            offset = scanner.offset
+            pair = scanner.decode()
+            if len(pair) != 2:
+                raise ValueError("Log-file element is not a [key, value] pair.")
+            if prefixes != None:
+                pair[0] = _expand_key(pair[0], prefixes)
+            yield pair, offset, scanner.offset - offset
+
+    def element_at(self, fileobj, offset, length):
+        """Decode the [key, value] element at offset. Keys are not expanded."""
+        fileobj.seek(offset)
+        return json.loads(fileobj.read(length))
+
+    def convert(self, data):
+        """json decodes strings as unicode."""
+        return _convert_to_string(data)
+
+
+class MarshalCodec(object):
+    """
+    A header line - the magic, then the version of this format and the
+    marshal.version it was written with - then blocks of: 4-byte
+    little-endian length + zlib-compressed marshal data. The first block
+    holds the prefix table (or None), each following block a list of up to
+    block_size (key, value) pairs, and a zero-length block ends the log -
+    so a truncated file is detected, as it is for json. Compressing many
+    records together is what makes it compact: field names and timestamps
+    repeat from one record to the next.
+    The offset of an element is that of its block, and its 'length' is its
+    index in the block - see element_at().
+    marshal is only suitable for trusted files: ie. logs this package wrote.
+    Its format changes between Python versions: a log written by a newer
+    marshal.version can not be read here (ValueError) - convert it to json
+    with the Python which wrote it.
+    """
+    name = 'marshal'
+    magic = 'TASKLOG-MARSHAL '
+    version = 2
+    #Records per block: larger blocks compress better, but a lazy read
+    #decodes a whole block
+    block_size = 32
+    _LENGTH = struct.Struct('<I')
+
+    def dump(self, fileobj, pairs, offsets=None, prefixes=None):
+        """As JSONCodec.dump()."""
+        fileobj.write('{0}{1} {2}\n'.format(self.magic, self.version, marshal.version))
+        self._write_block(fileobj, None if prefixes == None else list(prefixes))
+        if prefixes != None:
+            prefix_index = dict((prefix, index) for index, prefix in enumerate(prefixes))
+        position = fileobj.tell()
+        block = []
+        for key, value in pairs:
+            if offsets != None:
+                offsets[key] = (position, len(block))
+            if prefixes == None:
+                block.append((key, value))
+            else:
+                block.append((_compress_key(key, prefix_index), value))
+            if len(block) == self.block_size:
+                position += self._write_block(fileobj, block)
+                block = []
+        if block:
+            self._write_block(fileobj, block)
+        fileobj.write(self._LENGTH.pack(0))
+
+    def elements(self, fileobj, chunksize=65536):
+        """As JSONCodec.elements(), with the offset of each element's block,
+        and its index in the block. chunksize is unused: blocks are read
+        one at a time, through the file's own buffer."""
+        self._read_header(fileobj)
+        prefixes = self._decode(self._read_frame(fileobj))
+        while True:
+            offset = fileobj.tell()
+            frame = self._read_frame(fileobj)
+            if not frame:
+                return
+            for index, pair in enumerate(self._decode(frame)):
+                pair = list(pair)
+                if prefixes != None:
+                    pair[0] = _expand_key(pair[0], prefixes)
+                yield pair, offset, index
+
+    def element_at(self, fileobj, offset, index):
+        """The [key, value] element at index, in the block at offset.
+        Keys are not expanded."""
+        fileobj.seek(offset)
+        return list(self._decode(self._read_frame(fileobj))[index])
+
+    def convert(self, data):
+        """marshal preserves str, so nothing needs converting."""
+        return data
+
+    def _read_header(self, fileobj):
+        header = fileobj.readline()
+        if not header.startswith(self.magic):
+            raise ValueError("Log-file does not begin with the marshal header.")
+        try:
+            version, marshal_version = [int(field) for field in header[len(self.magic):].split()]
+        except ValueError:
+            raise ValueError("Unreadable marshal header: {0!r}".format(header))
+        if version != self.version:
+            raise ValueError(str.format(
+                "Log-file is in version {0} of the marshal format; expected version {1}.",
+                version, self.version
+            ))
+        if marshal_version > marshal.version:
+            raise ValueError(str.format(
+                "Log-file was written with marshal version {0}, newer than this "
+                "Python's ({1}): convert it to json with the Python which wrote it.",
+                marshal_version, marshal.version
+            ))
+
+    def _write_block(self, fileobj, data):
+        """Write data as a compressed frame. Returns the bytes written."""
+        frame = zlib.compress(marshal.dumps(data))
+        fileobj.write(self._LENGTH.pack(len(frame)))
+        fileobj.write(frame)
+        return self._LENGTH.size + len(frame)
+
+    def _decode(self, frame):
+        try:
+            return marshal.loads(zlib.decompress(frame))
+        except (zlib.error, EOFError, TypeError) as exc:
+            raise ValueError("Corrupt block in log-file: {0}".format(exc))
+
+    def _read_frame(self, fileobj):
+        header = fileobj.read(self._LENGTH.size)
+        if len(header) != self._LENGTH.size:
+            raise ValueError("Log-file ends before its final frame.")
+        length, = self._LENGTH.unpack(header)
+        frame = fileobj.read(length)
+        if len(frame) != length:
+            raise ValueError("Log-file ends inside a frame.")
+        return frame
+
+
+CODECS = collections.OrderedDict(
+    (codec.name, codec) for codec in (JSONCodec(), MarshalCodec())
+)
+
+
+def get_codec(name):
+    """Codec registered in CODECS under name."""
+    rich_core.AssertKlass(name, basestring, name='name')
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(str.format(
+            "Unknown log codec '{0}'; expected one of: {1}",
+            name, ", ".join(CODECS)
+        ))
+
+def detect_codec(fileobj):
+    """Codec of the log-file, from its header. The file position is
+    left unchanged."""
+    position = fileobj.tell()
+    head = fileobj.read(max(len(codec.magic or '') for codec in CODECS.values()))
+    fileobj.seek(position)
+    for codec in CODECS.values():
+        if codec.magic != None and head.startswith(codec.magic):
+            return codec
+    return CODECS['json']
+
+
+#==============================================================================
+#    Local Utility Functions
+#==============================================================================
+def _convert_to_string(data):
+    '''Converts potentially abstract objects to strings.
+    Commonly used to convert JSON to dicts.'''
+    #basestrings: convert directly to string
+    if isinstance(data,basestring):
+        return str(data)
+    #Mappings: recurse on it's elements, and convert to a dict.
+    elif isinstance(data, collections.Mapping):
+        return dict(_convert_to_string(item) for item in data.iteritems())
+        #return dict(map(_convert_to_string, data.iteritems()))
+    #Iterables: recurse on it's elements, and preserve it's type.
+    elif isinstance(data, collections.Iterable):
+        return type(data)(_convert_to_string(elm) for elm in data)
+        #return type(data)(map(_convert_to_string, data))
+    #Others: no change
+    else:
+        return data
+
+_LOG_OPEN = re.compile(r'\s*\{\s*')
+_LOG_PREFIXES = re.compile(r'"prefixes"\s*:\s*')
+_LOG_ARRAY = re.compile(r'\s*,?\s*"log"\s*:\s*\[')
+_LOG_SEPARATORS = re.compile(r'[\s,]*')
+class _LogScanner(object):
+    """Incremental reader of JSON text from a file, used by
+    JSONCodec.elements(). Keeps only the unread part of the file
+    in memory."""
+    def __init__(self, fileobj, chunksize, lookahead=256):
+        self.fileobj = fileobj
+        self.chunksize = chunksize
+        self.lookahead = lookahead
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.buf_offset = fileobj.tell()
+    @property
+    def offset(self):
+        """Position in the file of the next unread character."""
+        return self.buf_offset + self.pos
+    def match(self, regex):
+        """Consume regex, if the unread text starts with it."""
+        while True:
+            found = regex.match(self.buf, self.pos)
+            if found and found.end() < len(self.buf):
+                self.pos = found.end()
+                return True
+            if not found and len(self.buf) - self.pos >= self.lookahead:
+                return False
+            if not self._fill(self.chunksize):
+                if found:
+                    self.pos = found.end()
+                return bool(found)
+    def decode(self):
+        """Consume and return one JSON value. Raises ValueError if the
+        file ends before it does."""
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                #Value is incomplete: read more of the file
+                if not self._fill(max(self.chunksize, len(self.buf) - self.pos)):
+                    raise
+                continue
+            self.pos = end
+            return value
+    def peek(self):
+        """Next unread character, or '' at the end of the file."""
+        while self.pos >= len(self.buf):
+            if not self._fill(self.chunksize):
+                return ''
+        return self.buf[self.pos]
+    def _fill(self, size):
+        chunk = self.fileobj.read(size)
+        if not chunk:
+            return False
+        self.buf_offset += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+def _key_prefixes(keys, minimum=8):
+    """Directory prefixes shared by at least two strings in keys, and at
+    least 'minimum' characters long."""
+    counts = collections.defaultdict(int)
+    for key in keys:
+        for part in _key_parts(key):
+            if isinstance(part, basestring) and '/' in part:
+                counts[part[:part.rindex('/') + 1]] += 1
+    return sorted(
+        prefix for prefix, count in counts.items()
+        if count >= 2 and len(prefix) >= minimum
+    )
+
+def _key_parts(key):
+    if isinstance(key, tuple):
+        return key
+    return (key, )
+
+def _compress_part(part, prefix_index):
+    if isinstance(part, basestring) and '/' in part:
+        prefix = part[:part.rindex('/') + 1]
+        if prefix in prefix_index:
+            return {'p': prefix_index[prefix], 's': part[len(prefix):]}
+    return part
+
+def _compress_key(key, prefix_index):
+    if isinstance(key, tuple):
+        return [_compress_part(part, prefix_index) for part in key]
+    return _compress_part(key, prefix_index)
+
+def _expand_key(key, prefixes):
+    """Inverse of _compress_key(), on the decoded form of a key."""
+    if isinstance(key, (list, tuple)):
+        return [_expand_key(part, prefixes) for part in key]
+    if isinstance(key, dict):
+        return prefixes[key['p']] + key['s']
+    return key
+
+def seq2tuple(obj):
+    """Convert sequence keys to tuples. Key strings are interned, so strings
+    repeated across keys (ex. a task name) are held in memory once."""
+    if isinstance(obj, rich_core.NonStringSequence):
+        return tuple(_intern(elm) for elm in obj)
+    else:
+        return _intern(obj)
+
+def _intern(obj):
+    if type(obj) is str:
+        return intern(obj)
+    return obj
+
+
+
+
+if __name__ == "__main__":
+    from logger import convert_log
+    if len(sys.argv) not in (3, 4):
+        sys.exit("usage: python log_codecs.py {" + "|".join(CODECS) + "} logpath [outpath]")
+    convert_log(sys.argv[2], sys.argv[1], *sys.argv[3:])
@@ -0,0 +1,148 @@
+import unittest
+import marshal
+import os
+import StringIO
+#-----
+from logger import JSONProgressLog, ProcessLogger, convert_log
+from log_codecs import CODECS, get_codec, detect_codec
+
+
+
+
+class CodecTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "codec-test-log.json"
+        self.other = "codec-test-log.converted"
+        self.directory = "/data/htdocs/cccid/build/compounds-db/data-files/virtual_chemistry/"
+        self.remove()
+    def tearDown(self):
+        self.remove()
+    def remove(self):
+        for logpath in (self.name, self.other):
+            for name in os.listdir('.'):
+                if name.startswith(logpath):
+                    os.remove(name)
+
+    def make_log(self, **options):
+        with JSONProgressLog(self.name, **options) as log:
+            for i in range(20):
+                key = (self.directory + 'Virtual_Chemistry_{0}.sdf'.format(i), 'import')
+                log[key] = {'state':'completed', 'results':['foo', i, 1.5, None]}
+            log['/single/string/key'] = {'state':'errored', 'exc_value':'"quoted"'}
+            log[(1, 2)] = {'state':'new'}
+
+    def assertRecords(self, log):
+        key = (self.directory + 'Virtual_Chemistry_3.sdf', 'import')
+        self.assertEqual(log[key], {'state':'completed', 'results':['foo', 3, 1.5, None]})
+        self.assertEqual(type(log[key]['results'][0]), str)
+        self.assertEqual(log['/single/string/key']['exc_value'], '"quoted"')
+        self.assertEqual(log[(1, 2)], {'state':'new'})
+        self.assertEqual(len(log), 22)
+
+    def test_round_trip(self):
+        for codec in CODECS:
+            for prefix_keys in (False, True):
+                self.make_log(codec=codec, prefix_keys=prefix_keys)
+                with open(self.name, 'rb') as fi:
+                    self.assertEqual(detect_codec(fi).name, codec)
+                    self.assertEqual(fi.tell(), 0)
+                for lazy in (False, True):
+                    with JSONProgressLog(self.name, lazy=lazy) as log:
+                        self.assertRecords(log)
+                        self.assertEqual(log.state_of('/single/string/key'), 'errored')
+                self.remove()
+
+    def test_keeps_codec(self):
+        #Without a codec option, a log is rewritten with the codec it was read with
+        self.make_log(codec='marshal')
+        with ProcessLogger(self.name) as log:
+            with log.attempt(('c.sdf',)) as attempt:
+                attempt['results'] = 'foo'
+        with open(self.name, 'rb') as fi:
+            self.assertEqual(detect_codec(fi).name, 'marshal')
+        with JSONProgressLog(self.name) as log:
+            self.assertEqual(log[('c.sdf',)]['results'], 'foo')
+
+    def test_convert(self):
+        self.make_log(journal=True)
+        convert_log(self.name, 'marshal', self.other)
+        with open(self.other, 'rb') as fi:
+            self.assertEqual(detect_codec(fi).name, 'marshal')
+        with JSONProgressLog(self.other) as log:
+            self.assertRecords(log)
+        #In place, and back
+        convert_log(self.other, 'json')
+        with open(self.other, 'rb') as fi:
+            self.assertEqual(detect_codec(fi).name, 'json')
+        with JSONProgressLog(self.other, lazy=True) as log:
+            self.assertRecords(log)
+        self.assertRaises(IOError, convert_log, 'missing-codec-log.json', 'json')
+
+    def test_convert_read_only(self):
+        with ProcessLogger(self.name, journal=True, dedupe=['exc_traceback']) as log:
+            with log.attempt(('a.sdf',)) as attempt:
+                raise RuntimeError("Intentional")
+        snapshot = self.snapshot()
+        self.assert_(self.name + '.journal' in snapshot)
+        self.assert_(self.name + '.texts' in snapshot)
+        convert_log(self.name, 'marshal', self.other)
+        self.assertEqual(self.snapshot(), snapshot)
+        with ProcessLogger(self.other) as log:
+            record = log.resolve(log[('a.sdf',)])
+            self.assertEqual(record['state'], 'errored')
+            self.assert_('RuntimeError' in record['exc_traceback'])
+
+    def snapshot(self):
+        """{name: contents} of the files of self.name."""
+        snapshot = {}
+        for name in os.listdir('.'):
+            if name.startswith(self.name):
+                with open(name, 'rb') as fi:
+                    snapshot[name] = fi.read()
+        return snapshot
+
+    def test_truncated(self):
+        self.make_log(codec='marshal')
+        with open(self.name, 'rb') as fi:
+            text = fi.read()
+        with open(self.name, 'wb') as fi:
+            fi.write(text[:-10])
+        log = JSONProgressLog(self.name)
+        self.assertRaises(ValueError, log.open)
+        #Left untouched
+        self.assertEqual(os.path.getsize(self.name), len(text) - 10)
+
+    def test_compact(self):
+        sizes = {}
+        for codec in CODECS:
+            self.make_log(codec=codec)
+            sizes[codec] = os.path.getsize(self.name)
+            self.remove()
+        self.assert_(sizes['marshal'] * 2 < sizes['json'])
+
+    def test_marshal_versions(self):
+        self.make_log(codec='marshal')
+        with open(self.name, 'rb') as fi:
+            text = fi.read()
+        header, rest = text.split('\n', 1)
+        self.assertEqual(header, 'TASKLOG-MARSHAL 2 {0}'.format(marshal.version))
+        #Another format version, or a newer marshal version
+        for header in ('TASKLOG-MARSHAL 3 {0}', 'TASKLOG-MARSHAL 2 {1}', 'TASKLOG-MARSHAL 2'):
+            with open(self.name, 'wb') as fi:
+                fi.write(header.format(marshal.version, marshal.version + 1) + '\n' + rest)
+            for lazy in (False, True):
+                self.assertRaises(ValueError, JSONProgressLog(self.name, lazy=lazy).open)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, 'pickle')
+        self.assertRaises(ValueError, JSONProgressLog, self.name, codec='pickle')
+
+    def test_detect_default(self):
+        self.assertEqual(detect_codec(StringIO.StringIO('{"log": []}')).name, 'json')
+        self.assertEqual(detect_codec(StringIO.StringIO('')).name, 'json')
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
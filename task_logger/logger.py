@@ -2,8 +2,6 @@
 
 @TODO: ProcessLogger().attempts - update/interact based on __enter__/__exit__
 @TODO: Review ProcessLoggerABC, and make ProcessLogger inherit from it
-@TODO: ProcessingAttempt: make uncaught exception in switch_on_exit() cause parent
-    to close all other attempts.
 
 @TODO: Write ProcessLoggerABC in task_logger/. Then switch .validate()
     from checking if log is JSONProgressLog() to ProcessLoggerABC().
@@ -13,10 +11,27 @@
 
 import os
 import collections
+import copy
+import errno
+import hashlib
+import heapq
+import itertools
 import json
+import multiprocessing
+import multiprocessing.pool
+import pickle
+import Queue
+import re
+import shutil
+import signal
+import socket
+import sys
+import threading
 
 import traceback
 import datetime
+import time
+import weakref
 #----
 from local_packages import rich_core
 from local_packages import rich_collections
@@ -24,12 +39,31 @@ from local_packages import rich_property
 #---- Local Modules
 import enum #local version of enum
 import pa_exceptions
+import accounting
+from flusher import WriteBehindFlusher
+from retry import policies_of, policy_for
+from chunking import AdaptiveChunker
+from leases import LeaseDirectory, Heartbeat, node_id, live_owners
+from log_codecs import get_codec, detect_codec, seq2tuple
+from log_codecs import _convert_to_string, _key_prefixes, _key_parts
 
 
 LOGGER_SUPPRESSES_ERRORS = True
+# Seconds between heartbeats of open attempts - see ProcessLogger(heartbeat=...)
+HEARTBEAT_INTERVAL = 30.0
+# Seconds without a heartbeat after which an 'attempting' record is stale
+STALE_AFTER = 120.0
+# Record fields which JSONProgressLog(dedupe=...) can store by reference
+DEDUPED_FIELDS = ('exc_traceback', 'exc_value')
 
 
-
+# Durability of writes to the log-file and its side-files. Higher levels
+# trade throughput for surviving power-loss, not just process crashes.
+SyncLevels = enum.Enum([
+    ('none','off'),         #rename into place, no fsync
+    ('file',),              #fsync files before renaming them into place
+    ('directory','full')    #also fsync the directory after renaming
+])
 
 
 
@@ -51,14 +85,94 @@ class JSONProgressLog(rich_collections.BasicMutableMapping):
 
     """
 
-    def __init__(self, logpath=None):
+    def __init__(self, logpath=None, journal=False, delta=False, merge_every=None,
+                 checkpoint_every=None, checkpoint_interval=None, fsync='none',
+                 lazy=False, dedupe=(), prefix_keys=False, codec=None, node=None):
+        """
+        journal: if True, records are appended to a JSON-lines journal
+            (self.journalpath) as each attempt finishes, instead of
+            rewriting the whole log on close(). See compact().
+        delta: if True, flush() writes only the keys changed since the last
+            flush, as a delta segment next to the log-file.
+        merge_every: with delta=True, compact() the log once this many
+            delta segments have accumulated.
+        checkpoint_every: flush() after this many attempts have exited.
+        checkpoint_interval: flush() when an attempt exits, and this many
+            seconds have passed since the last flush.
+            If neither is given, the log is only flushed on close().
+        fsync: a name from SyncLevels. See write().
+        lazy: if True, open() only indexes the 'state' and file position of
+            each record; full records are read when first accessed with
+            self[key], and kept. items(), values() and summary() read them
+            without keeping them. See LazyRecords.
+        dedupe: names of record fields (ex. 'exc_traceback', 'exc_value')
+            whose text is stored once, in self.textspath, keyed by its hash.
+            Records then hold '<field>_id' instead. See resolve().
+            A node stores its texts in a file of its own (logpath.texts.<node>),
+            and open() reads them all.
+        prefix_keys: if True, write() stores directory prefixes shared by
+            key strings once, rather than in every key.
+        codec: name of the codec write() uses - see log_codecs.CODECS.
+            If None, an existing log-file keeps the codec it was written
+            with, and new log-files are written as 'json'. Reading always
+            detects the codec from the file.
+        node: name of this node, when several hosts (or processes) share
+            the log-file - or True, for node_id(). Records are appended to
+            the node's own journal (logpath.node.<node>), and the log-file
+            is never rewritten, so nodes never overwrite each other. open()
+            reads every node's journal; open() without node folds those of
+            nodes which have stopped into the log-file. Journals of nodes
+            still running (holding an unexpired lease or presence file in
+            logpath.leases - see leases.live_owners()) are read, but never
+            folded or removed. Implies journal=True.
+        Note: in journal and delta modes, changes made directly on .data
+        (rather than through the log's Mapping methods, or commit()) are
+        not tracked.
+        
+        self.lock is held by ProcessingAttempt() while it reads or changes
+        its record, so attempts may run in several threads at once.
+        """
         if logpath == None:
             self.logpath = 'default-log.json'
         else:
             self.logpath = logpath
+        self.journal = journal
+        self.journalpath = self.logpath + '.journal'
+        if node == True:
+            node = node_id()
+        if node != None:
+            if not re.match(r'^[\w.-]+$', node):
+                raise ValueError(
+                    "node should be a name usable in file names, not {0!r}".format(node)
+                )
+            if delta or lazy:
+                raise ValueError("node does not combine with 'delta' or 'lazy'.")
+            self.journal = True
+            self.journalpath = self.logpath + '.node.' + node
+        self.node = node
+        self.delta = delta
+        self.merge_every = merge_every
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.fsync = SyncLevels[fsync].name
+        self.lazy = lazy
+        self.dedupe = tuple(dedupe)
+        self.prefix_keys = prefix_keys
+        self.codec = None if codec == None else get_codec(codec).name
+        self.textspath = self.logpath + '.texts'
+        if node != None:
+            self.textspath += '.' + node
+        self.leasespath = self.logpath + '.leases'  #Used by ProcessLogger nodes
 
         self.data = None #Default until opened
+        self.texts = {}
         self.opened = False
+        self._file_codec = None  #Codec the log-file was last read with
+        self.lock = threading.RLock()
+        self._journal_file = None
+        self._dirty = set()
+        self._commits_since_flush = 0
+        self._last_flush = time.time()
 
 
     def open(self):
@@ -66,20 +180,59 @@ class JSONProgressLog(rich_collections.BasicMutableMapping):
             self.data = self.read()
         except ValueError as exc:
             #File found, but 'No JSON object could be decoded'
-            #Create and initialize the log file
+            #Only an empty file is initialized - a damaged log is never
+            #overwritten, since that would discard the work it records.
+            if os.path.getsize(self.logpath) > 0:
+                raise ValueError(str.format(
+                    "Log-file '{0}' could not be decoded, and was left untouched: {1}",
+                    self.logpath, exc
+                ))
             self.write({})
             self.data = self.read()
         except IOError as exc:
             #Usually: 'No such file or directory'
-            #Create and initialize the log file
-            self.write({})
-            self.data = self.read()
+            #Create and initialize the log file - unless a node, since
+            #nodes never write the log-file
+            if self.node != None:
+                self.data = {}
+            else:
+                self.write({})
+                self.data = self.read()
+        for path in self._delta_paths():
+            self._replay(path)
+        for path in self._node_paths():
+            if path != self.journalpath:
+                self._replay(path)
+        self._replay(self.journalpath)
+        #Read after the records: a running node writes texts before the
+        #records referring to them
+        self.texts = self._read_texts()
+        #Side-files left behind by a different mode are folded in
+        if (not self.delta and self._delta_paths()) or (
+                self.node == None and self._stopped_node_paths()) or (
+                self.node == None and self._stopped_node_paths('.texts.')) or (
+                not self.journal and os.path.exists(self.journalpath)
+                and os.path.getsize(self.journalpath) > 0):
+            self.compact()
+        if self.journal:
+            #Appended to: the next entry should not land on a torn line
+            _truncate_torn(self.journalpath)
+            self._journal_file = open(self.journalpath, mode='a')
+        _truncate_torn(self.textspath)
+        self._dirty.clear()
+        self._commits_since_flush = 0
+        self._last_flush = time.time()
         self.opened = True
         return self
         
     def close(self):
         #This should check that all attempts are closed
-        self.write(self.data)
+        self.flush()
+        if self._journal_file != None:
+            self._journal_file.close()
+            self._journal_file = None
+        if self.lazy:
+            self.data.close()
         #self.data = None
         self.opened = False
         return self
@@ -90,25 +243,317 @@ class JSONProgressLog(rich_collections.BasicMutableMapping):
             (*args):{attempt-record},
             ...
         }
+        In lazy mode, returns LazyRecords() instead.
         """
-        with open(self.logpath, mode='r') as fi:
-            raw = json.load(fi)
-        _unserialized = self.unserialize(raw)
-        #Unpack nested structures
-        return _convert_to_string(_unserialized)        
+        if self.lazy:
+            records = LazyRecords(self.logpath).load()
+            self._file_codec = records.codec.name
+            return records
+        with open(self.logpath, mode='rb') as fi:
+            codec = detect_codec(fi)
+            #Single pass: pairs are converted as they are parsed
+            records = dict(_stream_log_pairs(fi, codec=codec))
+        self._file_codec = codec.name
+        return records
         
     def write(self, data=None):
-        """Write 
+        """Write data to the log-file. Written to a temporary file first, and
+        renamed over the log-file once complete, so a crash mid-write
+        leaves the previous log intact.
         """ 
         if data == None:
             data = self.data
-        with open(self.logpath, mode='w') as fi:
-            json.dump(self.serialize(data), fi, indent=1)
-            
+        rich_core.AssertKlass(data, collections.Mapping, name='data')
+        codec = get_codec(self.codec or self._file_codec or 'json')
+        reindex = isinstance(data, LazyRecords)
+        offsets = {} if reindex else None
+        prefixes = _key_prefixes(data) if self.prefix_keys else None
+        with open(self.logpath + '.tmp', mode='wb') as fi:
+            codec.dump(fi, data.iteritems(), offsets=offsets, prefixes=prefixes)
+            self._sync(fi)
+        self._rename(self.logpath + '.tmp', self.logpath)
+        self._file_codec = codec.name
+        if reindex:
+            data.reindex(self.logpath, offsets, codec)
         return self
     
+    #-------- Journal and delta segments
+    def commit(self, key):
+        """Mark the record for a single key as changed. Called by
+        ProcessingAttempt() on __exit__. In journal mode, the record is
+        appended to the journal immediately; otherwise it is persisted
+        by the next flush()."""
+        with self.lock:
+            return self._commit(key)
+    def _commit(self, key):
+        self._dirty.add(key)
+        if self.journal:
+            self._append_journal(self._entry(key))
+            self._dirty.discard(key)
+        self._commits_since_flush += 1
+        if self._checkpoint_due():
+            self.flush()
+        return self
+    
+    def flush(self):
+        """Persist changes made since the last flush.
+        journal mode: append the changed records to the journal.
+        delta mode: write the changed records as a new delta segment.
+        Otherwise: rewrite the whole log-file (see compact()).
+        """
+        with self.lock:
+            return self._flush()
+    def _flush(self):
+        if self.journal:
+            for key in list(self._dirty):
+                self._append_journal(self._entry(key))
+        elif self.delta:
+            if self._dirty:
+                self._write_delta([self._entry(key) for key in self._dirty])
+        else:
+            self.compact()
+        self._dirty.clear()
+        self._commits_since_flush = 0
+        self._last_flush = time.time()
+        if self.delta and self.merge_every != None:
+            if len(self._delta_paths()) >= self.merge_every:
+                self.compact()
+        return self
+    
+    def compact(self):
+        """Fold the journal and delta segments into a snapshot of the
+        log-file, and remove them. Only happens when asked for, or when
+        merge_every is reached."""
+        with self.lock:
+            return self._compact()
+    def _compact(self):
+        if self.node != None:
+            raise RuntimeError(
+                "Nodes do not rewrite the shared log-file: open it without 'node' to compact."
+            )
+        #Listed before writing: a node starting meanwhile keeps its journal
+        folded = self._delta_paths() + self._stopped_node_paths()
+        self._fold_texts(self._stopped_node_paths('.texts.'))
+        self.write(self.data)
+        self._dirty.clear()
+        for path in folded:
+            os.remove(path)
+        if self._journal_file != None:
+            self._journal_file.close()
+            self._journal_file = None
+        if os.path.exists(self.journalpath):
+            os.remove(self.journalpath)
+        if self.opened and self.journal:
+            self._journal_file = open(self.journalpath, mode='a')
+        return self
+    
+    #-------- State lookups
+    def keys_in_state(self, state):
+        """Yield keys of records whose 'state' is in the group of 'state'.
+        ex. log.keys_in_state('errored')"""
+        name = States[state].name
+        for key in self:
+            if _state_name(self.state_of(key)) == name:
+                yield key
+    
+    def state_index(self):
+        """Return {key: state} for every record. In lazy mode, this does
+        not read the records."""
+        if self.lazy:
+            return dict((key, self.data.state_of(key)) for key in self.data)
+        return dict(
+            (key, record.get('state')) for key, record in self.data.iteritems()
+        )
+    
+    def state_of(self, key, default=None):
+        """Return the 'state' of the record for key. In lazy mode, this
+        does not read the rest of the record."""
+        if self.lazy:
+            return self.data.state_of(key, default)
+        if key not in self:
+            return default
+        return self[key].get('state', default)
+    
+    def peek(self, key, default=None):
+        """Return the record for key, or default. In lazy mode, the record
+        is read without being kept - so changes to it are not kept either;
+        change records through self[key]."""
+        if self.lazy:
+            return self.data.peek(key, default)
+        return self.get(key, default)
+    
+    #-------- Deduplicated text
+    def store_text(self, text):
+        """Store text once, and return the hash it can be looked up by.
+        New texts are appended to self.textspath immediately, so they are
+        on disk before any record referring to them."""
+        digest = hashlib.sha1(text).hexdigest()
+        if digest not in self.texts:
+            self.texts[digest] = text
+            with open(self.textspath, mode='a') as fi:
+                fi.write(json.dumps([digest, text]) + '\n')
+                self._sync(fi)
+        return digest
+    
+    def text_of(self, digest):
+        return self.texts[digest]
+    
+    def resolve(self, record):
+        """Return record, with any '<field>_id' references to stored text
+        replaced by '<field>'. Returns record itself if it has none."""
+        references = [field for field in record if field.endswith('_id')
+                      and field[:-len('_id')] in DEDUPED_FIELDS]
+        if not references:
+            return record
+        record = dict(record)
+        for reference in references:
+            record[reference[:-len('_id')]] = self.text_of(record.pop(reference))
+        return record
+    
+    def _read_texts(self):
+        """Texts of the shared file, and of every node's - see 'node'."""
+        texts = {}
+        for path in [self.logpath + '.texts'] + self._node_paths('.texts.'):
+            texts.update(_read_text_file(path))
+        return texts
+    
+    def _fold_texts(self, paths):
+        """Append the texts of node text files (paths) to the shared file,
+        unless already there - then remove them."""
+        if not paths:
+            return
+        sharedpath = self.logpath + '.texts'
+        _truncate_torn(sharedpath)
+        shared = _read_text_file(sharedpath)
+        with open(sharedpath, mode='a') as fi:
+            for path in paths:
+                for digest, text in _read_text_file(path).iteritems():
+                    if digest not in shared:
+                        shared[digest] = text
+                        fi.write(json.dumps([digest, text]) + '\n')
+            self._sync(fi)
+        for path in paths:
+            os.remove(path)
+    
+    def _entry(self, key):
+        """[key, value] for a record, or [key] for a deletion."""
+        if key in self.data:
+            return [key, self.data[key]]
+        return [key]
+    
+    def _persist_entries(self, entries):
+        """Persist a batch of entries: appended to the journal in journal
+        mode, otherwise written as a delta segment."""
+        if self.journal:
+            for entry in entries:
+                self._append_journal(entry)
+        else:
+            self._write_delta(entries)
+    
+    def _append_journal(self, entry):
+        self._journal_file.write(json.dumps(entry) + '\n')
+        self._journal_file.flush()
+        if self.fsync not in SyncLevels['none']:
+            os.fsync(self._journal_file.fileno())
+    
+    def _checkpoint_due(self):
+        if self.checkpoint_every != None:
+            if self._commits_since_flush >= self.checkpoint_every:
+                return True
+        if self.checkpoint_interval != None:
+            if time.time() - self._last_flush >= self.checkpoint_interval:
+                return True
+        return False
+    
+    def _sync(self, fileobj):
+        """Flush fileobj to disk, if the fsync level asks for it."""
+        if self.fsync not in SyncLevels['none']:
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+    
+    def _rename(self, source, destination):
+        """Atomically move source over destination."""
+        os.rename(source, destination)
+        if self.fsync in SyncLevels['directory']:
+            fd = os.open(os.path.dirname(os.path.abspath(destination)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    
+    def _delta_paths(self):
+        """Paths of existing delta segments, in the order they were written."""
+        directory, name = os.path.split(os.path.abspath(self.logpath))
+        prefix = name + '.delta.'
+        return [
+            os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory))
+            if filename.startswith(prefix) and filename[len(prefix):].isdigit()
+        ]
+    
+    def _node_paths(self, infix='.node.'):
+        """Paths of existing node journals - or with infix='.texts.', of
+        node text files. See 'node'."""
+        directory, name = os.path.split(os.path.abspath(self.logpath))
+        prefix = name + infix
+        return [
+            os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory))
+            if filename.startswith(prefix)
+        ]
+    
+    def _stopped_node_paths(self, infix='.node.'):
+        """Paths of node journals (or text files, as in _node_paths())
+        whose node is no longer running - see leases.live_owners()."""
+        live = live_owners(self.leasespath)
+        prefix = os.path.basename(self.logpath) + infix
+        return [
+            path for path in self._node_paths(infix)
+            if os.path.basename(path)[len(prefix):] not in live
+        ]
+    
+    def _write_delta(self, entries):
+        """Write entries as the next delta segment, in journal format.
+        Renamed into place once complete, so readers never see half of one."""
+        paths = self._delta_paths()
+        if paths:
+            number = int(paths[-1].rsplit('.', 1)[1]) + 1
+        else:
+            number = 0
+        path = "{0}.delta.{1:06d}".format(self.logpath, number)
+        with open(path + '.tmp', mode='w') as fi:
+            for entry in entries:
+                fi.write(json.dumps(entry) + '\n')
+            self._sync(fi)
+        self._rename(path + '.tmp', path)
+    
+    def _replay(self, path):
+        """Apply journal-format entries in path on top of self.data - last
+        write wins. A truncated final line (from a crash mid-append) is
+        skipped; a line which can not be decoded anywhere else raises
+        ValueError, as the file is damaged rather than torn."""
+        if not os.path.exists(path):
+            return
+        torn = None     #Number of a line which could not be decoded
+        with open(path, mode='r') as fi:
+            for number, line in enumerate(fi, 1):
+                if torn != None:
+                    raise ValueError(str.format(
+                        "Line {0} of '{1}' could not be decoded, and is not the last line.",
+                        torn, path
+                    ))
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    torn = number
+                    continue
+                key = seq2tuple(_convert_to_string(entry[0]))
+                if len(entry) == 1:
+                    self.data.pop(key, None)
+                else:
+                    self.data[key] = _convert_to_string(entry[1])
+    
     
-
     #-------- Context Manager
     def __enter__(self):
         self.open()
@@ -152,12 +597,30 @@ class JSONProgressLog(rich_collections.BasicMutableMapping):
         except TypeError as exc:
             raise KeyError(
                 "'{0}' not found likely because log file is not open.".format(key))
+        self._dirty.add(key)
     def __delitem__(self, key):
         try:
             del self.data[key]
         except TypeError as exc:
             raise KeyError(
                 "'{0}' not found likely because log file is not open.".format(key))
+        self.commit(key)
+    def __contains__(self, key):
+        #Asks data, rather than reading the record (see LazyRecords)
+        if self.data == None:
+            return False
+        return key in self.data
+    def iteritems(self):
+        """In lazy mode, records are read without being kept - see peek()."""
+        if self.lazy:
+            return self.data.iteritems()
+        return ((key, self[key]) for key in self)
+    def itervalues(self):
+        return (value for key, value in self.iteritems())
+    def items(self):
+        return list(self.iteritems())
+    def values(self):
+        return list(self.itervalues())
 
 
 
@@ -175,6 +638,120 @@ class JSONProgressLog(rich_collections.BasicMutableMapping):
 
 
 
+class LazyRecords(collections.MutableMapping):
+    """
+    Records of a log-file, read on demand. Used as JSONProgressLog().data
+    when lazy=True.
+    
+    Holds the 'state' of every record, and the position of its element in
+    the log-file. A full record is read from the file (and kept) when it is
+    first accessed with self[key], until the log-file is rewritten - see
+    reindex(). peek(), and iterating over items() or values(), read records
+    without keeping them - so modify records through self[key].
+    """
+    def __init__(self, logpath):
+        self.logpath = logpath
+        self.codec = None   #Detected by load()
+        self._states = {}
+        self._offsets = {}
+        self._loaded = {}
+        self._file = None
+    
+    def load(self):
+        """Index the log-file. Raises ValueError or IOError, as
+        JSONProgressLog.read() does."""
+        with open(self.logpath, mode='rb') as fi:
+            self.codec = detect_codec(fi)
+            for (key, value), offset, length in self.codec.elements(fi):
+                key = seq2tuple(self.codec.convert(key))
+                state = value.get('state')
+                if state != None:
+                    state = intern(str(state))
+                self._states[key] = state
+                self._offsets[key] = (offset, length)
+        return self
+    
+    def reindex(self, logpath, offsets, codec):
+        """Point at a rewritten log-file, containing these records at
+        offsets, as written by codec. Kept records are dropped, since they
+        are in the file: a dict read before, and changed after, is lost."""
+        self._states = dict((key, self.state_of(key)) for key in offsets)
+        self._offsets = offsets
+        self._loaded = {}
+        self.logpath = logpath
+        self.codec = codec
+        self.close()
+    
+    def close(self):
+        if self._file != None:
+            self._file.close()
+            self._file = None
+    
+    def state_of(self, key, default=None):
+        if key in self._loaded:
+            return self._loaded[key].get('state', default)
+        state = self._states.get(key)
+        if state == None:
+            return default
+        return state
+    
+    def peek(self, key, default=None):
+        """The record for key, without keeping it (unless already kept)."""
+        if key in self._loaded:
+            return self._loaded[key]
+        if key in self._offsets:
+            return self._read(key)
+        return default
+    
+    def _read(self, key):
+        if self._file == None:
+            self._file = open(self.logpath, mode='rb')
+        offset, length = self._offsets[key]
+        key, value = self.codec.element_at(self._file, offset, length)
+        return self.codec.convert(value)
+    
+    #---- MutableMapping
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            if key not in self._offsets:
+                raise KeyError(key)
+            self._loaded[key] = self._read(key)
+        return self._loaded[key]
+    def __setitem__(self, key, value):
+        self._loaded[key] = value
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._loaded.pop(key, None)
+        self._offsets.pop(key, None)
+        self._states.pop(key, None)
+    def __contains__(self, key):
+        return (key in self._loaded) or (key in self._offsets)
+    def __iter__(self):
+        for key in self._offsets:
+            yield key
+        for key in self._loaded:
+            if key not in self._offsets:
+                yield key
+    def __len__(self):
+        return len(self._offsets) + sum(
+            1 for key in self._loaded if key not in self._offsets
+        )
+    def iteritems(self):
+        for key in self:
+            if key in self._loaded:
+                yield key, self._loaded[key]
+            else:
+                yield key, self._read(key)
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+    def items(self):
+        return list(self.iteritems())
+    def values(self):
+        return list(self.itervalues())
+
+
 # States used to track state of ProcessingAttempt
 States = enum.Enum([
     ('new','untried'),
@@ -182,6 +759,15 @@ States = enum.Enum([
     ('errored','error','exception','stopped'),
     ('attempting','attempted','in progress','in_progress','running')
 ])
+# States whose arguments are dispatched by ProcessLogger.map() - see pending()
+PENDING_STATES = ('new', 'errored')
+# Seconds between checks on the workers of ProcessLogger.map(timeout=S)
+_POLL_INTERVAL = 0.01
+# Default of ProcessLogger.map(speculate=True): how many times its expected
+# duration an attempt runs before it is duplicated
+SPECULATION_FACTOR = 2.0
+# Fields of an errored record kept in its 'failures', when retried
+_FAILURE_FIELDS = ('exc_type', 'exc_value', 'exc_value_id', 'stopped')
     
 
 class ProcessingAttempt(rich_collections.BasicMutableMapping):
@@ -191,28 +777,49 @@ class ProcessingAttempt(rich_collections.BasicMutableMapping):
     
     This class exists as a subject-class to ProcessLogger.
     
+    While open, its record is 'attempting', with the 'owner' ([host, pid])
+    and a 'heartbeat' (seconds since the epoch), which ProcessLogger
+    refreshes. A record left 'attempting' by an owner which has stopped
+    is reclaimed by the next attempt - see _is_stale().
     
     @TODO: Consider whether initial data should be included. I suspect not.
-    @TODO: Consider difficult issue: in switch_on_exit(): NonSuppressedError()
-        - should it trigger an event in the parent log(), to close out of all
-        other open attempts before raising that error?
     
     @TODO: Make the exception catching functionality ALSO catch on KeyboardInterrupt
     """
-    def __init__(self, log, arguments, data=None):
+    def __init__(self, log, arguments, data=None, timeout=None):
         """Memoize on arguments.
         log should be a log, treatable as a MutableMapping
-        data is initial values for the processing attempt's record
-            self.data is copied back to self.log[self.arguments], upon __exit__
+        data is initial values for the processing attempt's record. The
+            record in the log is left as it is until __enter__, which checks
+            its state, then replaces it with a record started from data.
+        timeout: seconds processing may run, or None - see __enter__()
+        
+        resume_point is the progress last checkpoint()ed by an unfinished
+        attempt on the same arguments, or None. It is carried into this
+        attempt's record, until checkpoint() replaces it.
         """
         
         
         
         self.open = False
         self.started = datetime.datetime.now()
+        self.remote_traceback = None    #Set by finish()
+        self.exc_type = None            #Exception type, if errored
+        self.entered_state = None       #State of the record before __enter__
+        self.reclaimed_from = None      #Owner of a stale record, reclaimed by __enter__
+        self.canceled = False           #Set by cancel() and discard()
+        self._usage_before = None       #accounting.snapshot(), while open
+        self.deadline = None            #time.time() to finish by, if timeout
+        self._alarm = None              #(previous SIGALRM handler,), while armed
+        if timeout != None and not timeout > 0:
+            raise ValueError(
+                "timeout should be a positive number of seconds, not {0}".format(timeout)
+            )
+        self.timeout = timeout
         (self.log,
         self.arguments,
-        self.data) = self.validate(log, arguments, data)
+        self.initial_data) = self.validate(log, arguments, data)
+        self.resume_point = self._resume_point()
 
     
     def validate(self, log, arguments, data):
@@ -235,44 +842,281 @@ class ProcessingAttempt(rich_collections.BasicMutableMapping):
         """Entering 'with' context manager.
         Some initialization of keys handled here; however - initialization the Mapping
         (self ~ self.data) occurs in in the data property getter.
+        
+        With a timeout, in the main thread, SIGALRM raises AttemptTimedOut
+        inside the 'with' block once the timeout passes. This interrupts
+        Python code only: a call stuck inside a C extension is interrupted
+        when it returns. For a hard limit, use map(processes=N, timeout=S).
         """
-        self.open = True
+        return self._enter(alarm=True)
+    def _enter(self, alarm, measure=True):
+        """measure: False if processing runs in another process, which
+        measures its own resources."""
+        self.started = datetime.datetime.now()
         
         #defs = rich_core.defaults(self.data, self.new_record())
         #self.update(defs)
 
-        if 'state' not in self:
-            self['state'] = States['new'].name
-        self.switch_on_enter(self['state'])
-          
+        with self._lock():
+            if self.canceled:
+                #Canceled while queued (see ProcessLogger.close_attempts()):
+                #processing never starts
+                raise pa_exceptions.AttemptCanceled("Canceled before it started.")
+            self.open = True
+            #Only 'state' is needed here, so don't make the log read the whole record
+            if hasattr(self.log, 'state_of') and self.arguments in self.log:
+                state = self.log.state_of(self.arguments)
+            else:
+                state = self.get('state')
+            if state == None:
+                state = self['state'] = _state_name('new')
+            self.switch_on_enter(state)
+            self.entered_state = state
+            #The previous attempt's record is replaced. Persisted by the next
+            #heartbeat or flush - short attempts finish before either, and
+            #cost no extra write
+            record = self._new_attempt_record()
+            record.update({
+                'state': _state_name('attempting'),
+                'owner': _owner(),
+                'heartbeat': time.time(),
+            })
+            self.data = record
+            self._register(True)
+        if measure and getattr(self.log, 'resources', False):
+            self._usage_before = accounting.snapshot()
+        self._arm_timeout(alarm)
         return self
          
     def __exit__(self, exc_type, exc_value, exc_traceback):
         """            
         """
+        alarmed = self._alarm != None
+        self._disarm_timeout()
+        if self.canceled:
+            # Outcome of canceled processing is ignored - but a fatal error
+            # passing through (ex. from a nested attempt) still propagates
+            return not _is_fatal(exc_type)
+        if exc_type == None and alarmed and self.expired():
+            # Its timer ran out during a nested attempt, which took the alarm
+            exc_type = pa_exceptions.AttemptTimedOut
+            exc_value, exc_traceback = exc_type(self._timeout_message()), None
+            self.remote_traceback = ''
         self.open = False
         self.elapsed()
-        self.switch_on_exit(exc_type, exc_value, exc_traceback)
+        with self._lock():
+            self._register(False)
+            try:
+                self.switch_on_exit(exc_type, exc_value, exc_traceback)
+            finally:
+                self.commit()
         return True     # Suppress exception
+    def start(self):
+        """Enter the attempt without a 'with' block, for callback-driven
+        code (ex. Twisted or Tornado) where processing completes later.
+        Raises as __enter__ does. Pair with finish().
+        A timeout is not enforced by signal here: the callbacks should
+        poll expired(), or call check_timeout(), and cancel their work."""
+        return self._enter(alarm=False)
+    def finish(self, started=None, stopped=None, exc_value=None, remote_traceback=None,
+               usage=None):
+        """Exit the attempt without a 'with' block: after start(), or when
+        processing ran elsewhere - ex. in a worker process of
+        ProcessLogger.map(). Takes the place of __exit__, given the timings
+        and exception of that processing, and the text of its traceback
+        (traceback objects can not be sent between processes), and the
+        resources it used (see accounting). started defaults to the time
+        of start(), and stopped to now.
+        As __exit__, re-raises NonSuppressedError."""
+        self._disarm_timeout()
+        if self.canceled:
+            return self
+        self.open = False
+        if started != None:
+            self.started = started
+        self.remote_traceback = remote_traceback
+        self.elapsed(stopped, usage)
+        exc_type = None if exc_value == None else type(exc_value)
+        with self._lock():
+            self._register(False)
+            try:
+                self.switch_on_exit(exc_type, exc_value, None)
+            finally:
+                self.commit()
+        return self
+    def cancel(self, reason="", commit=True):
+        """Close an open attempt without waiting for its processing, which
+        may be running in another thread or process: record it as errored,
+        with exc_type AttemptCanceled. The outcome of its processing, if
+        it ever arrives, is ignored."""
+        self._disarm_timeout()
+        self.open = False
+        self.canceled = True
+        with self._lock():
+            if self.entered_state == None:
+                #Canceled while queued: the previous attempt's record is replaced
+                self.data = self._new_attempt_record()
+            self._register(False)
+            self.elapsed()
+            self.remote_traceback = ''
+            self._original_close_errored(pa_exceptions.AttemptCanceled, reason)
+            if commit:
+                self.commit()
+        return self
+    def discard(self):
+        """Stop recording an attempt whose arguments another process has
+        taken over (ex. its node's lease was lost): the outcome of its
+        processing, if it ever arrives, is ignored, and nothing more of
+        this attempt is persisted."""
+        self._disarm_timeout()
+        self.open = False
+        self.canceled = True
+        with self._lock():
+            self._register(False)
+            getattr(self.log, '_dirty', set()).discard(self.arguments)
+        return self
+    def abandon(self):
+        """Leave an attempt which will not finish (ex. after a
+        NonSuppressedError stopped ProcessLogger.map()): its record is
+        returned to the state it was entered in."""
+        self._disarm_timeout()
+        self.open = False
+        with self._lock():
+            self._register(False)
+            self.data.update({'state': self.entered_state})
+            self._release()
+            self.commit()
+        return self
+    def commit(self):
+        """Ask the parent log to persist this attempt's record, if the
+        log supports it (ex. JSONProgressLog in journal mode)."""
+        if hasattr(self.log, 'commit'):
+            self.log.commit(self.arguments)
+    #------ Sub-progress
+    def checkpoint(self, **progress):
+        """Record how far processing has got, ex.
+            attempt.checkpoint(offset=fi.tell(), records=count)
+        Merged into the record's 'progress', and committed - so it is
+        persisted as the log persists commits (at once in journal mode,
+        otherwise by the next flush). If this attempt does not complete,
+        the next attempt on its arguments finds it as resume_point.
+        Processing should only checkpoint work whose results are durable.
+        Ignored once the attempt is canceled or discarded."""
+        with self._lock():
+            if self.canceled:
+                return self
+            merged = dict(self.get('progress') or {})
+            merged.update(progress)
+            self['progress'] = merged
+            self.commit()
+        return self
+    def _resume_point(self):
+        with self._lock():
+            if hasattr(self.log, 'state_of'):
+                #Completed records have no progress: don't read them
+                if _state_name(self.log.state_of(self.arguments)) == 'completed':
+                    return None
+            record = _peek(self.log, self.arguments)
+        if not record or _state_name(record.get('state')) == 'completed':
+            return None
+        if not record.get('progress'):
+            return None
+        return dict(record['progress'])
+    #------ Timeout
+    def expired(self):
+        """True if the attempt has run past its timeout."""
+        return self.deadline != None and time.time() > self.deadline
+    def check_timeout(self):
+        """Raise AttemptTimedOut if the attempt has run past its timeout -
+        for processing which cancels itself cooperatively."""
+        if self.expired():
+            raise pa_exceptions.AttemptTimedOut(self._timeout_message())
+    def _timeout_message(self):
+        return "Processing ran past its timeout of {0} seconds.".format(self.timeout)
+    def _arm_timeout(self, alarm):
+        """Set the deadline and - if alarm, and signals can be delivered
+        here - a timer raising AttemptTimedOut once it passes. The timer is
+        process-wide: a timer already set (ex. by an enclosing attempt) is
+        saved, and this one fires at whichever comes first."""
+        if self.timeout == None:
+            return
+        self.deadline = time.time() + self.timeout
+        #Signal handlers run only in the main thread
+        if alarm and threading.current_thread().name == 'MainThread':
+            previous = signal.signal(signal.SIGALRM, self._on_alarm)
+            remaining, interval = signal.setitimer(signal.ITIMER_REAL, 0)
+            self._alarm = (previous, remaining, interval, time.time())
+            if remaining > 0:
+                signal.setitimer(signal.ITIMER_REAL, min(self.timeout, remaining))
+            else:
+                signal.setitimer(signal.ITIMER_REAL, self.timeout)
+    def _disarm_timeout(self):
+        """Cancel the timer, and restore the one saved by _arm_timeout(),
+        for the time it has left. One which ran out meanwhile is not
+        restored: its attempt finds itself expired on exit."""
+        if self._alarm != None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            previous, remaining, interval, armed = self._alarm
+            signal.signal(signal.SIGALRM, signal.SIG_DFL if previous == None else previous)
+            self._alarm = None
+            left = remaining - (time.time() - armed)
+            if remaining > 0 and left > 0:
+                signal.setitimer(signal.ITIMER_REAL, left, interval)
+    def _on_alarm(self, signum, frame):
+        if not self.expired():
+            #The timer of an enclosing attempt
+            raise pa_exceptions.AttemptTimedOut(
+                "Processing ran past the timeout of an enclosing attempt.")
+        raise pa_exceptions.AttemptTimedOut(self._timeout_message())
+    def _register(self, entered):
+        """Add this attempt to, or remove it from, the parent log's open
+        attempts - if it keeps them (see ProcessLogger.attempts)."""
+        if hasattr(self.log, '_track'):
+            if entered:
+                self.log._track(self)
+            else:
+                self.log._untrack(self)
+    def _lock(self):
+        """The parent log's lock (see JSONProgressLog), held while reading
+        or changing this attempt's record."""
+        return getattr(self.log, 'lock', _NO_LOCK)
     #-------
-    def elapsed(self):
-        """Record time elapsed in processing."""
-        self.stopped = datetime.datetime.now()
-        self['started'] = str(self.started)
-        self['stopped'] = str(self.stopped)
-        self['elapsed'] = str(self.stopped - self.started)
+    def elapsed(self, stopped=None, usage=None):
+        """Record time elapsed in processing - and the resources it used:
+        usage, as measured elsewhere, or since __enter__ if the log asks
+        for resources (see accounting)."""
+        if stopped == None:
+            stopped = datetime.datetime.now()
+        self.stopped = stopped
+        fields = {
+            'started': str(self.started),
+            'stopped': str(self.stopped),
+            'elapsed': str(self.stopped - self.started),
+        }
+        if usage == None and self._usage_before != None:
+            usage = accounting.usage_since(self._usage_before)
+        self._usage_before = None
+        if usage:
+            fields.update(usage)
+        with self._lock():
+            self.data.update(fields)
     #------ Converting try_func(func, args, log)
     def switch_on_enter(self, state):         
-        if state in States['new']:
+        name = _state_name(state)
+        if name == 'new':
             #Continue to processing
             pass
-        elif state in States['attempting']:            
-            #Interrupt processing
-            raise pa_exceptions.AttemptAlreadyInProgress(state)
-        elif state in States['completed']:            
+        elif name == 'attempting':
+            record = _peek(self.log, self.arguments)
+            if not _is_stale(record, getattr(self.log, 'stale_after', STALE_AFTER)):
+                #Interrupt processing
+                raise pa_exceptions.AttemptAlreadyInProgress(state)
+            #Its owner stopped mid-attempt: continue to processing
+            self.reclaimed_from = _peek(self.log, self.arguments).get('owner')
+        elif name == 'completed':
             #Interrupt processing
             raise pa_exceptions.AttemptPreviouslyCompleted(state)
-        elif state in States['errored']:
+        elif name == 'errored':
             #Continue to processing
             pass
         else:
@@ -284,23 +1128,26 @@ class ProcessingAttempt(rich_collections.BasicMutableMapping):
         """    
         if exc_type == None:            
             #No error encountered
-            self['state'] = States['completed'].name
+            self['state'] = _state_name('completed')
+            self.data.pop('progress', None)
+            self._release()
             return True     # Suppress exception in __exit__
         elif issubclass(exc_type, pa_exceptions.AttemptAlreadyInProgress):
             #Attempt already in progress for this combination of arguments
-            self['state'] = States['attempting'].name
+            self['state'] = _state_name('attempting')
             return True     # Suppress exception in __exit__
         elif issubclass(exc_type, pa_exceptions.AttemptPreviouslyCompleted):
             #Attempt previous completed
-            self['state'] = States['completed'].name
+            self['state'] = _state_name('completed')
             return True     # Suppress exception in __exit__
         elif issubclass(exc_type, pa_exceptions.NonSuppressedError):
-            #Record exception, and raise the exception
+            #Record exception, cancel all other attempts of parent-log,
+            #and raise the exception
             self._original_close_errored(exc_type, exc_value, exc_traceback)
-            
-            # FUTURE: close all other attempts of parent-log
-            #self.log.close_attempts()
-            
+            if hasattr(self.log, 'close_attempts'):
+                self.log.close_attempts(
+                    "Canceled by {0}: {1}".format(exc_type.__name__, exc_value)
+                )
             raise exc_type, exc_value, exc_traceback
         else:
             #Other exception type - record as error, and suppress the exception
@@ -315,13 +1162,41 @@ class ProcessingAttempt(rich_collections.BasicMutableMapping):
             exc_type = pa_exceptions.AttemptCanceled
         if exc_value == None:
             exc_value = ""
-        if exc_traceback == None:
-            exc_traceback = traceback.print_stack()
+        self.exc_type = exc_type
+        if exc_traceback == None and self.remote_traceback != None:
+            traceback_text = self.remote_traceback
+        else:
+            if exc_traceback == None:
+                exc_traceback = traceback.print_stack()
+            traceback_text = '\n'.join(traceback.format_tb(exc_traceback))
         
-        self['state'] = States['errored'].name
+        self['state'] = _state_name('errored')
+        self._release()
         self['exc_type'] = exc_type.__name__
-        self['exc_value'] = str(exc_value)
-        self['exc_traceback'] = '\n'.join(traceback.format_tb(exc_traceback))
+        self._set_text('exc_value', str(exc_value))
+        self._set_text('exc_traceback', traceback_text)
+    def _new_attempt_record(self):
+        """Record of this attempt, replacing the previous attempt's: its
+        initial data, and the progress it resumes from."""
+        record = dict(self.initial_data)
+        if self.resume_point != None and 'progress' not in record:
+            record['progress'] = dict(self.resume_point)
+        if self.reclaimed_from != None:
+            record['reclaimed_from'] = self.reclaimed_from
+        return record
+    def _release(self):
+        """Drop the fields which mark the record as held by this process."""
+        for field in ('owner', 'heartbeat'):
+            self.data.pop(field, None)
+    def _set_text(self, field, text):
+        """Set a text field - as a reference to stored text, if the log
+        deduplicates that field."""
+        if field in getattr(self.log, 'dedupe', ()):
+            self[field + '_id'] = self.log.store_text(text)
+            self.pop(field, None)
+        else:
+            self[field] = text
+            self.pop(field + '_id', None)
     
 
     
@@ -464,14 +1339,17 @@ class ProcessingAttempt(rich_collections.BasicMutableMapping):
         Mapping-like behavior references this."""
         def getter(self):
             """Reference's parent log, creating a new entry if necessary."""
-            if self.arguments not in self.log:
-                self.log[self.arguments] = self.new_record()
-            return self.log[self.arguments]
+            with self._lock():
+                if self.arguments not in self.log:
+                    self.log[self.arguments] = self.new_record()
+                return self.log[self.arguments]
         def setter(self, data):
             """Set corresponding value inside parent log."""
-            self.log[self.arguments] = data
+            with self._lock():
+                self.log[self.arguments] = data
         def deleter(self):
-            del self.log[self.arguments]
+            with self._lock():
+                del self.log[self.arguments]
         def validator(self, data):
             if data == None:
                 return {}
@@ -498,13 +1376,22 @@ class ProcessingAttempt(rich_collections.BasicMutableMapping):
 #         else:
 #             rich_core.AssertKlass(data, collections.MutableMapping, name='data')
 #             return data
+    def __setitem__(self, key, value):
+        with self._lock():
+            self.data[key] = value
+    def __delitem__(self, key):
+        with self._lock():
+            del self.data[key]
     def new_record(self):
         """Create a new record, with default keys set."""
-        return {'state':States['new'].name}
+        return {'state':_state_name('new')}
     #----------
     def summary(self):
         """Print a summary of the state of this attempt."""
-        return _summarize_attempt(self.log[self.arguments], self.arguments)
+        record = self.log[self.arguments]
+        if hasattr(self.log, 'resolve'):
+            record = self.log.resolve(record)
+        return _summarize_attempt(record, self.arguments)
        
 
 
@@ -532,7 +1419,6 @@ class ProcessLogger(JSONProgressLog):
         
     
     @TODO: Consider: should close() and close_attempts() be called together?
-    @TODO: Closing an attempt should remove it from the list of active attempts.
     
     @TODO: Get default data working. Currently it causes bugs in self.attempt()
     @TODO: Allow setting default_data which is inherited by new attempts
@@ -544,15 +1430,53 @@ class ProcessLogger(JSONProgressLog):
 #         self.task = task
 #         self.dataset = dataset
 #         self.log = None
-    def __init__(self, logpath, data=None):
+    def __init__(self, logpath, data=None, write_behind=False, lease_ttl=60.0,
+                 heartbeat=HEARTBEAT_INTERVAL, stale_after=STALE_AFTER, resources=False,
+                 **options):
         """
         with ProcessLogger(logpath) as log:
             log.mapper
             with log.attempt(
+        write_behind: if True, records of exiting attempts are persisted
+            by a background thread (self.flusher), as journal entries in
+            journal mode, otherwise as delta segments.
+        lease_ttl: with the 'node' option, seconds without a heartbeat
+            after which another node may take over an argument - see
+            leases.LeaseDirectory.
+        heartbeat: seconds between refreshes of the 'heartbeat' of open
+            attempts, by a background thread - or None, for no thread.
+        stale_after: seconds after which an 'attempting' record whose
+            heartbeat has not been refreshed is reclaimable: its owner is
+            taken to have crashed, and the argument is dispatched again.
+            Keep it several times 'heartbeat'.
+        resources: if True, each attempt records the CPU time, peak RSS
+            growth and I/O bytes of its processing (see accounting), and
+            summary() totals them.
+        options are passed to JSONProgressLog (ex. journal=True).
+        
+        Running one task on several hosts, which share the log's directory:
+            with ProcessLogger('import-sdf-log.json', node=True) as log:
+                log.map(import_sdf, filepaths, processes=8)
+        map() then claims each argument with a lease file (in
+        logpath.leases), so no two nodes process the same argument.
         """
-        JSONProgressLog.__init__(self, logpath)
+        JSONProgressLog.__init__(self, logpath, **options)
         
         self.default_data = self.validate(data)
+        self.write_behind = write_behind
+        self.lease_ttl = lease_ttl
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.resources = resources
+        self._heartbeat = None      #Heartbeat thread, while open
+        self.leases = None          #LeaseDirectory, while open with 'node'
+        self.flusher = None
+        self.pending_counts = {}    #Set by pending()
+        self.chunker = None         #Set by map(chunksize='auto')
+        self._attempts = weakref.WeakValueDictionary()  #id -> open attempt
+        self._queued = weakref.WeakValueDictionary()    #id -> attempt map() has yet to enter
+        self.speculated = 0         #Counted by map(speculate=True)
+        self.speculation_wins = 0
         #self.default_data = {}
         
     
@@ -563,8 +1487,10 @@ class ProcessLogger(JSONProgressLog):
             rich_core.AssertKlass(data, collections.MutableMapping, name='data')
         return data
         
-    def attempt(self, arguments):
+    def attempt(self, arguments, data=None, timeout=None):
         """
+        data: initial values of the attempt's record.
+        timeout: seconds processing may run - see ProcessingAttempt.__enter__()
         """
         if not self.opened:
             raise RuntimeError("Log file must be open.")
@@ -574,8 +1500,7 @@ class ProcessLogger(JSONProgressLog):
 
         #Old code
         #attempt = ProcessingAttempt(self, arguments, data=self.default_data)
-        attempt = ProcessingAttempt(self, arguments)
-        self.attempts.append(attempt) 
+        attempt = ProcessingAttempt(self, arguments, data=data, timeout=timeout)
         return attempt
     
     def __enter__(self):
@@ -589,29 +1514,164 @@ class ProcessLogger(JSONProgressLog):
         #Extra stuff...    
         #self.close_attempts()
     
-    
-    #----- Attempts property
-    #Hook back from child attempts
-    #Child attempts must be written on exiting the context manager
+    #----- Write-behind
+    def open(self):
+        JSONProgressLog.open(self)
+        if self.write_behind:
+            self.flusher = WriteBehindFlusher(self._persist_entries)
+            self.flusher.start()
+        if self.node != None:
+            self.leases = LeaseDirectory(
+                self.leasespath, self.node, self.lease_ttl, on_lost=self._lease_lost
+            ).start()
+        elif os.path.isdir(self.leasespath) and not live_owners(self.leasespath):
+            #Every node has stopped, and its journal was folded in by
+            #JSONProgressLog.open(): completion markers are no longer needed
+            shutil.rmtree(self.leasespath)
+        self._start_heartbeat()
+        return self
+    def close(self):
+        """Drains the write-behind queue, and joins its thread, before closing.
+        A node releases any leases it still holds. The log is closed even if
+        the flusher failed - its error is raised afterwards."""
+        try:
+            self._stop_heartbeat()
+            if self.flusher != None:
+                flusher, self.flusher = self.flusher, None
+                flusher.stop()
+        finally:
+            try:
+                if self.leases != None:
+                    leases, self.leases = self.leases, None
+                    leases.stop()
+            finally:
+                JSONProgressLog.close(self)
+        return self
+    def commit(self, key):
+        """With write-behind, a copy of the record is queued for the flusher
+        thread, instead of being persisted here."""
+        if self.flusher == None:
+            return JSONProgressLog.commit(self, key)
+        with self.lock:
+            self._dirty.discard(key)
+            self.flusher.put(copy.deepcopy(self._entry(key)))
+        return self
+    def flush(self):
+        if self.flusher != None:
+            self.flusher.drain()
+        return JSONProgressLog.flush(self)
+    def _append_journal(self, entry):
+        """Once a node's record is persisted in a final state, its lease is
+        settled: a completed argument's lease becomes a completion marker,
+        any other is released - so another node may retry it."""
+        JSONProgressLog._append_journal(self, entry)
+        if self.leases != None and len(entry) == 2:
+            state = _state_name(entry[1].get('state'))
+            if state == 'completed':
+                self.leases.complete(entry[0])
+            elif state != 'attempting':
+                self.leases.release(entry[0])
+    def compact(self):
+        if self.flusher != None:
+            self.flusher.drain()
+        return JSONProgressLog.compact(self)
     
     
-    _attempts = []
-    @rich_property.VProperty
+    #----- Open attempts
+    #Hook back from child attempts: they register on entering, and
+    #unregister on exiting. Held by weak reference, so an attempt dropped
+    #without exiting is not kept alive - nor, through it, this log.
+    @property
     def attempts(self):
-        return self._attempts
-    @attempts.setter
-    def attempts(self, value):
-        self._attempts = value
-    @attempts.validator
-    def attempts(self, attempts):
-        rich_core.AssertKlass(attempts, rich_core.NonStringSequence, name='attempts')
-        for attempt in attempts:
-            rich_core.AssertKlass(attempt, ProcessingAttempt, name='attempt')
-        return attempts
-    def close_attempts(self):
-        """Close all attempts."""
-        for attempt in self.attempts:
-            attempt.close()
+        """List of the open attempts of this log."""
+        return self._attempts.values()
+    @property
+    def open_count(self):
+        """Number of open attempts."""
+        return len(self._attempts)
+    def _track(self, attempt):
+        self._queued.pop(id(attempt), None)
+        self._attempts[id(attempt)] = attempt
+    def _untrack(self, attempt):
+        self._attempts.pop(id(attempt), None)
+    def _queue(self, attempts):
+        """Hold attempts which map() will enter once a worker is free,
+        so close_attempts() can cancel them before they start."""
+        with self.lock:
+            for attempt in attempts:
+                self._queued[id(attempt)] = attempt
+    def _unqueue(self, attempts):
+        with self.lock:
+            for attempt in attempts:
+                self._queued.pop(id(attempt), None)
+    def _claim(self, attempt):
+        """Claim a queued attempt, as map() is about to enter it. With the
+        'node' option, this acquires the lease on its argument: False if
+        another node holds it, or has completed it - or if close_attempts()
+        dropped the attempt from the queue."""
+        if self.leases == None:
+            return True
+        with self.lock:
+            if id(attempt) in self._queued and self.leases.acquire(attempt.arguments):
+                return True
+            self._queued.pop(id(attempt), None)
+            return False
+    def _lease_lost(self, key):
+        """Called by the lease heartbeat: another node took over key, so
+        the open attempt on it is discarded - see ProcessingAttempt.discard()."""
+        with self.lock:
+            for attempt in self.attempts:
+                if attempt.arguments == key:
+                    attempt.discard()
+    def close_attempts(self, reason=""):
+        """Cancel every open attempt of this log (see ProcessingAttempt.cancel()),
+        and every attempt map() has queued but not yet entered - then flush
+        once. Called when an attempt raises NonSuppressedError, so in-flight
+        and queued attempts of map() stop holding their arguments. Queued
+        attempts then never start. A node's queued attempts hold no lease
+        yet (see _claim()): they are dropped, not canceled - another node
+        may be processing their arguments. Returns the canceled attempts."""
+        with self.lock:
+            queued = self._queued.values() if self.leases == None else []
+            self._queued.clear()
+            canceled = [
+                attempt.cancel(reason, commit=False)
+                for attempt in self.attempts + queued
+            ]
+            for attempt in canceled:
+                self._dirty.add(attempt.arguments)
+            self.flush()
+        return canceled
+    #------- Heartbeats
+    def _start_heartbeat(self):
+        """Start the thread calling beat() - see 'heartbeat'."""
+        if self.heartbeat != None and self._heartbeat == None:
+            self._heartbeat = Heartbeat(self.beat, self.heartbeat, name='AttemptHeartbeat')
+            self._heartbeat.start()
+    def _stop_heartbeat(self):
+        if self._heartbeat != None:
+            heartbeat, self._heartbeat = self._heartbeat, None
+            heartbeat.stop()
+    def beat(self):
+        """Refresh the 'heartbeat' of every open attempt - so other
+        processes can tell these attempts are still running. Persisted at
+        once in journal mode and with write_behind, otherwise by the next
+        flush; heartbeats do not count toward checkpoint_every."""
+        with self.lock:
+            for attempt in self.attempts:
+                attempt['heartbeat'] = time.time()
+                if self.flusher != None:
+                    if self.flusher.error == None:
+                        #A failed flusher is raised by the owning thread, not here
+                        self.flusher.put(copy.deepcopy(self._entry(attempt.arguments)))
+                elif self.journal:
+                    self._append_journal(self._entry(attempt.arguments))
+                else:
+                    self._dirty.add(attempt.arguments)
+    def stale(self, record):
+        """True if record is 'attempting', but its owner has stopped."""
+        return (_state_name(record.get('state')) == 'attempting'
+                and _is_stale(record, self.stale_after))
     #------- default_data property
     @rich_property.VProperty
     class default_data(object):
@@ -629,31 +1689,512 @@ class ProcessLogger(JSONProgressLog):
     def summary(self):
 #         for arguments, record in self.items():
 #             _summarize_attempt(record, arguments)
-        return "\n\n".join(
-            _summarize_attempt(record, arguments)
-            for arguments, record in self.items()
+        resolved = [
+            (arguments, self.resolve(record)) for arguments, record in self.items()
+        ]
+        text = "\n\n".join(
+            _summarize_attempt(record, arguments) for arguments, record in resolved
         )
+        records = [record for arguments, record in resolved]
+        totals = accounting.aggregate(records)
+        if totals != None:
+            wall = sum(
+                _parse_elapsed(record.get('elapsed')) or 0.0
+                for record in records if 'cpu_user' in record
+            )
+            text += "\n\n" + accounting.describe(totals, wall)
+        return text
 
-    #------ Advanced --- handle in the FUTURE
-    def map(self, processing, iterable=None):
-        """
-        'callable' is the core processing.
+    #------ Mapping processing over arguments
+    def pending(self, iterable):
+        """Return the arguments of iterable which still need processing:
+        those without a record, or whose record is 'new' or 'errored' - or
+        'attempting', but stale(). Decided up front, from a single
+        state_index() - so finished work costs a dict lookup, rather than
+        an attempt and an exception.
         
-        Mapper from example_2().
-        with ProcessLogger("testlog.json", task='import-expanded', dataset=VirtualChemistry) as log:
-            log.map(fake_processing)
+        Counts are kept in self.pending_counts: arguments by state group,
+        and 'dispatched' and 'skipped' totals.
+            ex. {'new': 10, 'completed': 999990,
+                 'dispatched': 10, 'skipped': 999990}
         """
-        if iterable==None:
-            iterable = self.dataset
-        
+        index = self.state_index()
+        counts = collections.defaultdict(int)
+        todo = []
         for argument in iterable:
-            with log.attempt(argument) as attempt:
-                processing(*argument)
+            name = _state_name(index.get(argument) or 'new')
+            counts[name] += 1
+            if name in PENDING_STATES:
+                todo.append(argument)
+            elif name == 'attempting' and self.stale(self.peek(argument)):
+                todo.append(argument)
+        total = sum(counts.values())
+        counts['dispatched'] = len(todo)
+        counts['skipped'] = total - len(todo)
+        self.pending_counts = dict(counts)
+        return todo
+    
+    def predict(self, arguments):
+        """Return {argument: predicted seconds of processing, or None}.
+        Predicted from the 'elapsed' of an argument's previous attempt; else
+        from the size of its file (the first string in the argument naming
+        a file), at the seconds-per-byte seen for arguments with both."""
+        elapsed, sizes = {}, {}
+        for argument in arguments:
+            if argument in self:
+                elapsed[argument] = _parse_elapsed(self.peek(argument).get('elapsed'))
+            sizes[argument] = _file_size(argument)
+        timed = [
+            argument for argument in arguments
+            if elapsed.get(argument) != None and sizes[argument]
+        ]
+        rate = None
+        if timed:
+            rate = (sum(elapsed[argument] for argument in timed)
+                    / sum(sizes[argument] for argument in timed))
+        predictions = {}
+        for argument in arguments:
+            if elapsed.get(argument) != None:
+                predictions[argument] = elapsed[argument]
+            elif rate != None and sizes[argument] != None:
+                predictions[argument] = sizes[argument] * rate
+            else:
+                predictions[argument] = None
+        return predictions
+    
+    def longest_first(self, arguments):
+        """Order arguments by predict(), longest first. Arguments with no
+        prediction come before the rest, largest file first - since any of
+        them could be the longest."""
+        predictions = self.predict(arguments)
+        def key(argument):
+            if predictions[argument] == None:
+                return (0, -(_file_size(argument) or 0))
+            return (1, -predictions[argument])
+        return sorted(arguments, key=key)
+    
+    def map(self, processing, iterable, processes=None, threads=None, retry=None,
+            longest_first=False, chunksize=1, timeout=None, speculate=False):
+        """
+        Apply processing(argument) to each argument of iterable, each inside
+        its own attempt. Returns the attempts, in the order of iterable.
+        Only pending() arguments are dispatched: see self.pending_counts
+        for how many were skipped.
+        
+            with ProcessLogger("testlog.json") as log:
+                log.map(fake_processing, VirtualChemistry.filepaths, processes=32)
+        
+        processes: if given, processing runs in a multiprocessing.Pool of
+            this many worker processes. So processing, its arguments, and
+            any exception it raises should be picklable. This process stays
+            the only owner of the log: workers send back only the timings
+            and exception of each call, which are applied to the attempts
+            here - in order, as the sequential 'with' loop would.
+            A NonSuppressedError stops the pool, and is raised after the
+            attempts before it are recorded.
+        chunksize: with processes, the number of arguments sent to a
+            worker at once, or 'auto' to tune it from the per-item
+            processing time observed (see chunking.AdaptiveChunker).
+            Outcomes come back a chunk at a time, but are still recorded
+            attempt by attempt.
+        threads: if given, attempts run in a pool of this many threads -
+            for I/O-bound processing, where process startup and pickling
+            are pure overhead. Attempts hold self.lock only while changing
+            their records, never while processing runs.
+        retry: a retry.RetryPolicy, or {exception type: RetryPolicy or None}.
+            Errored attempts are re-queued within this run, after a backoff,
+            until their policy's max_attempts. Their records count
+            'attempts', and keep earlier 'failures'. Only the last attempt
+            for each argument is returned.
+        longest_first: if True, dispatch arguments in order of predicted
+            duration, longest first (see longest_first()) - so a pool is
+            not left waiting on one long job started last.
+        With the 'node' option, each argument is claimed by lease as a
+            worker is free to start it (see _claim()). Arguments which
+            another node holds, or has completed, are skipped - and have no
+            attempt in the returned list.
+        timeout: seconds each attempt may run. Attempts which run past it
+            are recorded as errored, with exc_type AttemptTimedOut.
+            With processes, each attempt runs in a process of its own,
+            which is terminated at its timeout - so a call hung inside a C
+            extension does not hold a worker slot. Without processes, it
+            is enforced by SIGALRM (see ProcessingAttempt.__enter__()).
+            Threads can not be stopped, so it does not combine with threads.
+        speculate: with processes - once every argument has been dispatched,
+            an attempt running more than twice its expected duration (or
+            'speculate' times, if a number) is duplicated on an idle worker.
+            The first copy to succeed is recorded, and the other terminated;
+            self.speculated and self.speculation_wins count duplicates
+            launched, and those which finished first. The expected duration
+            is predicted from earlier runs (see predict()), and refined by
+            attempts finished in this run - see _stragglers().
+            processing should be safe to run twice at once (ex. write its
+            output to a temporary file, renamed into place). As with
+            timeout, each attempt runs in a process of its own.
+        """
+        if processes != None and threads != None:
+            raise ValueError("Give one of 'processes' or 'threads', not both.")
+        if chunksize != 1 and processes == None:
+            raise ValueError("'chunksize' applies only with 'processes'.")
+        if timeout != None and threads != None:
+            raise ValueError("'timeout' can not be enforced on threads: use processes.")
+        if timeout != None and chunksize != 1:
+            raise ValueError(
+                "'timeout' runs one attempt per process: it does not combine with 'chunksize'."
+            )
+        if speculate and (processes == None or chunksize != 1):
+            raise ValueError("'speculate' needs 'processes', without 'chunksize'.")
+        if speculate == True:
+            speculate = SPECULATION_FACTOR
+        arguments = self.pending(iterable)
+        dispatched = self.longest_first(arguments) if longest_first else arguments
+        if retry != None:
+            attempts = self._map_retrying(
+                processing, dispatched, processes, threads, chunksize, timeout, speculate,
+                policies_of(retry)
+            )
+        else:
+            attempts = self._dispatch(
+                processing, dispatched, processes, threads, chunksize, timeout, speculate
+            )
+        if longest_first:
+            by_argument = dict((attempt.arguments, attempt) for attempt in attempts)
+            attempts = [
+                by_argument[argument] for argument in arguments
+                if argument in by_argument
+            ]
+        return attempts
+    def _dispatch(self, processing, arguments, processes=None, threads=None,
+                  chunksize=1, timeout=None, speculate=False, data=None):
+        """One attempt for each of arguments. data: {argument: initial
+        values of its record}."""
+        if data == None:
+            data = {}
+        if self.leases != None:
+            return self._dispatch_leased(
+                processing, arguments, processes, threads, chunksize, timeout, speculate, data
+            )
+        return self._dispatch_workers(
+            processing, arguments, processes, threads, chunksize, timeout, speculate, data
+        )
+    def _dispatch_leased(self, processing, arguments, processes, threads, chunksize,
+                         timeout, speculate, data):
+        """Each argument is claimed just before its attempt starts, so nodes
+        share out arguments as they go, rather than each claiming everything
+        at the start. Leases are settled as records are persisted (see
+        _append_journal()); any still held at the end are released."""
+        try:
+            attempts = self._dispatch_workers(
+                processing, arguments, processes, threads, chunksize, timeout, speculate, data
+            )
+            if self.flusher != None:
+                self.flusher.drain()
+            return attempts
+        finally:
+            for argument in arguments:
+                self.leases.release(argument)
+    def _dispatch_workers(self, processing, arguments, processes, threads, chunksize,
+                          timeout, speculate, data):
+        if threads != None:
+            return self._map_threads(processing, arguments, threads, data)
+        if processes == None:
+            return [
+                self.call(processing, argument, data.get(argument), timeout)
+                for argument in arguments
+                if self.leases == None or self.leases.acquire(argument)
+            ]
+        return self._map_processes(
+            processing, arguments, processes, chunksize, timeout, speculate, data
+        )
+    def _map_retrying(self, processing, arguments, processes, threads, chunksize,
+                      timeout, speculate, policies):
+        """Dispatch arguments in rounds: each round retries the errored
+        attempts whose backoff has passed."""
+        last = {}           #argument -> its latest attempt
+        counts = collections.defaultdict(int)
+        failures = collections.defaultdict(list)
+        waiting = []        #heap of (due time, argument)
+        batch = arguments
+        while batch or waiting:
+            data = dict((argument, {'attempts': counts[argument] + 1}) for argument in batch)
+            for argument in batch:
+                if failures[argument]:
+                    data[argument]['failures'] = list(failures[argument])
+            for attempt in self._dispatch(processing, batch, processes, threads,
+                                          chunksize, timeout, speculate, data):
+                argument = attempt.arguments
+                counts[argument] += 1
+                last[argument] = attempt
+                if _state_name(attempt.get('state')) != 'errored':
+                    continue
+                policy = policy_for(policies, attempt.exc_type)
+                if policy != None and policy.allows(counts[argument]):
+                    failures[argument].append(dict(
+                        (field, attempt[field]) for field in _FAILURE_FIELDS
+                        if field in attempt
+                    ))
+                    heapq.heappush(waiting, (time.time() + policy.wait(counts[argument]), argument))
+            batch = []
+            if waiting:
+                time.sleep(max(0.0, waiting[0][0] - time.time()))
+                while waiting and waiting[0][0] <= time.time():
+                    batch.append(heapq.heappop(waiting)[1])
+        return [last[argument] for argument in arguments if argument in last]
+    def _map_processes(self, processing, arguments, processes, chunksize, timeout, speculate, data):
+        """Attempts are queued, and entered only as they are sent to a
+        worker - so only those are 'attempting', and refreshed by beat()."""
+        #Predicted before entering attempts replaces their records' 'elapsed'
+        predicted = self.predict(arguments) if speculate else {}
+        attempts = [self.attempt(argument, data.get(argument)) for argument in arguments]
+        skipped = set()     #ids of attempts whose argument another node holds
+        self._queue(attempts)
+        try:
+            if timeout != None or speculate:
+                self._map_spawned(
+                    processing, attempts, processes, timeout, speculate, predicted, skipped
+                )
+            else:
+                self._map_pool(processing, attempts, processes, chunksize, skipped)
+        finally:
+            self._unqueue(attempts)
+            for attempt in attempts:
+                if attempt.open:
+                    attempt.abandon()
+        return [attempt for attempt in attempts if id(attempt) not in skipped]
+    def _map_pool(self, processing, attempts, processes, chunksize, skipped):
+        pool = multiprocessing.Pool(processes)
+        try:
+            self._apply_chunks(pool, processing, attempts, processes, chunksize, skipped)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    def _apply_chunks(self, pool, processing, attempts, processes, chunksize, skipped):
+        """Send attempts to pool in chunks - of chunksize, or sized by an
+        AdaptiveChunker if 'auto' - keeping four chunks per worker sent but
+        not yet returned. Each attempt is claimed and entered as its chunk
+        is sent; the ids of those not claimed (see _claim()) are added to
+        skipped.
+        Outcomes are applied in order, each chunk under a single hold of
+        self.lock; a slow chunk holds back only the applying, not the
+        sending of later chunks. A NonSuppressedError is raised as soon as
+        its chunk returns, out of order - see _raise_fatal()."""
+        chunker = AdaptiveChunker() if chunksize == 'auto' else None
+        in_flight = collections.deque()     #(chunk, AsyncResult), in the order sent
+        checked = set()                     #ids of returned results without a fatal outcome
+        returned = _Returned()
+        sent = position = 0
+        while position < len(attempts) or in_flight:
+            ready = [
+                (chunk, result) for chunk, result in in_flight
+                if id(result) not in checked and result.ready()
+            ]
+            self._raise_fatal(
+                (attempt, outcome) for chunk, result in ready
+                for attempt, outcome in itertools.izip(chunk, result.get())
+            )
+            checked.update(id(result) for chunk, result in ready)
+            while position < len(attempts) and sent - returned.count < 4 * processes:
+                if chunker != None:
+                    size = chunker.size(len(attempts) - position, processes)
+                else:
+                    size = chunksize
+                chunk = []
+                with self.lock:
+                    while position < len(attempts) and len(chunk) < size:
+                        attempt = attempts[position]
+                        position += 1
+                        if not self._claim(attempt):
+                            skipped.add(id(attempt))
+                            continue
+                        attempt._enter(alarm=False, measure=False)
+                        chunk.append(attempt)
+                if not chunk:
+                    break
+                in_flight.append((chunk, pool.apply_async(_run_chunk, [
+                    (processing, [attempt.arguments for attempt in chunk], self.resources)
+                ], callback=returned)))
+                sent += 1
+            if not in_flight:
+                continue
+            if not in_flight[0][1].ready():
+                returned.wait()
+                continue
+            chunk, result = in_flight.popleft()
+            checked.discard(id(result))
+            outcomes = result.get()
+            if chunker != None:
+                chunker.observe(len(outcomes), sum(
+                    _seconds(outcome[1] - outcome[0]) for outcome in outcomes
+                ))
+            with self.lock:
+                for attempt, outcome in itertools.izip(chunk, outcomes):
+                    attempt.finish(*outcome)
+        if chunker != None:
+            self.chunker = chunker
+    def _map_spawned(self, processing, attempts, processes, timeout, speculate, predicted,
+                     skipped):
+        """Run each attempt in a process of its own, at most 'processes' at
+        once - so any one can be terminated: at its timeout, or when it
+        loses to a speculative duplicate (see map()). Outcomes are applied
+        in order, as in _map_pool(). predicted: predict() of the arguments.
+        skipped: as in _apply_chunks()."""
+        copies = {}         #index -> [(Process, receiving Connection, started, duplicate)]
+        failures = {}       #index -> first failed outcome, while another copy runs
+        outcomes = {}       #index -> arguments of finish()
+        finishes = []       #(seconds, file size) of each successful attempt
+        position = finished = 0
+        try:
+            while finished < len(attempts):
+                while position < len(attempts) and _count_copies(copies) < processes:
+                    attempt = attempts[position]
+                    with self.lock:
+                        claimed = self._claim(attempt)
+                        if claimed:
+                            attempt._enter(alarm=False, measure=False)
+                    if claimed:
+                        copies[position] = [_spawn(processing, attempt.arguments, self.resources)]
+                    else:
+                        skipped.add(id(attempt))
+                    position += 1
+                if speculate and position == len(attempts):
+                    idle = processes - _count_copies(copies)
+                    for index in self._stragglers(
+                        attempts, copies, finishes, speculate, predicted
+                    )[:idle]:
+                        copies[index].append(_spawn(
+                            processing, attempts[index].arguments, self.resources, True
+                        ))
+                        self.speculated += 1
+                for index, running in copies.items():
+                    for worker_copy in list(running):
+                        outcome = _poll_worker(
+                            worker_copy[0], worker_copy[1], worker_copy[2], timeout
+                        )
+                        if outcome == None:
+                            continue
+                        worker_copy[1].close()
+                        running.remove(worker_copy)
+                        if _is_fatal(type(outcome[2])):
+                            self._raise_fatal(
+                                [(attempts[done], outcomes.pop(done))
+                                 for done in sorted(outcomes)]
+                                + [(attempts[index], outcome)]
+                            )
+                        if outcome[2] != None and running:
+                            failures.setdefault(index, outcome)
+                            continue
+                        if outcome[2] == None:
+                            self.speculation_wins += worker_copy[3]
+                            if speculate:
+                                finishes.append((
+                                    _seconds(outcome[1] - outcome[0]),
+                                    _file_size(attempts[index].arguments)
+                                ))
+                        else:
+                            #Every copy failed: the first failure is kept
+                            outcome = failures.get(index, outcome)
+                        failures.pop(index, None)
+                        outcomes[index] = outcome
+                        _terminate(running)
+                        del copies[index]
+                        break
+                if finished not in outcomes:
+                    time.sleep(_POLL_INTERVAL)
+                while finished in outcomes or (
+                    finished < position and id(attempts[finished]) in skipped
+                ):
+                    if finished in outcomes:
+                        attempts[finished].finish(*outcomes.pop(finished))
+                    finished += 1
+        finally:
+            for running in copies.values():
+                _terminate(running)
+    def _raise_fatal(self, finished):
+        """If an outcome of finished ((attempt, outcome) pairs) is a
+        NonSuppressedError, raise it without waiting for its turn: the other
+        outcomes are applied first, then the first fatal one - which
+        cancels the open and queued attempts (see switch_on_exit())."""
+        finished = list(finished)
+        fatal = [
+            (attempt, outcome) for attempt, outcome in finished
+            if _is_fatal(type(outcome[2]))
+        ]
+        if not fatal:
+            return
+        with self.lock:
+            for attempt, outcome in finished:
+                if not _is_fatal(type(outcome[2])):
+                    attempt.finish(*outcome)
+            attempt, outcome = fatal[0]
+            attempt.finish(*outcome)
+    def _stragglers(self, attempts, copies, finishes, factor, predicted):
+        """Indexes of attempts without a duplicate, running more than
+        factor times their expected duration - most overdue first.
+        predicted (see predict()) is the prior: it counts as one finished
+        attempt, averaged with the estimate from the successful attempts of
+        this run - by their seconds per byte, for attempts on a file; else
+        their median. Attempts with neither are never stragglers."""
+        median = rate = None
+        if finishes:
+            median = sorted(seconds for seconds, size in finishes)[len(finishes) // 2]
+        sized = [(seconds, size) for seconds, size in finishes if size]
+        if sized:
+            rate = sum(seconds for seconds, size in sized) / sum(size for seconds, size in sized)
+        now = datetime.datetime.now()
+        overdue = []
+        for index, running in copies.items():
+            if len(running) != 1:
+                continue
+            prior = predicted.get(attempts[index].arguments)
+            size = _file_size(attempts[index].arguments) if rate != None else None
+            observed = size * rate if size else median
+            if observed == None and prior == None:
+                continue
+            elif observed == None:
+                expected = prior
+            elif prior == None:
+                expected = observed
+            else:
+                expected = (prior + observed * len(finishes)) / (1 + len(finishes))
+            ratio = _seconds(now - running[0][2]) / max(expected, _POLL_INTERVAL)
+            if ratio > factor:
+                overdue.append((ratio, index))
+        return [index for ratio, index in sorted(overdue, reverse=True)]
+    def _map_threads(self, processing, arguments, threads, data):
+        attempts = [self.attempt(argument, data.get(argument)) for argument in arguments]
+        self._queue(attempts)
+        pool = multiprocessing.pool.ThreadPool(threads)
+        try:
+            #None for the attempts not claimed (see _claim())
+            called = list(pool.imap(
+                lambda attempt: self._call_queued(processing, attempt), attempts
+            ))
+            pool.close()
+        finally:
+            #Stops dispatch - threads already processing run to completion
+            pool.terminate()
+            pool.join()
+            self._unqueue(attempts)
+        return [attempt for attempt in called if attempt is not None]
             
-    def call(self, processing, argument):        
-        with self.attempt(argument) as attempt:
+    def call(self, processing, argument, data=None, timeout=None):
+        """Apply processing(argument) inside an attempt. Safe to call from
+        several threads at once. data: initial values of its record."""
+        with self.attempt(argument, data, timeout) as attempt:
             results = processing(argument)
         return attempt
+    def _call_queued(self, processing, attempt):
+        """Apply processing inside a queued attempt - unless close_attempts()
+        canceled it before a thread got to it. None if not claimed."""
+        if not self._claim(attempt):
+            return None
+        try:
+            with attempt:
+                processing(attempt.arguments)
+        except pa_exceptions.AttemptCanceled:
+            pass
+        return attempt
             
                 
 
@@ -707,31 +2248,290 @@ def LoggerDecorator(logpath, arguments):
     return outer
 
 
+def convert_log(logpath, codec, outpath=None):
+    """Rewrite the log at logpath with codec (a name in log_codecs.CODECS),
+    to outpath - or in place, if outpath is None. Records are read one at
+    a time, so large logs are not held in memory.
+    The source is only read: its journal, delta and node segments are
+    applied to the records written, but neither folded nor removed (in
+    place, the next open() applies them again, to the same records). Its
+    stored texts, including those of nodes, are copied to outpath."""
+    if not os.path.exists(logpath):
+        raise IOError("No log-file at '{0}'".format(logpath))
+    source = JSONProgressLog(logpath, lazy=True)
+    source.data = source.read()
+    try:
+        #Same order as JSONProgressLog.open()
+        for path in source._delta_paths() + source._node_paths():
+            source._replay(path)
+        source._replay(source.journalpath)
+        target = JSONProgressLog(outpath or logpath, codec=codec)
+        if target.textspath != source.textspath:
+            texts = source._read_texts()
+            if texts:
+                with open(target.textspath, mode='w') as fi:
+                    for digest, text in texts.iteritems():
+                        fi.write(json.dumps([digest, text]) + '\n')
+        target.write(source.data)
+    finally:
+        source.data.close()
+    return outpath or logpath
+
+
 #==============================================================================
 #    Local Utility Functions
 #==============================================================================
-def _convert_to_string(data):
-    '''Converts potentially abstract objects to strings.
-    Commonly used to convert JSON to dicts.'''
-    #basestrings: convert directly to string
-    if isinstance(data,basestring):
-        return str(data)
-    #Mappings: recurse on it's elements, and convert to a dict.
-    elif isinstance(data, collections.Mapping):
-        return dict(_convert_to_string(item) for item in data.iteritems())
-        #return dict(map(_convert_to_string, data.iteritems()))
-    #Iterables: recurse on it's elements, and preserve it's type.
-    elif isinstance(data, collections.Iterable):
-        return type(data)(_convert_to_string(elm) for elm in data)
-        #return type(data)(map(_convert_to_string, data))
-    #Others: no change
-    else:
-        return data
-def seq2tuple(obj):
-    if isinstance(obj, rich_core.NonStringSequence):
-        return tuple(obj)
-    else:
-        return obj
+def _truncate_torn(path, blocksize=65536):
+    """Cut a partial last line (from a crash mid-append) off the
+    JSON-lines file at path, so the next line appended starts on a line
+    of its own."""
+    if not os.path.exists(path):
+        return
+    with open(path, mode='rb+') as fi:
+        fi.seek(0, os.SEEK_END)
+        position = fi.tell()
+        if position == 0:
+            return
+        fi.seek(-1, os.SEEK_END)
+        if fi.read(1) == '\n':
+            return
+        while position > 0:
+            size = min(blocksize, position)
+            position -= size
+            fi.seek(position)
+            index = fi.read(size).rfind('\n')
+            if index != -1:
+                fi.truncate(position + index + 1)
+                return
+        fi.truncate(0)
+
+def _read_text_file(path):
+    """{digest: text} stored in path, by JSONProgressLog.store_text()."""
+    texts = {}
+    if os.path.exists(path):
+        with open(path, mode='r') as fi:
+            for line in fi:
+                try:
+                    digest, text = json.loads(line)
+                except ValueError:
+                    continue    #Truncated by a crash mid-append
+                texts[str(digest)] = str(text)
+    return texts
+
+def _stream_log_pairs(fileobj, chunksize=65536, codec=None):
+    """Yield (key, value) pairs from a log-file written by
+    JSONProgressLog.write(), in any of log_codecs.CODECS (detected from the
+    file's header, unless given). Elements are decoded one at a time, so
+    only a chunk of the file and a single element are held in memory
+    besides the results.
+    Raises ValueError if the file is not a complete log.
+    """
+    if codec == None:
+        codec = detect_codec(fileobj)
+    for (key, value), offset, length in codec.elements(fileobj, chunksize):
+        yield seq2tuple(codec.convert(key)), codec.convert(value)
+
+def _run_attempt(task):
+    """Worker side of ProcessLogger.map(processes=N). task is
+    (processing, argument, measure). Returns the arguments of
+    ProcessingAttempt.finish(): (started, stopped, exception, traceback,
+    usage) - usage being measured by accounting, if measure is True."""
+    processing, argument, measure = task
+    before = accounting.snapshot() if measure else None
+    started = datetime.datetime.now()
+    try:
+        processing(argument)
+    except Exception as exc:
+        return (
+            started, datetime.datetime.now(),
+            _picklable_exception(exc),
+            '\n'.join(traceback.format_tb(sys.exc_info()[2])),
+            _usage_since(before)
+        )
+    return started, datetime.datetime.now(), None, None, _usage_since(before)
+
+def _usage_since(before):
+    if before == None:
+        return None
+    return accounting.usage_since(before)
+
+def _spawn(processing, argument, measure, duplicate=False):
+    """Start a worker process running _send_attempt(). Returns
+    (Process, receiving Connection, started, duplicate)."""
+    receiver, sender = multiprocessing.Pipe(False)
+    worker = multiprocessing.Process(
+        target=_send_attempt, args=(sender, processing, argument, measure)
+    )
+    worker.daemon = True
+    worker.start()
+    sender.close()
+    return worker, receiver, datetime.datetime.now(), duplicate
+
+def _terminate(copies):
+    """Stop the worker processes of _spawn() copies."""
+    for worker, receiver, started, duplicate in copies:
+        worker.terminate()
+        worker.join()
+        receiver.close()
+
+def _count_copies(copies):
+    return sum(len(running) for running in copies.values())
+
+def _send_attempt(connection, processing, argument, measure):
+    """Worker side of ProcessLogger.map() with timeout or speculate: send the
+    outcome of _run_attempt() back through connection."""
+    connection.send(_run_attempt((processing, argument, measure)))
+    connection.close()
+
+def _poll_worker(worker, receiver, started, timeout):
+    """Outcome of a worker of _send_attempt(), as the arguments of
+    ProcessingAttempt.finish() - or None, if it is still running within
+    its timeout. Past its timeout, the worker is terminated."""
+    if receiver.poll():
+        try:
+            outcome = receiver.recv()
+        except EOFError:
+            outcome = None
+        worker.join()
+        if outcome != None:
+            return outcome
+    elif worker.is_alive():
+        now = datetime.datetime.now()
+        if timeout == None or _seconds(now - started) <= timeout:
+            return None
+        worker.terminate()
+        worker.join()
+        return (started, now, pa_exceptions.AttemptTimedOut(str.format(
+            "Processing ran past its timeout of {0} seconds: worker process terminated.",
+            timeout
+        )), '')
+    elif receiver.poll():
+        #Sent its outcome just before exiting
+        return _poll_worker(worker, receiver, started, timeout)
+    worker.join()
+    return (started, datetime.datetime.now(), RuntimeError(str.format(
+        "Worker process exited with code {0}, before sending an outcome.",
+        worker.exitcode
+    )), '')
+
+def _run_chunk(task):
+    """Worker side of ProcessLogger.map(chunksize='auto'). task is
+    (processing, arguments, measure). Returns a list of _run_attempt() outcomes."""
+    processing, arguments, measure = task
+    return [_run_attempt((processing, argument, measure)) for argument in arguments]
+
+def _seconds(delta):
+    """datetime.timedelta.total_seconds(), which Python 2.6 lacks."""
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+def _picklable_exception(exc):
+    """exc, or - if it does not survive pickling - a stand-in carrying its
+    type name and message."""
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:
+        if isinstance(exc, pa_exceptions.NonSuppressedError):
+            stand_in = pa_exceptions.NonSuppressedError
+        else:
+            stand_in = RuntimeError
+        return stand_in("{0}: {1}".format(type(exc).__name__, exc))
+
+def _state_name(state):
+    """Name of the group in States containing state (ex. 'done' ->
+    'completed'), or None if state is in none of them. Memoized, since
+    attempts check states several times each, and resolving an alias
+    through States scans every group."""
+    try:
+        return _STATE_NAMES[state]
+    except KeyError:
+        try:
+            name = States[state].name
+        except ValueError:
+            name = None
+        _STATE_NAMES[state] = name
+        return name
+_STATE_NAMES = {}
+
+def _owner():
+    """Owner of attempts started in this process: [host, pid]."""
+    return [socket.gethostname(), os.getpid()]
+
+def _peek(log, key):
+    """log.peek(key) - for logs without it, log.get(key) - or {}."""
+    if hasattr(log, 'peek'):
+        return log.peek(key) or {}
+    return log.get(key) or {}
+
+def _is_stale(record, stale_after):
+    """True if the owner of an 'attempting' record has stopped: it is a
+    process on this host which no longer exists, or its heartbeat is more
+    than stale_after seconds old. Records from before owners and
+    heartbeats were recorded are always stale."""
+    owner, heartbeat = record.get('owner'), record.get('heartbeat')
+    if owner == None or heartbeat == None:
+        return True
+    host, pid = owner
+    if host == socket.gethostname() and not _process_exists(pid):
+        return True
+    return time.time() - heartbeat > stale_after
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+def _parse_elapsed(text):
+    """Seconds in str(datetime.timedelta), as stored in 'elapsed'.
+    ex. '0:02:31.5' or '1 day, 2:00:00'. None if missing or unreadable."""
+    if not isinstance(text, basestring):
+        return None
+    match = _ELAPSED.match(text)
+    if not match:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return (int(days or 0) * 86400 + int(hours) * 3600 + int(minutes) * 60
+            + float(seconds))
+_ELAPSED = re.compile(r'^(?:(-?\d+) days?, )?(\d+):(\d\d):(\d\d(?:\.\d+)?)$')
+
+def _file_size(argument):
+    """Size in bytes of the first file named by a string in argument
+    (or argument itself), or None."""
+    for part in _key_parts(argument):
+        if isinstance(part, basestring) and os.path.isfile(part):
+            return os.path.getsize(part)
+    return None
+
+def _is_fatal(exc_type):
+    """True if exc_type is an exception no attempt may suppress."""
+    return exc_type != None and issubclass(exc_type, pa_exceptions.NonSuppressedError)
+
+class _Returned(object):
+    """Callback of the chunks ProcessLogger._apply_chunks() sends to a
+    pool, counting those returned. Called only by the pool's result
+    thread, so the count needs no lock."""
+    def __init__(self):
+        self.count = 0
+        self.event = threading.Event()
+    def __call__(self, outcomes):
+        self.count += 1
+        self.event.set()
+    def wait(self):
+        """Wait for a chunk to return. A chunk which fails to run is never
+        counted, and a counted chunk is ready only once this returns: so
+        wait a poll interval at most."""
+        self.event.wait(_POLL_INTERVAL)
+        self.event.clear()
+
+class _NoLock(object):
+    """Stand-in for the lock of a log which has none (ex. a dict)."""
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+_NO_LOCK = _NoLock()
 
 def _summarize_attempt(record, arguments):
     """
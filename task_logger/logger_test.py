@@ -3,11 +3,23 @@ import os
 import random
 import copy
 import collections
+import gc
+import json
+import multiprocessing
+import shutil
+import signal
+import socket
+import threading
+import time
 #-----
 from local_packages import rich_core
 #-----
 from logger import JSONProgressLog, ProcessingAttempt, States, ProcessLogger
+from logger import _stream_log_pairs, _convert_to_string
+from pa_exceptions import NonSuppressedError, AttemptTimedOut, AttemptAlreadyInProgress
+from retry import RetryPolicy
 from data import read_dir, CompoundDataSet
+import benchmark
 
 
 
@@ -58,6 +70,1109 @@ class JSONProgressLogTests(unittest.TestCase):
         self.assert_(otherlog.opened)
         otherlog.close()
 
+    def test_streaming_read(self):
+        with JSONProgressLog(self.name) as log:
+            for i in range(50):
+                log[('/data/file_{0}.sdf'.format(i), i)] = {
+                    'state':'errored', 'exc_value':'say "]," [x] '*i, 'results':[i, {'n':i}]
+                }
+        with open(self.name) as fi:
+            expected = _convert_to_string(log.unserialize(json.load(fi)))
+        for chunksize in (7, 64, 65536):
+            with open(self.name) as fi:
+                streamed = dict(_stream_log_pairs(fi, chunksize=chunksize))
+            self.assertEqual(streamed, expected)
+
+    def test_streaming_truncated(self):
+        with JSONProgressLog(self.name) as log:
+            log['testdata'] = ['foo','bar']
+        with open(self.name) as fi:
+            text = fi.read()
+        with open(self.name, 'w') as fi:
+            fi.write(text[:len(text)//2])
+        with open(self.name) as fi:
+            self.assertRaises(ValueError, dict, _stream_log_pairs(fi, chunksize=4))
+
+
+class PrefixKeysTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "prefix-test-log.json"
+        self.directory = "/data/htdocs/cccid/build/compounds-db/data-files/virtual_chemistry/"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def make_log(self, **options):
+        with JSONProgressLog(self.name, **options) as log:
+            for i in range(20):
+                key = (self.directory + 'Virtual_Chemistry_{0}.sdf'.format(i), 'import')
+                log[key] = {'state':'completed'}
+            log['/single/string/key'] = {'state':'new'}
+            log[(1, 2)] = {'state':'new'}
+        return os.path.getsize(self.name)
+
+    def test_round_trip(self):
+        plain_size = self.make_log()
+        compressed_size = self.make_log(prefix_keys=True)
+        self.assert_(compressed_size < plain_size)
+        for lazy in (False, True):
+            with JSONProgressLog(self.name, lazy=lazy) as log:
+                key = (self.directory + 'Virtual_Chemistry_3.sdf', 'import')
+                self.assertEqual(log[key], {'state':'completed'})
+                self.assertEqual(log['/single/string/key'], {'state':'new'})
+                self.assertEqual(log[(1, 2)], {'state':'new'})
+                self.assertEqual(len(log), 22)
+
+    def test_interned_keys(self):
+        self.make_log(prefix_keys=True)
+        with JSONProgressLog(self.name) as log:
+            tasks = set(id(key[1]) for key in log if isinstance(key, tuple) and len(key) == 2
+                        and key[1] == 'import')
+            self.assertEqual(len(tasks), 1)
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "json-checkpoint-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_checkpoint_every(self):
+        with JSONProgressLog(self.name, checkpoint_every=2) as log:
+            for i in range(3):
+                with ProcessingAttempt(log, ('file', i)) as attempt:
+                    pass
+            with JSONProgressLog(self.name) as otherlog:
+                self.assertEqual(len(otherlog), 2)
+        with JSONProgressLog(self.name) as otherlog:
+            self.assertEqual(len(otherlog), 3)
+
+    def test_checkpoint_interval(self):
+        with JSONProgressLog(self.name, checkpoint_interval=0) as log:
+            with ProcessingAttempt(log, ('file', 0)) as attempt:
+                pass
+            with JSONProgressLog(self.name) as otherlog:
+                self.assertEqual(len(otherlog), 1)
+
+    def test_atomic_write(self):
+        for fsync in ('none', 'file', 'directory'):
+            with JSONProgressLog(self.name, fsync=fsync) as log:
+                log['testdata'] = ['foo', fsync]
+            self.assert_(not os.path.exists(self.name + '.tmp'))
+            with JSONProgressLog(self.name) as otherlog:
+                self.assertEqual(otherlog['testdata'], ['foo', fsync])
+
+    def test_corrupt_log_is_kept(self):
+        with JSONProgressLog(self.name) as log:
+            log['testdata'] = ['foo','bar']
+        with open(self.name) as fi:
+            text = fi.read()
+        with open(self.name, 'w') as fi:
+            fi.write(text[:len(text)//2])
+        self.assertRaises(ValueError, JSONProgressLog(self.name).open)
+        with open(self.name) as fi:
+            self.assertEqual(fi.read(), text[:len(text)//2])
+
+
+class JSONJournalTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "json-journal-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_attempt_appends(self):
+        with JSONProgressLog(self.name, journal=True) as log:
+            with ProcessingAttempt(log, ('a',)) as attempt:
+                attempt['results'] = 'foo'
+            with open(log.journalpath) as fi:
+                self.assertEqual(len(fi.readlines()), 1)
+        with JSONProgressLog(self.name, journal=True) as otherlog:
+            self.assertEqual(otherlog[('a',)]['results'], 'foo')
+            self.assertEqual(otherlog[('a',)]['state'], 'completed')
+
+    def test_last_write_wins(self):
+        with JSONProgressLog(self.name, journal=True) as log:
+            log['testdata'] = ['foo']
+            log.commit('testdata')
+            log['testdata'] = ['bar']
+            log['moredata'] = ['bababar']
+        with JSONProgressLog(self.name, journal=True) as log:
+            self.assertEqual(log['testdata'], ['bar'])
+            del log['moredata']
+        with JSONProgressLog(self.name, journal=True) as log:
+            self.assert_('moredata' not in log)
+
+    def test_compact(self):
+        with JSONProgressLog(self.name, journal=True) as log:
+            log['testdata'] = ['foo','bar']
+            log.commit('testdata')
+            log.compact()
+            self.assertEqual(os.path.getsize(log.journalpath), 0)
+        with JSONProgressLog(self.name) as otherlog:
+            self.assertEqual(otherlog['testdata'], ['foo','bar'])
+
+    def test_truncated_line(self):
+        with JSONProgressLog(self.name, journal=True) as log:
+            log['testdata'] = ['foo']
+        with open(log.journalpath, 'a') as fi:
+            fi.write('[["partial"')
+        with JSONProgressLog(self.name, journal=True) as log:
+            self.assertEqual(log['testdata'], ['foo'])
+            #Appended on a line of its own, not onto the torn one
+            log['b'] = ['bar']
+        with JSONProgressLog(self.name, journal=True) as log:
+            self.assertEqual(log['b'], ['bar'])
+
+    def test_damaged_line(self):
+        #Only the last line may be torn: elsewhere, a bad line is damage
+        with JSONProgressLog(self.name, journal=True) as log:
+            log['testdata'] = ['foo']
+        with open(log.journalpath) as fi:
+            entries = fi.read()
+        with open(log.journalpath, 'w') as fi:
+            fi.write('[["partial"\n' + entries)
+        self.assertRaises(ValueError, JSONProgressLog(self.name, journal=True).open)
+
+
+class JSONDeltaTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "json-delta-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_flush_writes_only_changes(self):
+        with JSONProgressLog(self.name, delta=True) as log:
+            for i in range(100):
+                log[('file', i)] = {'state':'new'}
+            log.flush()
+            with ProcessingAttempt(log, ('file', 3)) as attempt:
+                attempt['results'] = 'foo'
+            del log[('file', 4)]
+            log.flush()
+            paths = log._delta_paths()
+        self.assertEqual(len(paths), 2)
+        with open(paths[1]) as fi:
+            self.assertEqual(len(fi.readlines()), 2)
+        with JSONProgressLog(self.name, delta=True) as log:
+            self.assertEqual(len(log), 99)
+            self.assertEqual(log[('file', 3)]['state'], 'completed')
+            self.assert_(('file', 4) not in log)
+
+    def test_flush_without_changes(self):
+        with JSONProgressLog(self.name, delta=True) as log:
+            log.flush()
+            self.assertEqual(log._delta_paths(), [])
+
+    def test_merge_every(self):
+        with JSONProgressLog(self.name, delta=True, merge_every=3) as log:
+            for i in range(5):
+                log[('file', i)] = {'state':'new'}
+                log.flush()
+            self.assertEqual(len(log._delta_paths()), 2)
+        with JSONProgressLog(self.name) as otherlog:
+            self.assertEqual(len(otherlog), 5)
+            self.assertEqual(otherlog._delta_paths(), [])
+
+
+
+class LazyTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "lazy-test-log.json"
+        _remove_log_files(self.name)
+        with JSONProgressLog(self.name) as log:
+            for i in range(20):
+                log[('file', i)] = {
+                    'state':['completed', 'errored'][i % 2],
+                    'exc_traceback':'line\n' * i
+                }
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_state_without_record(self):
+        with JSONProgressLog(self.name, lazy=True) as log:
+            self.assertEqual(log.state_of(('file', 3)), 'errored')
+            self.assertEqual(len(log.data._loaded), 0)
+            self.assertEqual(sorted(log.keys_in_state('completed'))[0], ('file', 0))
+            self.assertEqual(len(log.data._loaded), 0)
+            self.assertEqual(log[('file', 3)]['exc_traceback'], 'line\n' * 3)
+            self.assertEqual(len(log.data._loaded), 1)
+            self.assertEqual(len(log), 20)
+
+    def test_modify_and_rewrite(self):
+        with JSONProgressLog(self.name, lazy=True) as log:
+            log[('file', 3)]['state'] = 'completed'
+            del log[('file', 4)]
+            log[('file', 99)] = {'state':'new'}
+            log.flush()
+            self.assertEqual(log.state_of(('file', 3)), 'completed')
+            self.assertEqual(log[('file', 5)]['exc_traceback'], 'line\n' * 5)
+        with JSONProgressLog(self.name) as otherlog:
+            self.assertEqual(len(otherlog), 20)
+            self.assertEqual(otherlog[('file', 3)]['state'], 'completed')
+            self.assert_(('file', 4) not in otherlog)
+
+    def test_attempts_keep_only_their_records(self):
+        keys = [('file', i) for i in range(20)]
+        with ProcessLogger(self.name, lazy=True) as log:
+            attempts = [log.attempt(key) for key in keys]
+            self.assertEqual(len(log.data._loaded), 0)
+            with attempts[3]:
+                pass
+            self.assertEqual(log.data._loaded.keys(), [('file', 3)])
+            log.predict(keys)
+            log.pending(keys)
+            self.assertEqual(len(log.data._loaded), 1)
+            #Rewritten: kept records are dropped, and read again on demand
+            log.flush()
+            self.assertEqual(len(log.data._loaded), 0)
+            self.assertEqual(log[('file', 3)]['state'], 'completed')
+
+    def test_items_not_kept(self):
+        with ProcessLogger(self.name, lazy=True) as log:
+            log.summary()
+            self.assertEqual(len(log.items()), 20)
+            self.assertEqual(len(log.values()), 20)
+            self.assertEqual(len(log.data._loaded), 0)
+
+    def test_attempt(self):
+        with ProcessLogger(self.name, lazy=True) as log:
+            with log.attempt(('file', 100)) as attempt:
+                attempt['results'] = 'foo'
+            self.assertEqual(log.state_of(('file', 100)), 'completed')
+        with ProcessLogger(self.name, lazy=True) as log:
+            self.assertEqual(log[('file', 100)]['results'], 'foo')
+
+
+class DedupeTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "dedupe-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def run_failing(self, log, count):
+        for i in range(count):
+            with log.attempt(('file', i)) as attempt:
+                raise RuntimeError("Same error every time")
+
+    def test_traceback_stored_once(self):
+        with ProcessLogger(self.name, dedupe=['exc_traceback', 'exc_value']) as log:
+            self.run_failing(log, 10)
+            self.assertEqual(len(log.texts), 2)
+            record = log[('file', 3)]
+            self.assert_('exc_traceback' not in record)
+            self.assert_('exc_value_id' in record)
+        with open(self.name + '.texts') as fi:
+            self.assertEqual(len(fi.readlines()), 2)
+        with ProcessLogger(self.name) as log:
+            record = log.resolve(log[('file', 3)])
+            self.assertEqual(record['exc_value'], "Same error every time")
+            self.assert_('run_failing' in record['exc_traceback'])
+            self.assert_("RuntimeError: Same error every time" in log.summary())
+
+    def test_without_dedupe(self):
+        with ProcessLogger(self.name) as log:
+            self.run_failing(log, 2)
+            self.assert_('exc_traceback' in log[('file', 1)])
+            self.assertEqual(log.resolve(log[('file', 1)]), log[('file', 1)])
+        self.assert_(not os.path.exists(self.name + '.texts'))
+
+
+class WriteBehindTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "write-behind-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_delta_write_behind(self):
+        with ProcessLogger(self.name, write_behind=True) as log:
+            for i in range(20):
+                with log.attempt(('file', i)) as attempt:
+                    attempt['results'] = i
+            log.flusher.drain()
+            self.assert_(log.flusher.records_flushed >= 20)
+            self.assertEqual(log.flusher.queue_depth, 0)
+            flusher = log.flusher
+        self.assert_(not flusher.is_alive())
+        self.assertEqual(log._delta_paths(), [])
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(len(log), 20)
+            self.assertEqual(log[('file', 7)]['results'], 7)
+
+    def test_journal_write_behind(self):
+        with ProcessLogger(self.name, write_behind=True, journal=True) as log:
+            with log.attempt(('file', 0)) as attempt:
+                raise RuntimeError("Intentional")
+        with ProcessLogger(self.name, journal=True) as log:
+            self.assertEqual(log[('file', 0)]['state'], 'errored')
+
+    def test_failed_flusher(self):
+        def failing_persist(entries):
+            raise IOError("NFS went away")
+        log = ProcessLogger(self.name, write_behind=True, journal=True)
+        log._persist_entries = failing_persist
+        log.open()
+        with log.attempt(('file', 0)) as attempt:
+            pass
+        self.assertRaises(IOError, log.flush)
+        self.assertRaises(IOError, log.commit, ('file', 0))
+        #Still closed, though the flusher raises
+        self.assertRaises(IOError, log.close)
+        self.assertEqual(log.flusher, None)
+        self.assert_(not log.opened)
+        self.assertEqual(log._journal_file, None)
+
+
+class MapTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "map-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_sequential_and_processes_agree(self):
+        records = []
+        for processes in (None, 3):
+            _remove_log_files(self.name)
+            with ProcessLogger(self.name) as log:
+                attempts = log.map(odd_failing_processing, range(10), processes=processes)
+                self.assertEqual([attempt.arguments for attempt in attempts], range(10))
+            with ProcessLogger(self.name) as log:
+                records.append(dict(
+                    (key, (record['state'], record.get('exc_type'), record.get('exc_value')))
+                    for key, record in log.items()
+                ))
+                self.assert_('odd_failing_processing' in log[3]['exc_traceback'])
+                self.assert_('elapsed' in log[4])
+        self.assertEqual(records[0], records[1])
+        self.assertEqual(records[1][3], ('errored', 'ValueError', 'Odd argument: 3'))
+        self.assertEqual(records[1][4][0], 'completed')
+
+    def test_non_suppressed_error(self):
+        with ProcessLogger(self.name) as log:
+            self.assertRaises(NonSuppressedError,
+                log.map, non_suppressed_processing, range(6), processes=2)
+            self.assertEqual(log[3]['state'], 'errored')
+            self.assertEqual(log[3]['exc_type'], 'NonSuppressedError')
+            #Every other argument was sent at once: each finished before the
+            #error arrived, or was canceled in flight
+            for number in (0, 1, 2, 4, 5):
+                if log[number]['state'] != 'completed':
+                    self.assertEqual(log[number]['exc_type'], 'AttemptCanceled')
+                    self.assert_('Stop at 3' in log[number]['exc_value'])
+
+    def test_fatal_out_of_order(self):
+        #A fatal error is raised when it arrives, not once the slow
+        #attempt before it finishes
+        for options in ({}, {'chunksize': 'auto'}, {'timeout': 30}):
+            _remove_log_files(self.name)
+            with ProcessLogger(self.name) as log:
+                started = time.time()
+                self.assertRaises(NonSuppressedError,
+                    log.map, slow_then_fatal_processing, range(40), processes=2, **options)
+                self.assert_(time.time() - started < 2, options)
+                self.assertEqual(log[1]['exc_type'], 'NonSuppressedError')
+                self.assertEqual(log[0]['exc_type'], 'AttemptCanceled')
+                self.assert_(len(list(log.keys_in_state('completed'))) < 10, options)
+                self.assertEqual(log.open_count, 0)
+
+    def test_cancel_threads(self):
+        with ProcessLogger(self.name, journal=True) as log:
+            self.assertRaises(NonSuppressedError,
+                log.map, slow_or_fatal_processing, range(2), threads=2)
+            #In flight when the error was raised: its later success is ignored
+            self.assertEqual(log[0]['exc_type'], 'AttemptCanceled')
+            self.assertEqual(log[1]['exc_type'], 'NonSuppressedError')
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(log[0]['exc_type'], 'AttemptCanceled')
+
+    def test_cancel_queued_threads(self):
+        #Arguments still queued for the threads are canceled, and never start
+        with ProcessLogger(self.name) as log:
+            self.assertRaises(NonSuppressedError,
+                log.map, fatal_at_one_processing, range(20), threads=2)
+            self.assertEqual(log[1]['exc_type'], 'NonSuppressedError')
+            for number in [0] + range(2, 20):
+                self.assertEqual(log[number]['exc_type'], 'AttemptCanceled')
+            self.assertEqual(sorted(FATAL_STARTED), [0, 1])
+
+    def test_cancel_nested(self):
+        #Canceled by the inner attempt, the outer one still lets the error through
+        def nested(log):
+            with log.attempt('outer'):
+                with log.attempt('inner'):
+                    raise NonSuppressedError("Database gone")
+                log['after'] = {'state': 'completed'}
+        with ProcessLogger(self.name) as log:
+            self.assertRaises(NonSuppressedError, nested, log)
+            self.assertEqual(log['inner']['exc_type'], 'NonSuppressedError')
+            self.assertEqual(log['outer']['exc_type'], 'AttemptCanceled')
+            self.assert_('after' not in log)
+
+    def test_threads(self):
+        start = time.time()
+        with ProcessLogger(self.name, journal=True) as log:
+            attempts = log.map(sleeping_processing, range(8), threads=4)
+            self.assertEqual([attempt.arguments for attempt in attempts], range(8))
+        self.assert_(time.time() - start < 8 * 0.1)
+        with ProcessLogger(self.name) as log:
+            for number in range(8):
+                record = log[number]
+                if number % 2:
+                    self.assertEqual(record['exc_value'], 'Odd argument: {0}'.format(number))
+                else:
+                    self.assertEqual(record['state'], 'completed')
+                #Each attempt is timed from its own start, not the map's
+                self.assert_(record['elapsed'].startswith('0:00:00.1'), record['elapsed'])
+                self.assert_(record['started'] < record['stopped'])
+
+    def test_chunks(self):
+        expected = None
+        for chunksize in (1, 3, 'auto'):
+            _remove_log_files(self.name)
+            with ProcessLogger(self.name) as log:
+                attempts = log.map(odd_failing_processing, range(40),
+                                   processes=2, chunksize=chunksize)
+                self.assertEqual([attempt.arguments for attempt in attempts], range(40))
+                states = dict((key, record['state']) for key, record in log.items())
+                self.assertEqual(log[7]['exc_value'], 'Odd argument: 7')
+            if expected != None:
+                self.assertEqual(states, expected)
+            expected = states
+        self.assert_(log.chunker.chunks > 1)
+        self.assertRaises(ValueError, log.map, odd_failing_processing, range(2), chunksize=5)
+
+    def test_processes_or_threads(self):
+        with ProcessLogger(self.name) as log:
+            self.assertRaises(ValueError,
+                log.map, sleeping_processing, range(2), processes=2, threads=2)
+
+    def test_unpicklable_exception(self):
+        with ProcessLogger(self.name) as log:
+            log.map(unpicklable_processing, ['a'], processes=1)
+            self.assertEqual(log['a']['state'], 'errored')
+            self.assert_('UnpicklableError' in log['a']['exc_value'])
+
+
+class PendingTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "pending-test-log.json"
+        _remove_log_files(self.name)
+        with ProcessLogger(self.name) as log:
+            log['a'] = {'state':'completed'}
+            log['b'] = {'state':'done'}
+            log['c'] = {'state':'errored'}
+            log['d'] = {'state':'running', 'owner':[socket.gethostname(), os.getpid()],
+                        'heartbeat':time.time() + 3600}
+            log['e'] = {'state':'new'}
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_pending(self):
+        for lazy in (False, True):
+            with ProcessLogger(self.name, lazy=lazy) as log:
+                self.assertEqual(log.pending('abcdef'), ['c', 'e', 'f'])
+                self.assertEqual(log.pending_counts, {
+                    'completed': 2, 'errored': 1, 'attempting': 1, 'new': 2,
+                    'dispatched': 3, 'skipped': 3
+                })
+
+    def test_map_skips_finished(self):
+        with ProcessLogger(self.name) as log:
+            attempts = log.map(odd_failing_processing, 'abcdef')
+            self.assertEqual([attempt.arguments for attempt in attempts], ['c', 'e', 'f'])
+            self.assertEqual(log.pending_counts['skipped'], 3)
+            #Untouched by the rerun
+            self.assertEqual(log['b'], {'state':'done'})
+            self.assertEqual(log['d']['state'], 'running')
+            self.assertEqual(log['f']['state'], 'completed')
+
+
+class RetryTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "retry-test-log.json"
+        _remove_log_files(self.name)
+        _remove_log_files(FLAKY_MARKER)
+    def tearDown(self):
+        _remove_log_files(self.name)
+        _remove_log_files(FLAKY_MARKER)
+
+    def test_retries(self):
+        policies = {
+            Exception: RetryPolicy(max_attempts=3, delay=0.01),
+            KeyError: None
+        }
+        for mode in [{}, {'threads': 2}, {'processes': 2}]:
+            _remove_log_files(self.name)
+            _remove_log_files(FLAKY_MARKER)
+            with ProcessLogger(self.name) as log:
+                attempts = log.map(flaky_processing, [1, 2, 5, 'key'], retry=policies, **mode)
+                self.assertEqual([attempt.arguments for attempt in attempts], [1, 2, 5, 'key'])
+            with ProcessLogger(self.name) as log:
+                self.assertEqual(log[1]['state'], 'completed')
+                self.assertEqual(log[1]['attempts'], 2)
+                self.assertEqual(len(log[1]['failures']), 1)
+                self.assertEqual(log[2]['state'], 'completed')
+                self.assertEqual(log[2]['attempts'], 3)
+                self.assertEqual(
+                    [failure['exc_value'] for failure in log[2]['failures']],
+                    ['Failure 1 of 2', 'Failure 2 of 2']
+                )
+                #Gave up after max_attempts
+                self.assertEqual(log[5]['state'], 'errored')
+                self.assertEqual(log[5]['attempts'], 3)
+                self.assertEqual(len(log[5]['failures']), 2)
+                #Never retried
+                self.assertEqual(log['key']['exc_type'], 'KeyError')
+                self.assertEqual(log['key']['attempts'], 1)
+                self.assert_('failures' not in log['key'])
+
+
+class LongestFirstTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "longest-test-log.json"
+        self.files = ["longest-test-file-{0}".format(size) for size in (10, 1000, 100)]
+        for path in self.files:
+            with open(path, 'w') as fi:
+                fi.write('x' * int(path.rsplit('-', 1)[1]))
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+        _remove_log_files("longest-test-file")
+        del ORDER[:]
+
+    def test_sizes_only(self):
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(log.predict(self.files), dict.fromkeys(self.files))
+            self.assertEqual(
+                log.longest_first(self.files + ['not-a-file']),
+                [self.files[1], self.files[2], self.files[0], 'not-a-file']
+            )
+
+    def test_elapsed_and_sizes(self):
+        small, large, medium = self.files
+        with ProcessLogger(self.name) as log:
+            #The smallest file was slow last time: 20 ms per byte
+            log[small] = {'state':'errored', 'elapsed':'0:00:00.200000'}
+            log['other'] = {'state':'errored', 'elapsed':'0:00:05'}
+            predictions = log.predict(self.files + ['other', 'unknown'])
+            self.assertAlmostEqual(predictions[large], 20.0)
+            self.assertAlmostEqual(predictions[medium], 2.0)
+            self.assertEqual(predictions['unknown'], None)
+            self.assertEqual(
+                log.longest_first(self.files + ['other', 'unknown']),
+                ['unknown', large, 'other', medium, small]
+            )
+
+    def test_map(self):
+        with ProcessLogger(self.name) as log:
+            attempts = log.map(ordered_processing, self.files, longest_first=True)
+            self.assertEqual(ORDER, [self.files[1], self.files[2], self.files[0]])
+            self.assertEqual([attempt.arguments for attempt in attempts], self.files)
+
+
+class StartFinishTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "start-finish-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_interleaved(self):
+        #As callback-driven code would: all started, finished out of order
+        with ProcessLogger(self.name) as log:
+            attempts = [log.attempt((name,)).start() for name in ['a', 'b', 'c']]
+            self.assertEqual(log[('b',)]['state'], 'attempting')
+            attempts[2].finish()
+            attempts[0].finish(exc_value=IOError("Connection reset"),
+                               remote_traceback='  File "fetch.py", line 3\n')
+            self.assertRaises(NonSuppressedError,
+                attempts[1].finish, exc_value=NonSuppressedError("Stop"))
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(log[('c',)]['state'], 'completed')
+            self.assertEqual(log[('a',)]['exc_type'], 'IOError')
+            self.assertEqual(log[('a',)]['exc_traceback'], '  File "fetch.py", line 3\n')
+            self.assertEqual(log[('b',)]['state'], 'errored')
+            self.assert_(log[('a',)]['started'] < log[('a',)]['stopped'])
+
+
+
+class TimeoutTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "timeout-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_attempt(self):
+        with ProcessLogger(self.name) as log:
+            started = time.time()
+            with log.attempt(('hangs',), timeout=0.2) as attempt:
+                time.sleep(30)
+            self.assert_(time.time() - started < 5)
+            with log.attempt(('quick',), timeout=5) as attempt:
+                pass
+            #Timer and handler are restored
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+            self.assertEqual(signal.getsignal(signal.SIGALRM), signal.SIG_DFL)
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(log[('hangs',)]['state'], 'errored')
+            self.assertEqual(log[('hangs',)]['exc_type'], 'AttemptTimedOut')
+            self.assertEqual(log[('quick',)]['state'], 'completed')
+
+    def test_nested(self):
+        with ProcessLogger(self.name) as log:
+            #A nested attempt does not cancel the enclosing deadline
+            started = time.time()
+            with log.attempt('outer', timeout=0.5) as outer:
+                with log.attempt('inner', timeout=5) as inner:
+                    pass
+                time.sleep(2)
+            self.assert_(time.time() - started < 1.5)
+            self.assertEqual(log['inner']['state'], 'completed')
+            self.assertEqual(log['outer']['exc_type'], 'AttemptTimedOut')
+            #The enclosing timer runs out during the nested attempt
+            with log.attempt('outer-2', timeout=0.3) as outer:
+                with log.attempt('inner-2', timeout=5) as inner:
+                    time.sleep(2)
+            self.assertEqual(log['inner-2']['exc_type'], 'AttemptTimedOut')
+            self.assert_('enclosing' in log['inner-2']['exc_value'])
+            self.assertEqual(log['outer-2']['exc_type'], 'AttemptTimedOut')
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+            self.assertEqual(signal.getsignal(signal.SIGALRM), signal.SIG_DFL)
+
+    def test_map(self):
+        for processes in (None, 2):
+            _remove_log_files(self.name)
+            with ProcessLogger(self.name) as log:
+                started = time.time()
+                attempts = log.map(hanging_processing, range(5), processes=processes, timeout=0.5)
+                self.assert_(time.time() - started < 10)
+                self.assertEqual([attempt.arguments for attempt in attempts], range(5))
+            with ProcessLogger(self.name) as log:
+                self.assertEqual(log[2]['exc_type'], 'AttemptTimedOut')
+                self.assertEqual(log[3]['exc_type'], 'ValueError')
+                self.assertEqual(
+                    [log[number]['state'] for number in (0, 1, 4)], ['completed'] * 3
+                )
+
+    def test_worker_exits(self):
+        with ProcessLogger(self.name) as log:
+            log.map(exiting_processing, range(3), processes=2, timeout=5)
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(log[1]['exc_type'], 'RuntimeError')
+            self.assert_('code 3' in log[1]['exc_value'])
+            self.assertEqual(log[2]['state'], 'completed')
+
+    def test_cooperative(self):
+        with ProcessLogger(self.name) as log:
+            attempt = log.attempt(('callback',), timeout=0.1).start()
+            self.assert_(not attempt.expired())
+            time.sleep(0.2)
+            self.assert_(attempt.expired())
+            self.assertRaises(AttemptTimedOut, attempt.check_timeout)
+            attempt.finish(exc_value=AttemptTimedOut("Canceled"), remote_traceback="")
+            self.assertEqual(log[('callback',)]['exc_type'], 'AttemptTimedOut')
+
+    def test_invalid(self):
+        with ProcessLogger(self.name) as log:
+            self.assertRaises(
+                ValueError, log.map, hanging_processing, range(3), threads=2, timeout=1
+            )
+            self.assertRaises(ValueError, log.map, hanging_processing, range(3),
+                              processes=2, chunksize='auto', timeout=1)
+            self.assertRaises(ValueError, log.attempt, ('a',), timeout=0)
+
+
+
+class SpeculationTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "speculation-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_straggler(self):
+        with ProcessLogger(self.name) as log:
+            started = time.time()
+            attempts = log.map(straggling_processing, range(6), processes=2, speculate=True)
+            self.assert_(time.time() - started < 10)
+            self.assertEqual([attempt.arguments for attempt in attempts], range(6))
+            self.assertEqual((log.speculated, log.speculation_wins), (1, 1))
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(list(log.keys_in_state('completed')), range(6))
+
+    def test_prior(self):
+        #Nothing else finishes in this run: the straggler is expected to
+        #take as long as its previous attempt did
+        with ProcessLogger(self.name) as log:
+            log[5] = {'state':'errored', 'elapsed':'0:00:00.050000'}
+            started = time.time()
+            log.map(straggling_processing, [5], processes=2, speculate=True)
+            self.assert_(time.time() - started < 10)
+            self.assertEqual((log.speculated, log.speculation_wins), (1, 1))
+            self.assertEqual(log[5]['state'], 'completed')
+
+    def test_needs_processes(self):
+        with ProcessLogger(self.name) as log:
+            self.assertRaises(ValueError, log.map, straggling_processing, range(3), speculate=True)
+            self.assertRaises(ValueError, log.map, straggling_processing, range(3),
+                              processes=2, chunksize=2, speculate=True)
+
+
+
+class ResumeTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "resume-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def process(self, log, fail_at=None):
+        """Count 'records' of a file, from its resume_point."""
+        with log.attempt(('big.sdf',)) as attempt:
+            start = (attempt.resume_point or {}).get('records', 0)
+            for record in range(start, 10):
+                if record == fail_at:
+                    raise IOError("NFS handle went stale")
+                if record % 3 == 0:
+                    attempt.checkpoint(records=record, offset=record * 100)
+        return attempt, start
+
+    def test_resume(self):
+        with ProcessLogger(self.name) as log:
+            attempt, start = self.process(log, fail_at=8)
+            self.assertEqual((attempt.resume_point, start), (None, 0))
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(log[('big.sdf',)]['progress'], {'records': 6, 'offset': 600})
+            #Fails again before any checkpoint: the resume point is kept
+            attempt, start = self.process(log, fail_at=6)
+            self.assertEqual(start, 6)
+            self.assertEqual(log[('big.sdf',)]['progress'], {'records': 6, 'offset': 600})
+            attempt, start = self.process(log)
+            self.assertEqual(start, 6)
+            self.assertEqual(log[('big.sdf',)]['state'], 'completed')
+            self.assert_('progress' not in log[('big.sdf',)])
+            self.assertEqual(log.attempt(('big.sdf',)).resume_point, None)
+
+    def test_persisted(self):
+        #In journal mode, a checkpoint survives a crash mid-attempt
+        log = ProcessLogger(self.name, journal=True).open()
+        attempt = log.attempt(('big.sdf',)).start()
+        attempt.checkpoint(records=5)
+        with ProcessLogger(self.name) as recovered:
+            self.assertEqual(recovered.attempt(('big.sdf',)).resume_point, {'records': 5})
+        log.close()
+
+
+
+class ResourceTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "resource-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def assertMeasured(self, record):
+        for field in ('cpu_user', 'cpu_system', 'maxrss_delta'):
+            self.assert_(isinstance(record[field], (int, long, float)), field)
+        self.assert_(record['cpu_user'] + record['cpu_system'] > 0)
+
+    def test_sequential(self):
+        with ProcessLogger(self.name, resources=True) as log:
+            log.map(busy_processing, [1, 2])
+            with log.attempt(3) as attempt:
+                raise ValueError("Bad input")
+        with ProcessLogger(self.name) as log:
+            self.assertMeasured(log[1])
+            self.assertEqual(log[3]['state'], 'errored')
+            self.assert_('cpu_user' in log[3])
+            self.assert_("Resources of 3 attempts" in log.summary())
+
+    def test_processes(self):
+        with ProcessLogger(self.name, resources=True) as log:
+            log.map(busy_processing, [1, 2, 3], processes=2)
+            for argument in [1, 2, 3]:
+                self.assertMeasured(log[argument])
+
+    def test_off(self):
+        with ProcessLogger(self.name) as log:
+            log.map(busy_processing, [1])
+            self.assert_('cpu_user' not in log[1])
+            self.assert_("Resources of" not in log.summary())
+
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "registry-test-log.json"
+        self.other = "registry-test-log-other.json"
+        _remove_log_files(self.name)
+        _remove_log_files(self.other)
+    def tearDown(self):
+        _remove_log_files(self.name)
+        _remove_log_files(self.other)
+
+    def test_instance_level(self):
+        with ProcessLogger(self.name) as log:
+            with ProcessLogger(self.other) as other:
+                with log.attempt('a') as attempt:
+                    self.assertEqual(log.attempts, [attempt])
+                    self.assertEqual((log.open_count, other.open_count), (1, 0))
+                started = log.attempt('b').start()
+                self.assertEqual(log.open_count, 1)
+                started.finish()
+                self.assertEqual(log.open_count, 0)
+
+    def test_dropped(self):
+        #An attempt dropped without exiting is not kept alive
+        with ProcessLogger(self.name) as log:
+            log.attempt('a').start()
+            gc.collect()
+            self.assertEqual(log.open_count, 0)
+
+    def test_close_attempts(self):
+        with ProcessLogger(self.name) as log:
+            attempts = [log.attempt(name).start() for name in 'abc']
+            self.assertEqual(len(log.close_attempts("Shutting down")), 3)
+            self.assertEqual(log.open_count, 0)
+            self.assertEqual(log['b']['exc_type'], 'AttemptCanceled')
+
+    def test_memory(self):
+        #Every attempt used to be kept, by a list shared across loggers
+        with ProcessLogger(self.name, heartbeat=None) as log:
+            for i in xrange(1000):
+                with log.attempt('same') as attempt:
+                    pass
+                del log['same']     #So it can be attempted again
+            del attempt
+            gc.collect()
+            self.assertEqual(log.open_count, 0)
+            self.assertEqual(len([
+                obj for obj in gc.get_objects() if isinstance(obj, ProcessingAttempt)
+            ]), 0)
+        #Peak RSS is a process-wide high-water mark: measured in a fresh
+        #interpreter, so earlier tests do not hide the growth
+        seconds, megabytes = benchmark.measure(
+            benchmark.repeat_attempts, os.path.abspath(self.other), '100000'
+        )
+        #Well under the ~100 MB that 100000 kept attempts take
+        self.assert_(megabytes < 20, megabytes)
+
+
+
+class HeartbeatTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "heartbeat-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_owner(self):
+        with ProcessLogger(self.name, heartbeat=0.05) as log:
+            with log.attempt('a') as attempt:
+                self.assertEqual(attempt['state'], 'attempting')
+                self.assertEqual(attempt['owner'], [socket.gethostname(), os.getpid()])
+                first = attempt['heartbeat']
+                time.sleep(0.2)
+                self.assert_(attempt['heartbeat'] > first)
+                #Fresh: another attempt on it is refused
+                self.assert_(not log.stale(log['a']))
+                self.assertEqual(log.pending('a'), [])
+            self.assertEqual(log['a']['state'], 'completed')
+
+    def test_only_dispatched(self):
+        #Queued arguments of map(processes=N) are not open, so not beaten
+        with ProcessLogger(self.name, journal=True, heartbeat=0.05) as log:
+            counts = []
+            sampling = threading.Event()
+            def sample():
+                while not sampling.isSet():
+                    counts.append(log.open_count)
+                    time.sleep(0.005)
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            try:
+                log.map(sleeping_processing, range(40), processes=2)
+            finally:
+                sampling.set()
+                sampler.join()
+            self.assert_(0 < max(counts) < 20, max(counts))
+            #Not counted toward checkpoint_every
+            log.checkpoint_every, log.journal = 1, False
+            attempt = log.attempt('a').start()
+            commits = log._commits_since_flush
+            log.beat()
+            self.assertEqual(log._commits_since_flush, commits)
+            attempt.finish()
+            log.journal = True
+
+    def test_reclaim(self):
+        dead = multiprocessing.Process(target=time.sleep, args=(0, ))
+        dead.start()
+        dead.join()
+        with ProcessLogger(self.name) as log:
+            #Crashed on this host, crashed elsewhere, and from before heartbeats
+            log['dead'] = {'state':'attempting', 'owner':[socket.gethostname(), dead.pid],
+                           'heartbeat':time.time()}
+            log['silent'] = {'state':'attempting', 'owner':['elsewhere', 1],
+                             'heartbeat':time.time() - 3600}
+            log['legacy'] = {'state':'running'}
+            log['alive'] = {'state':'attempting', 'owner':['elsewhere', 1],
+                            'heartbeat':time.time()}
+        with ProcessLogger(self.name) as log:
+            attempts = log.map(odd_failing_processing, ['dead', 'silent', 'legacy', 'alive'])
+            self.assertEqual(
+                [attempt.arguments for attempt in attempts], ['dead', 'silent', 'legacy']
+            )
+            self.assertEqual(log['legacy']['state'], 'completed')
+            self.assertEqual(log['alive']['state'], 'attempting')
+            #Entering directly: a stale record is reclaimed, a fresh one refused
+            log['silent'] = {'state':'attempting', 'owner':['elsewhere', 1], 'heartbeat':0}
+            with log.attempt('silent'):
+                pass
+            self.assertEqual(log['silent']['reclaimed_from'], ['elsewhere', 1])
+            self.assertEqual(log['silent']['state'], 'completed')
+            #Held only while open
+            self.assert_('owner' not in log['silent'] and 'heartbeat' not in log['silent'])
+            def enter_alive():
+                with log.attempt('alive'):
+                    pass
+            self.assertRaises(AttemptAlreadyInProgress, enter_alive)
+            self.assertEqual(log['alive']['owner'], ['elsewhere', 1])
+
+    def test_abandon(self):
+        with ProcessLogger(self.name) as log:
+            log['a'] = {'state':'errored'}
+            log.attempt('a').start().abandon()
+            self.assertEqual(log['a'], {'state':'errored'})
+
+
+
+class NodeTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "node-test-log.json"
+        _remove_log_files(self.name)
+    def tearDown(self):
+        _remove_log_files(self.name)
+
+    def test_nodes(self):
+        #Several nodes on one machine: each argument is processed once
+        nodes = [
+            multiprocessing.Process(target=run_node, args=(self.name, 'node-{0}'.format(i)))
+            for i in range(3)
+        ]
+        for node in nodes:
+            node.start()
+        for node in nodes:
+            node.join()
+        with open(self.name + '.processed') as fi:
+            processed = sorted(int(line) for line in fi)
+        self.assertEqual(processed, range(20))
+        self.assertEqual(len(os.listdir(self.name + '.leases')), 20)
+        #Opened without node: node journals are folded in
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(sorted(log.keys_in_state('completed')), range(20))
+        self.assertEqual(os.listdir('.').count(self.name), 1)
+        side_files = [name for name in os.listdir('.') if name.startswith(self.name + '.')]
+        self.assertEqual(side_files, [self.name + '.processed'])
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(len(log), 20)
+
+    def test_claims_as_workers_free(self):
+        #0 runs until every other argument is processed: arguments are
+        #claimed as workers free up, not a round at a time
+        for options in [dict(processes=2), dict(processes=2, timeout=30), dict(threads=2)]:
+            _remove_log_files(self.name)
+            with ProcessLogger(self.name, node='only') as log:
+                attempts = log.map(waiting_processing, range(12), **options)
+                self.assertEqual(
+                    [attempt['state'] for attempt in attempts], ['completed'] * 12
+                )
+                self.assertEqual(log.leases.held, {})
+            self.assertEqual(len(os.listdir(self.name + '.leases')), 12)
+
+    def test_skips_completed(self):
+        with ProcessLogger(self.name, node='first') as log:
+            log.map(odd_failing_processing, range(4))
+        #A node which read the log before 'first' finished
+        with ProcessLogger(self.name, node='second') as log:
+            log.data.clear()
+            attempts = log.map(odd_failing_processing, range(4))
+            self.assertEqual([attempt.arguments for attempt in attempts], [1, 3])
+            self.assertRaises(RuntimeError, log.compact)
+        self.assert_(os.path.exists(self.name + '.node.first'))
+        self.assert_(os.path.exists(self.name + '.node.second'))
+
+    def test_fold_waits_for_running_nodes(self):
+        with ProcessLogger(self.name, node='stopped') as log:
+            log.map(odd_failing_processing, [0])
+        running = ProcessLogger(self.name, node='running').open()
+        try:
+            running.map(odd_failing_processing, [2])
+            with ProcessLogger(self.name) as log:
+                self.assertEqual(sorted(log.keys_in_state('completed')), [0, 2])
+            #Only the stopped node's journal is folded
+            self.assert_(not os.path.exists(self.name + '.node.stopped'))
+            self.assert_(os.path.exists(self.name + '.node.running'))
+            self.assert_(os.path.isdir(self.name + '.leases'))
+            running.map(odd_failing_processing, [4])
+        finally:
+            running.close()
+        with ProcessLogger(self.name) as log:
+            self.assertEqual(sorted(log.keys_in_state('completed')), [0, 2, 4])
+        self.assert_(not os.path.exists(self.name + '.node.running'))
+        self.assert_(not os.path.exists(self.name + '.leases'))
+
+    def test_lost_lease(self):
+        with ProcessLogger(self.name, node='first') as log:
+            self.assert_(log.leases.acquire('a'))
+            with log.attempt('a') as attempt:
+                #Taken over by another node
+                with open(log.leases.path_of('a'), 'w') as fi:
+                    fi.write(json.dumps({'owner': 'second', 'state': 'attempting'}))
+                log.leases.renew()
+                self.assert_(attempt.canceled)
+                attempt.checkpoint(records=10)
+            self.assertEqual(log.open_count, 0)
+        with ProcessLogger(self.name, node='second') as log:
+            #Nothing of the discarded attempt was persisted
+            self.assert_('a' not in log)
+
+    def test_texts_per_node(self):
+        #Nodes never append to a shared file: each has texts of its own
+        first = ProcessLogger(self.name, node='first', dedupe=['exc_value']).open()
+        try:
+            first.map(odd_failing_processing, [1])
+            with ProcessLogger(self.name, node='second', dedupe=['exc_value']) as log:
+                log.map(odd_failing_processing, [3])
+                self.assert_(os.path.exists(self.name + '.texts.second'))
+                self.assert_(not os.path.exists(self.name + '.texts'))
+                #Reads the texts of the running node
+                self.assertEqual(log.resolve(log[1])['exc_value'], 'Odd argument: 1')
+            #Only the stopped node's texts are folded
+            with ProcessLogger(self.name) as log:
+                self.assertEqual(log.resolve(log[3])['exc_value'], 'Odd argument: 3')
+            self.assert_(os.path.exists(self.name + '.texts'))
+            self.assert_(os.path.exists(self.name + '.texts.first'))
+            self.assert_(not os.path.exists(self.name + '.texts.second'))
+        finally:
+            first.close()
+        with ProcessLogger(self.name) as log:
+            for key in (1, 3):
+                self.assertEqual(
+                    log.resolve(log[key])['exc_value'], 'Odd argument: {0}'.format(key)
+                )
+        self.assert_(not os.path.exists(self.name + '.texts.first'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, ProcessLogger, self.name, node='a/b')
+        self.assertRaises(ValueError, ProcessLogger, self.name, node='a', delta=True)
+
 
 
 class ProcessAttemptTests(unittest.TestCase):
@@ -223,6 +1338,18 @@ class ProcessLoggerTests(unittest.TestCase):
 #------------------------------------------------------------------------------
 #    Local Utility Functions
 #------------------------------------------------------------------------------
+def _remove_log_files(logpath):
+    """Delete a log-file, and any side-files written next to it."""
+    directory = os.path.dirname(os.path.abspath(logpath))
+    prefix = os.path.basename(logpath)
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
 def front(iterable, count=1):
     #Basically itertools.islice(iterable, stop)
     iterator = iter(iterable)
@@ -230,6 +1357,105 @@ def front(iterable, count=1):
         yield iterator.next()
 
 
+def odd_failing_processing(number):
+    if isinstance(number, int) and number % 2:
+        raise ValueError("Odd argument: {0}".format(number))
+
+FLAKY_MARKER = "flaky-test-marker"
+def flaky_processing(argument):
+    """Fails the first 'argument' times it is called with argument."""
+    if argument == 'key':
+        raise KeyError(argument)
+    path = "{0}-{1}".format(FLAKY_MARKER, argument)
+    failures = os.path.getsize(path) if os.path.exists(path) else 0
+    if failures < argument:
+        with open(path, 'a') as fi:
+            fi.write('x')
+        raise RuntimeError("Failure {0} of {1}".format(failures + 1, argument))
+
+ORDER = []
+def ordered_processing(argument):
+    ORDER.append(argument)
+
+def sleeping_processing(number):
+    time.sleep(0.1)
+    odd_failing_processing(number)
+
+def non_suppressed_processing(number):
+    if number == 3:
+        raise NonSuppressedError("Stop at 3")
+
+def slow_then_fatal_processing(number):
+    if number == 0:
+        time.sleep(4)
+    elif number == 1:
+        raise NonSuppressedError("Stop at 1")
+    else:
+        time.sleep(0.05)
+
+def hanging_processing(number):
+    if number == 2:
+        time.sleep(60)
+    elif number == 3:
+        raise ValueError("Not hanging")
+
+def exiting_processing(number):
+    if number == 1:
+        os._exit(3)
+
+def straggling_processing(number):
+    #The first run of 5 hangs - a duplicate of it finishes quickly
+    marker = "speculation-test-log.json.straggler"
+    if number == 5 and not os.path.exists(marker):
+        open(marker, 'w').close()
+        time.sleep(60)
+    time.sleep(0.05)
+
+def run_node(logpath, node):
+    with ProcessLogger(logpath, node=node) as log:
+        log.map(recording_processing, range(20), processes=2)
+
+def recording_processing(number):
+    time.sleep(0.01)
+    with open("node-test-log.json.processed", 'a') as fi:
+        fi.write("{0}\n".format(number))
+
+def waiting_processing(number):
+    #0 returns once 1 to 11 are processed
+    if number != 0:
+        return recording_processing(number)
+    path = "node-test-log.json.processed"
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        if os.path.exists(path) and len(open(path).readlines()) == 11:
+            return
+        time.sleep(0.02)
+    raise RuntimeError("Arguments after 0 were held back")
+
+def slow_or_fatal_processing(number):
+    if number == 0:
+        time.sleep(0.3)
+    else:
+        time.sleep(0.05)
+        raise NonSuppressedError("Database gone")
+
+FATAL_STARTED = []
+def fatal_at_one_processing(number):
+    FATAL_STARTED.append(number)
+    if number == 1:
+        raise NonSuppressedError("Database gone")
+    time.sleep(0.1)
+
+class UnpicklableError(Exception):
+    def __init__(self, first, second):
+        Exception.__init__(self, first)
+
+def busy_processing(number):
+    return sum(value * value for value in xrange(200000 * number))
+
+def unpicklable_processing(argument):
+    raise UnpicklableError('first', 'second')
+
 def dummy_processing(filepath):
     """Unit-test processing mock function.
     Reads the first few lines from the file
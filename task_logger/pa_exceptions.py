@@ -32,4 +32,8 @@ class NonSuppressedError(StopProcessingAttempt):
             return Exception.__str__(self)
 
 class AttemptCanceled(StopProcessingAttempt):
-    pass
\ No newline at end of file
+    pass
+
+class AttemptTimedOut(StopProcessingAttempt):
+    """Processing ran past the attempt's timeout. Recorded as an error,
+    so it is retried, and dispatched again by later runs."""
@@ -0,0 +1,74 @@
+"""
+Retry policies for ProcessLogger.map(retry=...).
+
+Errored attempts are re-queued within the same run, after an exponential
+backoff with jitter - so transient errors (ex. a dropped MySQL connection,
+or a stale NFS handle) are absorbed without rerunning the whole dataset.
+
+    policies = {
+        Exception: RetryPolicy(max_attempts=3),
+        IOError: RetryPolicy(max_attempts=8, delay=5.0),
+        ValueError: None,       #never retried
+    }
+    with ProcessLogger('import-sdf-log.json') as log:
+        log.map(import_sdf, filepaths, retry=policies)
+"""
+import collections
+import random
+#----
+from local_packages import rich_core
+
+
+class RetryPolicy(object):
+    """
+    max_attempts: most attempts per argument, counting the first.
+    delay: seconds before the first retry.
+    backoff: each later retry waits this many times longer.
+    max_delay: longest wait, in seconds, before jitter.
+    jitter: fraction of each wait drawn at random, so retries of many
+        arguments which failed together do not all hit a server at once.
+    """
+    def __init__(self, max_attempts=3, delay=1.0, backoff=2.0, max_delay=300.0, jitter=0.5):
+        rich_core.AssertKlass(max_attempts, int, name='max_attempts')
+        if not 0.0 <= jitter <= 1.0:
+            raise ValueError("jitter should be between 0 and 1, not {0}".format(jitter))
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def allows(self, attempts):
+        """True if another attempt may follow 'attempts' attempts."""
+        return attempts < self.max_attempts
+
+    def wait(self, attempts):
+        """Seconds to wait after 'attempts' attempts have failed."""
+        wait = min(self.max_delay, self.delay * self.backoff ** (attempts - 1))
+        return wait * random.uniform(1.0 - self.jitter, 1.0)
+
+    def __repr__(self):
+        return str.format(
+            "RetryPolicy(max_attempts={0}, delay={1}, backoff={2}, max_delay={3}, jitter={4})",
+            self.max_attempts, self.delay, self.backoff, self.max_delay, self.jitter
+        )
+
+
+def policies_of(retry):
+    """Normalize the 'retry' argument of ProcessLogger.map():
+    a RetryPolicy (for every exception), or a Mapping of
+    {exception type: RetryPolicy or None}."""
+    if isinstance(retry, RetryPolicy):
+        return {Exception: retry}
+    rich_core.AssertKlass(retry, collections.Mapping, name='retry')
+    for exc_type, policy in retry.items():
+        rich_core.AssertKlass(policy, (RetryPolicy, type(None)), name='policy')
+    return dict(retry)
+
+def policy_for(policies, exc_type):
+    """Policy for the most specific class of exc_type in policies,
+    or None if it should not be retried."""
+    for klass in getattr(exc_type, '__mro__', ()):
+        if klass in policies:
+            return policies[klass]
+    return None
@@ -0,0 +1,39 @@
+import unittest
+#-----
+from retry import RetryPolicy, policies_of, policy_for
+
+
+
+
+class RetryPolicyTests(unittest.TestCase):
+    def test_wait(self):
+        policy = RetryPolicy(delay=1.0, backoff=2.0, max_delay=5.0, jitter=0.5)
+        for attempts, longest in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 5.0), (10, 5.0)]:
+            for _ in range(20):
+                wait = policy.wait(attempts)
+                self.assert_(longest * 0.5 <= wait <= longest, (attempts, wait))
+        self.assertEqual(RetryPolicy(delay=3.0, jitter=0.0).wait(1), 3.0)
+
+    def test_allows(self):
+        policy = RetryPolicy(max_attempts=2)
+        self.assert_(policy.allows(1))
+        self.assert_(not policy.allows(2))
+
+    def test_policy_for(self):
+        default, io = RetryPolicy(), RetryPolicy(max_attempts=8)
+        policies = policies_of({Exception: default, EnvironmentError: io, ValueError: None})
+        self.assert_(policy_for(policies, RuntimeError) is default)
+        self.assert_(policy_for(policies, IOError) is io)
+        self.assert_(policy_for(policies, UnicodeDecodeError) is None)
+        self.assert_(policy_for(policies, KeyboardInterrupt) is None)
+        self.assert_(policy_for(policies_of(io), KeyError) is io)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, RetryPolicy, jitter=2.0)
+        self.assertRaises(Exception, policies_of, {Exception: 3})
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
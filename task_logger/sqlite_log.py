@@ -0,0 +1,363 @@
+"""
+SQLite storage for the progress log.
+
+SQLiteProgressLog() honors the same MutableMapping contract as
+JSONProgressLog(), but keeps records as rows in a stdlib sqlite3 database.
+'state', 'started' and 'elapsed' are indexed columns, and the remainder of
+each record is stored as a JSON blob. So questions like 'which attempts
+errored?' are index lookups, and records are upserted one row at a time
+when an attempt exits - instead of rewriting the whole file.
+
+    with SQLiteProcessLogger('import-sdf-log.sqlite') as log:
+        for filepath in filepaths:
+            with log.attempt(filepath) as attempt:
+                ...
+        errored = list(log.keys_in_state('errored'))
+"""
+import collections
+import hashlib
+import json
+import sqlite3
+#----
+from local_packages import rich_core
+from local_packages import rich_property
+#---- Local Modules
+from logger import JSONProgressLog, ProcessLogger, States, SyncLevels
+from log_codecs import seq2tuple, _convert_to_string
+
+
+INDEXED_FIELDS = ('state', 'started', 'elapsed')
+# Most records SQLiteProgressLog keeps cached, before writing back and
+# dropping them
+CACHE_SIZE = 10000
+# PRAGMA synchronous setting corresponding to each of SyncLevels
+SYNCHRONOUS = {'none': 'OFF', 'file': 'NORMAL', 'directory': 'FULL'}
+
+
+class SQLiteProgressLog(JSONProgressLog):
+    """
+    ~ JSONProgressLog()
+    + (1) records stored as rows of a sqlite3 database at self.logpath
+    + (2) records read during a session are cached, so ProcessingAttempt()
+        can modify them in place. Modified records - set, or changed in
+        place - are upserted on commit(key) (ie. at attempt exit), on
+        flush() and close(), and when the cache reaches CACHE_SIZE
+        records, and is emptied. So change a record soon after reading
+        it: a dict read before the cache was emptied is no longer tracked.
+    + (3) values which are not dicts are stored whole, in the JSON blob.
+
+    .data is a live view of the records: reading and setting through it
+    read and set rows. read() materializes every record into a dict.
+    The connection is shared by threads (ex. of map(threads=N)), so every
+    use of it holds self.lock.
+    """
+    _connection = None
+
+    def open(self):
+        self._connection = sqlite3.connect(self.logpath, check_same_thread=False)
+        self._connection.execute(
+            "PRAGMA synchronous = " + SYNCHRONOUS[self.fsync]
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS log ("
+            " key TEXT PRIMARY KEY, state TEXT, started TEXT, elapsed TEXT,"
+            " record BLOB)"
+        )
+        for field in INDEXED_FIELDS:
+            self._connection.execute(str.format(
+                "CREATE INDEX IF NOT EXISTS log_{0} ON log ({0})", field
+            ))
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS texts (id TEXT PRIMARY KEY, text TEXT)"
+        )
+        self._connection.commit()
+        self._cache = {}    #key -> (record, _fingerprint() as last read or upserted)
+        self._dirty = set()
+        self.opened = True
+        return self
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self._connection.close()
+            self._connection = None
+            self._cache = {}
+        self.opened = False
+        return self
+
+    def read(self):
+        """Return dict of all records in the database."""
+        self.flush()
+        return dict(
+            (_decode_key(key), _decode_row(state, started, elapsed, record))
+            for key, state, started, elapsed, record in self._query(
+                "SELECT key, state, started, elapsed, record FROM log"
+            )
+        )
+
+    def write(self, data=None):
+        """Upsert every record in data. Does not remove other rows."""
+        if data == None:
+            data = self.data
+        rich_core.AssertKlass(data, collections.Mapping, name='data')
+        self._upsert(data.items())
+        return self
+
+    def commit(self, key):
+        """Upsert the row for a single key. Called by ProcessingAttempt()
+        on __exit__."""
+        with self.lock:
+            self._dirty.discard(key)
+            if key in self._cache:
+                self._upsert([(key, self._cache[key][0])])
+        return self
+
+    def flush(self):
+        """Upsert the records changed since they were read, or last upserted."""
+        self._write_back()
+        return self
+
+    def compact(self):
+        """Reclaim space left by deleted and replaced rows."""
+        self._write_back()
+        self._query("VACUUM")
+        return self
+
+    #-------- Index lookups
+    def keys_in_state(self, state):
+        """Yield keys of records whose 'state' is in the group of 'state'.
+        ex. log.keys_in_state('errored')"""
+        self._write_back()
+        for (key, ) in self._query(
+            "SELECT key FROM log WHERE state = ?", (States[state].name, )
+        ):
+            yield _decode_key(key)
+
+    def state_index(self):
+        """Return {key: state} for every record, in a single query."""
+        self._write_back()
+        return dict(
+            (_decode_key(key), None if state == None else str(state))
+            for key, state in self._query("SELECT key, state FROM log")
+        )
+
+    def state_of(self, key, default=None):
+        """Return the 'state' of the record for key, without loading
+        the rest of the record."""
+        with self.lock:
+            if key in self._cache:
+                record = self._cache[key][0]
+                return record.get('state', default) if isinstance(record, dict) else default
+            rows = self._query("SELECT state FROM log WHERE key = ?", (_encode_key(key), ))
+        if not rows or rows[0][0] == None:
+            return default
+        return str(rows[0][0])
+
+    #-------- Deduplicated text
+    def store_text(self, text):
+        """Store text once in the 'texts' table, and return its hash."""
+        digest = hashlib.sha1(text).hexdigest()
+        self._query("INSERT OR IGNORE INTO texts (id, text) VALUES (?, ?)", (digest, text))
+        return digest
+
+    def text_of(self, digest):
+        rows = self._query("SELECT text FROM texts WHERE id = ?", (digest, ))
+        if not rows:
+            raise KeyError(digest)
+        return str(rows[0][0])
+
+    #-------- Internal
+    def _query(self, sql, parameters=()):
+        """Rows of a statement, fetched while holding self.lock."""
+        with self.lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _upsert(self, items):
+        items = list(items)
+        with self.lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO log (key, state, started, elapsed, record)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (_encode_row(key, record) for key, record in items)
+            )
+            self._connection.commit()
+            for key, record in items:
+                if key in self._cache:
+                    self._cache[key] = (record, _fingerprint(record))
+
+    def _write_back(self):
+        """Upsert the cached records which were set, or changed in place."""
+        with self.lock:
+            if self._connection == None:
+                return
+            changed = [
+                (key, record) for key, (record, fingerprint) in self._cache.items()
+                if key in self._dirty or _fingerprint(record) != fingerprint
+            ]
+            if changed:
+                self._upsert(changed)
+            self._dirty.clear()
+
+    def _cache_record(self, key, record):
+        """Cache record - first emptying the cache, if it is full."""
+        if len(self._cache) >= CACHE_SIZE:
+            self._write_back()
+            self._cache.clear()
+        self._cache[key] = (record, _fingerprint(record))
+
+    #---- Overriding JSONProgressLog
+    @rich_property.VProperty
+    class data(object):
+        """(MutableMapping). Live view of the records - see _Records().
+        Setting data replaces the records of the same keys."""
+        def getter(self):
+            if self._connection == None:
+                return None
+            return _Records(self)
+        def setter(self, data):
+            if data != None:
+                for key, value in data.items():
+                    self[key] = value
+        def validator(self, data):
+            rich_core.AssertKlass(data, (collections.Mapping, type(None)), name='data')
+            return data
+
+    def __getitem__(self, key):
+        with self.lock:
+            if self._connection == None:
+                raise KeyError(
+                    "'{0}' not found, likely because log file is not open.".format(key))
+            if key not in self._cache:
+                rows = self._query(
+                    "SELECT state, started, elapsed, record FROM log WHERE key = ?",
+                    (_encode_key(key), )
+                )
+                if not rows:
+                    raise KeyError(key)
+                self._cache_record(key, _decode_row(*rows[0]))
+            return self._cache[key][0]
+    def __setitem__(self, key, value):
+        with self.lock:
+            if self._connection == None:
+                raise KeyError(
+                    "'{0}' not found likely because log file is not open.".format(key))
+            self._cache_record(key, value)
+            self._dirty.add(key)
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self._cache.pop(key, None)
+            self._dirty.discard(key)
+            self._query("DELETE FROM log WHERE key = ?", (_encode_key(key), ))
+            self._connection.commit()
+    def __contains__(self, key):
+        with self.lock:
+            if self._connection == None:
+                return False
+            if key in self._cache:
+                return True
+            return len(self._query(
+                "SELECT 1 FROM log WHERE key = ?", (_encode_key(key), )
+            )) > 0
+    def __iter__(self):
+        if self._connection == None:
+            return
+        self._write_back()
+        for (key, ) in self._query("SELECT key FROM log"):
+            yield _decode_key(key)
+    def __len__(self):
+        if self._connection == None:
+            return 0
+        self._write_back()
+        return self._query("SELECT COUNT(*) FROM log")[0][0]
+
+
+class _Records(collections.MutableMapping):
+    """SQLiteProgressLog().data: a live view of its records, read and
+    set through the log's own Mapping methods."""
+    def __init__(self, log):
+        self.log = log
+    def __getitem__(self, key):
+        return self.log[key]
+    def __setitem__(self, key, value):
+        self.log[key] = value
+    def __delitem__(self, key):
+        del self.log[key]
+    def __contains__(self, key):
+        return key in self.log
+    def __iter__(self):
+        return iter(self.log)
+    def __len__(self):
+        return len(self.log)
+
+
+class SQLiteProcessLogger(SQLiteProgressLog, ProcessLogger):
+    """ProcessLogger(), storing its records with SQLiteProgressLog().
+    write_behind is not supported: rows are already upserted one at a time,
+    each in a short transaction on the shared connection.
+    Nor is node: sqlite's file locking is unreliable on network filesystems."""
+    def __init__(self, logpath, data=None, **options):
+        if options.get('write_behind'):
+            raise ValueError("SQLiteProcessLogger does not support write_behind.")
+        if options.get('node'):
+            raise ValueError("SQLiteProcessLogger does not support node.")
+        ProcessLogger.__init__(self, logpath, data=data, **options)
+
+    #SQLiteProgressLog.open/close come first in the MRO: the attempt
+    #heartbeat of ProcessLogger is started and stopped here
+    def open(self):
+        SQLiteProgressLog.open(self)
+        self._start_heartbeat()
+        return self
+    def close(self):
+        try:
+            self._stop_heartbeat()
+        finally:
+            SQLiteProgressLog.close(self)
+        return self
+    def beat(self):
+        """ProcessLogger.beat(), with the refreshed rows upserted at once -
+        so other processes see the attempts are still running."""
+        ProcessLogger.beat(self)
+        self.flush()
+
+
+
+
+#==============================================================================
+#    Local Utility Functions
+#==============================================================================
+def _encode_key(key):
+    return json.dumps(key)
+
+def _decode_key(text):
+    return seq2tuple(_convert_to_string(json.loads(text)))
+
+def _encode_row(key, record):
+    """Row for a record. A value which is not a dict has no indexed
+    fields, and is stored whole in the blob."""
+    if not isinstance(record, collections.Mapping):
+        return (_encode_key(key), None, None, None, json.dumps(record))
+    rest = dict(
+        (field, value) for field, value in record.items()
+        if field not in INDEXED_FIELDS
+    )
+    return (
+        (_encode_key(key), )
+        + tuple(record.get(field) for field in INDEXED_FIELDS)
+        + (json.dumps(rest), )
+    )
+
+def _decode_row(state, started, elapsed, record):
+    data = _convert_to_string(json.loads(record))
+    if not isinstance(data, dict):
+        return data
+    for field, value in zip(INDEXED_FIELDS, (state, started, elapsed)):
+        if value != None:
+            data[field] = str(value)
+    return data
+
+def _fingerprint(record):
+    """Text of record, to tell if it was changed in place."""
+    return json.dumps(record, sort_keys=True)
@@ -0,0 +1,153 @@
+import unittest
+import os
+import time
+#-----
+from logger import ProcessingAttempt
+import sqlite_log
+from sqlite_log import SQLiteProgressLog, SQLiteProcessLogger
+
+
+
+
+class SQLiteProgressLogTests(unittest.TestCase):
+    def setUp(self):
+        self.name = "sqlite-test-log.sqlite"
+        if os.path.exists(self.name):
+            os.remove(self.name)
+    def tearDown(self):
+        if os.path.exists(self.name):
+            os.remove(self.name)
+
+    def test_insert(self):
+        with SQLiteProgressLog(self.name) as log:
+            log['testdata'] = {'state':'new', 'results':['foo','bar']}
+        with SQLiteProgressLog(self.name) as otherlog:
+            self.assertEquals(otherlog['testdata']['results'], ['foo','bar'])
+            self.assertEquals(otherlog['testdata']['state'], 'new')
+
+    def test_remove(self):
+        with SQLiteProgressLog(self.name) as log:
+            log['testdata'] = {'state':'new'}
+            log['moredata'] = {'state':'new'}
+        with SQLiteProgressLog(self.name) as otherlog:
+            self.assert_('moredata' in otherlog)
+            del otherlog['moredata']
+        with SQLiteProgressLog(self.name) as mylog:
+            self.assert_('testdata' in mylog)
+            self.assert_('moredata' not in mylog)
+            self.assertEqual(len(mylog), 1)
+
+    def test_attempt_upserts_on_exit(self):
+        with SQLiteProgressLog(self.name) as log:
+            with ProcessingAttempt(log, ('a.sdf',)) as attempt:
+                attempt['results'] = 'foo'
+            with ProcessingAttempt(log, ('b.sdf',)) as attempt:
+                raise KeyError('b')
+            #Visible to a second connection before close()
+            with SQLiteProgressLog(self.name) as otherlog:
+                self.assertEqual(otherlog.state_of(('a.sdf',)), 'completed')
+                self.assertEqual(otherlog[('a.sdf',)]['results'], 'foo')
+
+    def test_keys_in_state(self):
+        with SQLiteProcessLogger(self.name) as log:
+            for name in ['a.sdf', 'b.sdf', 'c.sdf']:
+                with log.attempt((name,)) as attempt:
+                    if name != 'a.sdf':
+                        raise RuntimeError(name)
+            self.assertEqual(
+                sorted(log.keys_in_state('error')),
+                [('b.sdf',), ('c.sdf',)]
+            )
+            self.assertEqual(list(log.keys_in_state('completed')), [('a.sdf',)])
+            self.assertEqual(log.state_of(('d.sdf',)), None)
+
+    def test_pending(self):
+        with SQLiteProcessLogger(self.name) as log:
+            log[('a.sdf',)] = {'state':'completed'}
+            log[('b.sdf',)] = {'state':'errored'}
+            self.assertEqual(log.state_index(),
+                {('a.sdf',): 'completed', ('b.sdf',): 'errored'})
+            pending = log.pending([('a.sdf',), ('b.sdf',), ('c.sdf',)])
+            self.assertEqual(pending, [('b.sdf',), ('c.sdf',)])
+            self.assertEqual(log.pending_counts['skipped'], 1)
+
+    def test_threads(self):
+        with SQLiteProcessLogger(self.name) as log:
+            log.map(_slow_processing, ['{0}.sdf'.format(i) for i in range(6)], threads=3)
+        with SQLiteProcessLogger(self.name) as log:
+            self.assertEqual(len(list(log.keys_in_state('completed'))), 6)
+
+    def test_dedupe(self):
+        with SQLiteProcessLogger(self.name, dedupe=['exc_traceback']) as log:
+            for name in ['a.sdf', 'b.sdf']:
+                with log.attempt((name,)) as attempt:
+                    raise RuntimeError("Same error every time")
+        with SQLiteProcessLogger(self.name) as log:
+            record = log[('b.sdf',)]
+            self.assert_('exc_traceback' not in record)
+            self.assert_('test_dedupe' in log.resolve(record)['exc_traceback'])
+            self.assert_('RuntimeError' in log.summary())
+
+    def test_data_view(self):
+        with SQLiteProgressLog(self.name) as log:
+            log.data['a'] = {'state':'new'}
+            self.assert_('a' in log.data)
+            self.assertEqual(dict(log.data), {'a': {'state':'new'}})
+        with SQLiteProgressLog(self.name) as log:
+            self.assertEqual(log['a']['state'], 'new')
+
+    def test_not_dicts(self):
+        with SQLiteProgressLog(self.name) as log:
+            log['a'] = [1, 2]
+            log['b'] = 'text'
+        with SQLiteProgressLog(self.name) as log:
+            self.assertEqual(log['a'], [1, 2])
+            self.assertEqual(log['b'], 'text')
+            self.assertEqual(log.state_of('a'), None)
+
+    def test_changed_in_place(self):
+        with SQLiteProgressLog(self.name) as log:
+            log['a'] = {'state':'new', 'results':[]}
+        with SQLiteProgressLog(self.name) as log:
+            log['a']['results'].append('foo')
+        with SQLiteProgressLog(self.name) as log:
+            self.assertEqual(log['a']['results'], ['foo'])
+
+    def test_cache_bounded(self):
+        size = sqlite_log.CACHE_SIZE
+        sqlite_log.CACHE_SIZE = 5
+        try:
+            with SQLiteProgressLog(self.name) as log:
+                for i in range(20):
+                    log[str(i)] = {'state':'new'}
+                    self.assert_(len(log._cache) <= 5)
+            with SQLiteProgressLog(self.name) as log:
+                self.assertEqual(len(log), 20)
+        finally:
+            sqlite_log.CACHE_SIZE = size
+
+    def test_closed(self):
+        log = SQLiteProgressLog(self.name).open()
+        log['a'] = {'state':'new'}
+        log.close()
+        self.assert_('a' not in log)
+        self.assertEqual(log.data, None)
+
+    def test_live_owner(self):
+        #The heartbeat keeps a running attempt from looking stale
+        with SQLiteProcessLogger(self.name, heartbeat=0.05, stale_after=0.3) as log:
+            self.assert_(log._heartbeat != None)
+            with log.attempt('x') as attempt:
+                time.sleep(0.6)
+                with SQLiteProcessLogger(self.name, heartbeat=None) as other:
+                    self.assertEqual(other.pending(['x']), [])
+            self.assertEqual(log.state_of('x'), 'completed')
+        self.assertEqual(log._heartbeat, None)
+
+
+def _slow_processing(filepath):
+    time.sleep(0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()